@@ -0,0 +1,281 @@
+"""
+Handles Azure Graph API requests on asyncio event loop
+"""
+import asyncio
+import json
+import logging
+import aiohttp
+from . import contact_validator
+from . import exceptions
+from . import rate_control
+from .azure import Azure, TokenCache
+
+class AsyncAzure:
+    """
+    Handles Graph API requests with coroutines sharing one connection pool
+    Shares the token, the settings and the cached groups with the given Azure instance
+    The pages of a group follow @odata.nextLink one after another; groups are fetched at the same time
+    Must be opened and closed on the event loop that sends the requests
+    """
+    DEFAULT_MAX_CONCURRENCY = 16
+
+    def __init__(self, azure):
+        self.azure = azure
+        self.max_concurrency = AsyncAzure.DEFAULT_MAX_CONCURRENCY
+        self.rate_control = rate_control.RateControl('ASYNC_AZURE', self.max_concurrency)
+        self.session = None
+        self.token_lock = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Sets the maximum number of requests in flight at the same time; must be called before open
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_control = rate_control.RateControl('ASYNC_AZURE', max_concurrency, self.rate_control.max_retries)
+
+    def set_max_retries(self, max_retries):
+        """
+        Sets the number of times a throttled request is retried
+        """
+        self.rate_control.set_max_retries(max_retries)
+
+    def set_deadline(self, deadline):
+        """
+        Sets epoch seconds after which throttled requests are not retried
+        """
+        self.rate_control.set_deadline(deadline)
+
+    def get_rate_report(self):
+        """
+        Returns the counters of requests, throttled responses and retries
+        """
+        return self.rate_control.report()
+
+    async def open(self):
+        """
+        Gets the token if Azure is not set up yet and creates the session shared by all the requests
+        Creates the lock and the admission of requests on the running event loop
+        """
+        if not self.azure.token:
+            await asyncio.get_running_loop().run_in_executor(None, self.azure.setup)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.azure.timeout[0], sock_read=self.azure.timeout[1])
+        headers = {'Accept': 'application/json',
+                   'Content-Type': 'application/json',
+                   'return-client-request-id': 'true'}
+        self.session = aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
+        self.rate_control.open_async()
+        self.token_lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        """
+        Closes the session and its connections
+        Drops the lock and the admission of requests bound to the event loop
+        """
+        if self.session:
+            await self.session.close()
+            self.session = None
+        self.rate_control.close_async()
+        self.token_lock = None
+
+    async def _get_access_token(self):
+        """
+        Returns the access token shared with Azure; refreshes it if it expires soon
+        """
+        if TokenCache.is_valid(self.azure.token, Azure.TOKEN_REFRESH_MARGIN):
+            return self.azure.token['accessToken']
+        if self.token_lock is None:
+            # Not opened
+            self.token_lock = asyncio.Lock()
+        async with self.token_lock:
+            # adal blocks; the token is refreshed on a worker thread
+            return await asyncio.get_running_loop().run_in_executor(None, self.azure.get_access_token)
+
+    async def _send(self, method, url, caller, data=None, headers=None):
+        """
+        Sends HTTP request and returns the JSON response
+        Throttled requests are retried; raises AzureException unless the status is 200
+        """
+        token = await self._get_access_token()
+        kwargs = {'headers': dict(headers or {}, Authorization='Bearer ' + token)}
+        if data is not None:
+            kwargs['json'] = data
+        family = rate_control.endpoint_family(url, Azure.API_BASE + 'v1.0/')
+        try:
+            status, _, body = await self.rate_control.send_async(family, lambda: self._request(method, url, kwargs))
+            res = json.loads(body) if body else None
+        except Exception as err:
+            logging.error(err)
+            raise exceptions.AzureException() from err
+        if status != 200:
+            msg = 'ASYNC_AZURE.' + caller.upper() + ': Unexpected Response'
+            logging.error(msg)
+            logging.error(status)
+            logging.error(res)
+            raise exceptions.AzureException(msg)
+        return res
+
+    async def _request(self, method, url, kwargs):
+        """
+        Sends HTTP request and returns the status, the headers and the body
+        """
+        async with self.session.request(method, url, **kwargs) as resp:
+            return resp.status, resp.headers, await resp.text()
+
+    async def get_group_members(self, group_id, skip_token=None):
+        """
+        Fetches a page of Azure AD Group Members
+        """
+        if not group_id:
+            logging.error('ASYNC_AZURE.GET_GROUP_MEMBERS: Invalid Group ID')
+            raise exceptions.AzureException('ASYNC_AZURE.GET_GROUP_MEMBERS: Invalid Group ID')
+        url = self.azure.user_members_url(group_id) + self.azure.member_query()
+        # nextLink keeps $select and $top
+        if skip_token is not None:
+            url = self.azure.user_members_url(group_id) + '?' + skip_token
+        return await self._send('get', url, 'get_group_members')
+
+    async def iter_group_member_pages(self, group_id):
+        """
+        Yields each page of AD group members following @odata.nextLink
+        The next page is fetched while the caller processes the current one
+        """
+        data = await self.get_group_members(group_id)
+        task = None
+        try:
+            while True:
+                task = None
+                # Checks if there is a next page and if so, starts fetching it
+                if data.get('@odata.nextLink') is not None:
+                    skip_token = data['@odata.nextLink'].split('?')
+                    task = asyncio.ensure_future(self.get_group_members(group_id, skip_token[1]))
+                yield data['value']
+                if not task:
+                    break
+                data = await task
+        finally:
+            # The caller stopped before the prefetched page was consumed
+            if task and not task.done():
+                task.cancel()
+
+    async def get_all_group_members(self, group_id):
+        """
+        Fetches all the members of AD group following @odata.nextLink
+        """
+        members = []
+        async for page in self.iter_group_member_pages(group_id):
+            members += page
+        return members
+
+    async def get_all_group_members_map(self, group_id, registry=None):
+        """
+        Returns the Dictionary(<userPrincipalName>, <Contact>) of all group members
+        Members are validated while the following page is being fetched
+        Members already validated in the run are taken from ContactRegistry if given
+        """
+        dictionary = {}
+        async for page in self.iter_group_member_pages(group_id):
+            for contact in page:
+                if registry:
+                    contact = registry.validate(contact)
+                else:
+                    contact = contact_validator.validate_and_fix_azure_contact(contact)
+                dictionary[contact['userPrincipalName']] = contact
+        return dictionary
+
+    async def get_group_name(self, group_id, return_json=False):
+        """
+        Fetches Azure AD Group Name
+        Returns the cached group info if the group is already fetched
+        """
+        if not group_id:
+            logging.error('ASYNC_AZURE.GET_GROUP_NAME: Invalid Group ID')
+            raise exceptions.AzureException('ASYNC_AZURE.GET_GROUP_NAME: Invalid Group ID')
+        with self.azure.group_lock:
+            group = self.azure.groups.get(group_id)
+        if not group:
+            group = await self._send('get', self.azure.group_url(group_id), 'get_group_name')
+            with self.azure.group_lock:
+                self.azure.groups[group_id] = group
+        if return_json is False:
+            return group['displayName']
+        return dict(group)
+
+    async def get_groups(self, group_ids):
+        """
+        Fetches Azure AD Group info through JSON batching and caches it
+        Batches of MAX_BATCH_REQUESTS groups are sent at the same time
+        Returns the dictionary(<group id>, <group info>)
+        """
+        with self.azure.group_lock:
+            missing = [gid for gid in dict.fromkeys(group_ids) if gid not in self.azure.groups]
+        await asyncio.gather(*[self._get_group_batch(missing[i:i + Azure.MAX_BATCH_REQUESTS])
+                               for i in range(0, len(missing), Azure.MAX_BATCH_REQUESTS)])
+        with self.azure.group_lock:
+            return {gid: self.azure.groups[gid] for gid in group_ids if gid in self.azure.groups}
+
+    async def _get_group_batch(self, group_ids):
+        """
+        Fetches up to MAX_BATCH_REQUESTS groups with a single $batch request
+        """
+        data = {'requests': [{'id': str(i), 'method': 'GET', 'url': '/groups/' + gid}
+                             for i, gid in enumerate(group_ids)]}
+        res = await self._send('post', Azure.API_BATCH, '_get_group_batch', data)
+        for rslt in res['responses']:
+            gid = group_ids[int(rslt['id'])]
+            if rslt.get('status') != 200:
+                logging.warning('ASYNC_AZURE._GET_GROUP_BATCH: Failed to Fetch Group %s (%s)',
+                                gid, rslt.get('status'))
+                continue
+            with self.azure.group_lock:
+                self.azure.groups[gid] = rslt['body']
+
+    async def _get_users_with_filter(self, filter_string):
+        """
+        Fetches all the users matching the filter following @odata.nextLink
+        """
+        users = []
+        url = self.azure.user_filter_url(filter_string)
+        while url:
+            res = await self._send('get', url, 'get_users_with_filters')
+            users += res['value']
+            url = res.get('@odata.nextLink')
+        return users
+
+    async def get_users_with_filters_map(self, ad_user_emails):
+        """
+        Gets users specified in config file
+        Emails are looked up in chunks of MAX_FILTER_VALUES sent at the same time
+        """
+        if not ad_user_emails:
+            logging.error('ASYNC_AZURE.GET_USERS_WITH_FILTERS: No User Id Provided')
+            raise exceptions.AzureException('ASYNC_AZURE.GET_USERS_WITH_FILTERS: No User Id Provided')
+        filters = self.azure.generate_email_filter_strings(ad_user_emails)
+        chunks = await asyncio.gather(*[self._get_users_with_filter(filter_string) for filter_string in filters])
+        dictionary = {}
+        for users in chunks:
+            for contact in users:
+                contact = contact_validator.validate_and_fix_azure_contact(contact)
+                dictionary[contact['mail']] = contact
+        return dictionary
+
+    async def get_group_emails(self, ad_users, ad_group_ids):
+        """
+        Gets Group emails specified in the config file and adds them to the ad_users dictionary
+        """
+        if not ad_group_ids or not ad_users:
+            logging.error('ASYNC_AZURE.GET_GROUP_EMAILS: INVALID ARGUMENTS')
+            raise exceptions.AzureException('ASYNC_AZURE.GET_GROUP_EMAILS: INVALID ARGUMENTS')
+        await self.get_groups(ad_group_ids)
+        for gid_ad in ad_group_ids:
+            group = await self.get_group_name(gid_ad, True)
+            group = contact_validator.validate_and_fix_azure_contact(group)
+            ad_users[group['mail']] = group
+        return ad_users
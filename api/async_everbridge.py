@@ -0,0 +1,356 @@
+"""
+Handles Everbridge API requests on asyncio event loop
+"""
+import asyncio
+import json
+import logging
+import aiohttp
+from . import contact_records
+from . import exceptions
+from . import rate_control
+from . import everbridge
+from .everbridge import Everbridge
+
+# Requests that failed with these errors may succeed when retried
+TRANSIENT_ERRORS = everbridge.TRANSIENT_ERRORS + (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+class AsyncEverbridge:
+    """
+    Handles Everbridge API requests with coroutines sharing one connection pool
+    Provides the same methods as Everbridge as coroutines; URLs and responses are handled by the helpers of everbridge
+    No more than max_concurrency requests are in flight at the same time; see RateControl.send_async
+    Must be opened and closed on the event loop that sends the requests
+    """
+    DEFAULT_MAX_CONCURRENCY = 32
+
+    def __init__(self, org, username, password):
+        self.headers = Everbridge.create_authheader(username, password)
+        # aiohttp accepts only str header values
+        self.headers['Authorization'] = self.headers['Authorization'].decode('utf-8')
+        self.org = org
+        self.pagesize = Everbridge.DEFAULT_PAGESIZE
+        self.max_concurrency = AsyncEverbridge.DEFAULT_MAX_CONCURRENCY
+        self.rate_control = rate_control.RateControl('ASYNC_EVERBRIDGE', self.max_concurrency)
+        self.timeout = Everbridge.DEFAULT_TIMEOUT
+        self.session = None
+        self.group_directory = None
+        self.directory_lock = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def set_pagesize(self, pagesize):
+        """
+        Sets pagesize
+        """
+        self.pagesize = pagesize
+
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Sets the maximum number of requests in flight at the same time; must be called before open
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_control = rate_control.RateControl('ASYNC_EVERBRIDGE', max_concurrency,
+                                                     self.rate_control.max_retries)
+
+    def set_timeout(self, connect=None, read=None):
+        """
+        Sets seconds to connect to Everbridge API and to wait for each response; must be called before open
+        The timeout not given keeps its default
+        """
+        self.timeout = (connect or Everbridge.DEFAULT_TIMEOUT[0], read or Everbridge.DEFAULT_TIMEOUT[1])
+
+    def set_max_retries(self, max_retries):
+        """
+        Sets the number of times a throttled request is retried
+        """
+        self.rate_control.set_max_retries(max_retries)
+
+    def set_deadline(self, deadline):
+        """
+        Sets epoch seconds after which throttled requests are not retried
+        """
+        self.rate_control.set_deadline(deadline)
+
+    def get_rate_report(self):
+        """
+        Returns the counters of requests, throttled responses and retries
+        """
+        return self.rate_control.report()
+
+    def set_group_directory(self, group_directory):
+        """
+        Sets GroupDirectory that serves group ids by name
+        """
+        self.group_directory = group_directory
+
+    async def open(self):
+        """
+        Creates the session whose connection pool is shared by all the requests
+        Creates the lock and the admission of requests on the running event loop
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        self.session = aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout)
+        self.rate_control.open_async()
+        self.directory_lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        """
+        Closes the session and its connections
+        Drops the lock and the admission of requests bound to the event loop
+        """
+        if self.session:
+            await self.session.close()
+            self.session = None
+        self.rate_control.close_async()
+        self.directory_lock = None
+
+    def contacts_url(self, param=None):
+        """
+        Returns contacts API URL
+        """
+        return everbridge.api_url(Everbridge.API_CONTACTS, self.org, param)
+
+    def groups_url(self, param=None):
+        """
+        Returns groups API URL
+        """
+        return everbridge.api_url(Everbridge.API_GROUPS, self.org, param)
+
+    async def _send(self, method, url, data=None):
+        """
+        Sends HTTP request and returns the JSON response
+        Throttled requests are retried
+        """
+        kwargs = {}
+        if data is not None:
+            kwargs['json'] = contact_records.to_json_data(data)
+        family = rate_control.endpoint_family(url, Everbridge.API_BASE)
+        try:
+            _, _, body = await self.rate_control.send_async(family, lambda: self._request(method, url, kwargs))
+            return json.loads(body)
+        except Exception as error:
+            logging.error(error)
+            raise exceptions.EverbridgeException() from error
+
+    async def _request(self, method, url, kwargs):
+        """
+        Sends HTTP request and returns the status, the headers and the body
+        """
+        async with self.session.request(method, url, **kwargs) as resp:
+            return resp.status, resp.headers, await resp.text()
+
+    async def get_contacts_by_external_ids(self, external_ids):
+        """
+        Gets a list of contacts from Everbridge
+        external_ids: query string of externalIds; e.g. '&externalIds=aaa&externalIds=bbb'
+        """
+        if not external_ids:
+            msg = 'ASYNC_EVERBRIDGE.GET_CONTACTS_BY_EXTERNAL_IDS: No External IDs Provided'
+            raise exceptions.EverbridgeException(msg)
+        res = await self._send('get', self.contacts_url(everbridge.external_ids_params(external_ids)))
+        return everbridge.check_response('ASYNC_EVERBRIDGE.GET_CONTACTS_BY_EXTERNAL_IDS', res, 'page').get('data') or []
+
+    async def get_contacts_by_external_id_list(self, external_ids, per=100):
+        """
+        Gets contacts from Everbridge by the list of externalIds
+        The list is divided into requests per given number (default 100) sent at the same time
+        """
+        filters = everbridge.external_id_filters(external_ids, per)
+        pages = await asyncio.gather(*[self.get_contacts_by_external_ids(ids) for ids in filters])
+        return [contact for page in pages for contact in page]
+
+    async def _upsert_chunk_with_retry(self, contacts):
+        """
+        Upserts contacts and retries only this chunk if it fails transiently; see everbridge.is_transient_error
+        Waits before each retry with the backoff of RateControl; does not retry after the deadline
+        Returns [result, None] if succeeds; [None, error] otherwise
+        """
+        error = None
+        for attempt in range(Everbridge.UPSERT_RETRIES + 1):
+            if attempt:
+                delay = self.rate_control.limit_delay(self.rate_control.get_retry_delay(None, attempt - 1))
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+            try:
+                rslt = await self._send('post', self.contacts_url('batch?version=1'), contacts)
+                return [everbridge.check_code('ASYNC_EVERBRIDGE.UPSERT_CONTACTS', rslt), None]
+            except exceptions.EverbridgeException as err:
+                error = err
+                logging.error('ASYNC_EVERBRIDGE.UPSERT_CONTACTS: %d Contacts Failed (Attempt %d)',
+                              len(contacts), attempt + 1)
+                if not everbridge.is_transient_error(err, TRANSIENT_ERRORS):
+                    break
+        return [None, error]
+
+    async def upsert_contacts(self, contacts):
+        """
+        Upserts contacts to everbridge org
+        Contacts are sent in chunks of MAX_UPSERT_CONTACTS at the same time
+        Returns {'code': 100, 'message': 'OK', 'results': [<chunk result>], 'failed_contacts': [<contact>]}
+        """
+        if contacts is None:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.UPSERT_CONTACTS: No Contacts Provided')
+        chunks = everbridge.upsert_chunks(contacts)
+        results = await asyncio.gather(*[self._upsert_chunk_with_retry(chunk) for chunk in chunks])
+        return everbridge.merge_upsert_results('ASYNC_EVERBRIDGE.UPSERT_CONTACTS', contacts, chunks, results)
+
+    async def delete_contacts(self, contacts):
+        """
+        Deletes contacts from the org by Everbridge ids
+        """
+        if not contacts:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.DELETE_CONTACTS: No Contacts Provided')
+        rslt = await self._send('delete', self.contacts_url('batch'), contacts)
+        return everbridge.check_code('ASYNC_EVERBRIDGE.DELETE_CONTACTS', rslt)
+
+    async def get_group_by_name(self, name):
+        """
+        Gets Everbridge group by name
+        """
+        if not name:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.GET_GROUP_BY_NAME: No GroupName Provided')
+        res = await self._send('get', self.groups_url(f"{name}?queryType=name"))
+        return everbridge.check_response('ASYNC_EVERBRIDGE.GET_GROUP_BY_NAME', res, 'result')
+
+    async def get_group_id_by_name(self, name):
+        """
+        Gets Everbridge group id by group name
+        Served from GroupDirectory if set; queries by name only if the group is not found there
+        """
+        if not name:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.GET_GROUP_ID_BY_NAME: No GroupName Provided')
+        if self.group_directory:
+            await self.load_group_directory()
+            group_id = self.group_directory.get(name)
+            if group_id:
+                return group_id
+        group_id = everbridge.check_response('ASYNC_EVERBRIDGE.GET_GROUP_ID_BY_NAME',
+                                             await self.get_group_by_name(name), 'id')
+        if self.group_directory and group_id:
+            self.group_directory.add(name, group_id)
+        return group_id
+
+    async def get_groups_page(self, page=1):
+        """
+        Gets a page of Everbridge groups in the org
+        Returns the page object that contains data, totalCount and totalPageCount
+        """
+        res = await self._send('get', self.groups_url(everbridge.groups_page_params(self.pagesize, page)))
+        return everbridge.check_response('ASYNC_EVERBRIDGE.GET_GROUPS_PAGE', res, 'page')
+
+    async def get_all_groups(self):
+        """
+        Gets all Everbridge groups in the org; the pages after the first one are fetched at the same time
+        """
+        return await self._get_all_pages(self.get_groups_page)
+
+    async def load_group_directory(self):
+        """
+        Fills GroupDirectory from the cache file or by listing all groups unless it is fresh
+        """
+        if self.directory_lock is None:
+            # Not opened
+            self.directory_lock = asyncio.Lock()
+        async with self.directory_lock:
+            if self.group_directory.is_loaded() or self.group_directory.load():
+                return
+            self.group_directory.fill(await self.get_all_groups())
+            logging.info('Loaded %d Everbridge Groups', len(self.group_directory.groups))
+
+    async def get_group_members_page(self, group_id, page=1):
+        """
+        Gets a page of Everbridge group members that are ordered by externalId
+        Returns the page object that contains data, totalCount and totalPageCount
+        """
+        if not group_id:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.GET_GROUP_MEMBERS: No Group ID Provided')
+        params = everbridge.group_members_params(group_id, self.pagesize, page)
+        res = await self._send('get', self.contacts_url(params))
+        return everbridge.check_response('ASYNC_EVERBRIDGE.GET_GROUP_MEMBERS', res, 'page')
+
+    async def get_paged_group_members(self, group_id, page=1):
+        """
+        Gets Everbridge group members that are ordered by externalId
+        """
+        res = await self.get_group_members_page(group_id, page)
+        return res.get('data') or []
+
+    async def get_all_group_members(self, group_id):
+        """
+        Gets all the members of Everbridge group ordered by externalId
+        The pages after the first one are fetched at the same time
+        """
+        return await self._get_all_pages(lambda page: self.get_group_members_page(group_id, page))
+
+    async def _get_all_pages(self, get_page):
+        """
+        Gets the first page for totalPageCount and then the rest at the same time
+        Returns the data of all the pages in order
+        """
+        first = await get_page(1)
+        total = first.get('totalPageCount') or 0
+        pages = [first] + list(await asyncio.gather(*[get_page(page) for page in range(2, total + 1)]))
+        return [item for page in pages for item in page.get('data') or []]
+
+    async def get_contact_count(self, group_id=None):
+        """
+        Returns the number of contacts in the group; in the org if group_id is not given
+        """
+        res = await self._send('get', self.contacts_url(everbridge.contact_count_params(group_id)))
+        return everbridge.check_response('ASYNC_EVERBRIDGE.GET_CONTACT_COUNT', res, 'page').get('totalCount') or 0
+
+    async def delete_members_from_group(self, group_id, members):
+        """
+        Removes contacts from the group by Everbridge ids
+        """
+        if not group_id:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: No Group ID Provided')
+        if members is None:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: No Members Provided')
+        rslt = await self._send('delete', self.groups_url(everbridge.group_contacts_params(group_id)), members)
+        return everbridge.check_code('ASYNC_EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP', rslt)
+
+    async def add_members_to_group(self, group_id, members, id_type='id'):
+        """
+        Adds contacts to the group
+        id_type: members are contact ids (id) or externalIds (externalId)
+        """
+        if not group_id:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.ADD_MEMBERS_TO_GROUP: No Group ID Provided')
+        if members is None:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.ADD_MEMBERS_TO_GROUP: No Members Provided')
+        params = everbridge.group_contacts_params(group_id, id_type)
+        rslt = await self._send('post', self.groups_url(params), members)
+        return everbridge.check_code('ASYNC_EVERBRIDGE.ADD_MEMBERS_TO_GROUP', rslt)
+
+    async def add_group(self, group_name, parent_id=None):
+        """
+        Inserts new group into everbridge
+        """
+        if not group_name:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.ADD_GROUP: No Group Name Provided')
+        data = {'name': group_name, 'organizationId': self.org, 'parentId': parent_id}
+        rslt = await self._send('post', self.groups_url(''), data)
+        everbridge.check_message('ASYNC_EVERBRIDGE.ADD_GROUP', rslt)
+        if self.group_directory and rslt.get('id'):
+            self.group_directory.add(group_name, rslt['id'])
+        return rslt
+
+    async def delete_group(self, group_id):
+        """
+        Deletes Group from Everbridge
+        """
+        if not group_id:
+            raise exceptions.EverbridgeException('ASYNC_EVERBRIDGE.DELETE_GROUP: No Group ID Provided')
+        rslt = await self._send('delete', self.groups_url(group_id))
+        everbridge.check_message('ASYNC_EVERBRIDGE.DELETE_GROUP', rslt)
+        if self.group_directory:
+            self.group_directory.remove(group_id)
+        return rslt
@@ -0,0 +1,28 @@
+"""
+Provides iterator for everbridge group members fetched on asyncio event loop
+"""
+from . import everbridge_group_member_iterator
+
+class AsyncEverbridgeGroupMemberIterator(everbridge_group_member_iterator.EverbridgeGroupMemberIterator):
+    """
+    Iterates everbridge group members fetched by AsyncEverbridge on the loop of AsyncRunner
+    The pages read ahead are requests in flight on the loop instead of threads; more are read ahead
+    """
+    DEFAULT_READ_AHEAD = 16
+
+    def __init__(self, runner, group_id, read_ahead=None):
+        super().__init__(runner.everbridge, group_id,
+                         read_ahead or AsyncEverbridgeGroupMemberIterator.DEFAULT_READ_AHEAD)
+        self.runner = runner
+
+    def _fetch_page(self, page):
+        """
+        Fetches a page of group members and waits for it
+        """
+        return self._submit(page).result()
+
+    def _submit(self, page):
+        """
+        Schedules the request of the page on the loop and returns the future of it
+        """
+        return self.runner.submit(self.api.get_group_members_page(self.group_id, page))
@@ -0,0 +1,69 @@
+"""
+Runs the async API clients on an asyncio event loop shared by the sync threads
+"""
+import asyncio
+import logging
+import threading
+
+class AsyncRunner:
+    """
+    Runs an asyncio event loop on a background thread and opens the async clients on it
+    Coroutines submitted from any thread share the loop and the connection pools of the clients
+    """
+    def __init__(self, everbridge=None, azure=None):
+        self.everbridge = everbridge
+        self.azure = azure
+        self.loop = None
+        self.thread = None
+
+    def clients(self):
+        """
+        Returns the async clients run on the loop
+        """
+        return [client for client in [self.everbridge, self.azure] if client]
+
+    def open(self):
+        """
+        Starts the event loop thread and opens the clients on it
+        """
+        if self.loop:
+            return self
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='AsyncRunner', daemon=True)
+        self.thread.start()
+        try:
+            for client in self.clients():
+                self.run(client.open())
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def submit(self, coro):
+        """
+        Schedules the coroutine on the loop and returns concurrent.futures.Future of the result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """
+        Runs the coroutine on the loop and waits for the result
+        """
+        return self.submit(coro).result()
+
+    def close(self):
+        """
+        Closes the clients and stops the event loop thread
+        """
+        if not self.loop:
+            return
+        for client in self.clients():
+            try:
+                self.run(client.close())
+            except Exception as err: # pylint: disable=broad-except
+                logging.error(err)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
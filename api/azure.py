@@ -1,11 +1,113 @@
 """
 Requests Client Crediential Token and then performs API call to get Login Events
 """
+import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os.path import exists
 import requests
 import adal
+from cryptography.fernet import Fernet, InvalidToken
 from . import exceptions
+from . import contact_records
+from . import contact_utils
+from . import rate_control
 from . import contact_validator
+from . import external_sort
+
+class TokenCache:
+    """
+    Keeps Azure AD tokens until shortly before they expire
+    Tokens are shared in memory within the process and optionally saved in an encrypted file
+    """
+    MEMORY = {}
+    LOCK = threading.Lock()
+
+    def __init__(self, filename=None, key=None):
+        if filename and not key:
+            logging.error('TOKEN_CACHE: No Key Provided')
+            raise exceptions.AzureException('TOKEN_CACHE: No Key Provided')
+        self.filename = filename
+        self.fernet = Fernet(key) if key else None
+
+    @staticmethod
+    def expires_at(token):
+        """
+        Returns the expiration time of the token in epoch seconds; None if unknown
+        """
+        if token.get('expiresAt'):
+            return token['expiresAt']
+        if token.get('expiresOn'):
+            # adal returns local time e.g. '2019-09-12 15:04:41.123456'
+            try:
+                return datetime.strptime(token['expiresOn'], '%Y-%m-%d %H:%M:%S.%f').timestamp()
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def is_valid(token, margin=0):
+        """
+        Returns True if the token does not expire within margin seconds
+        Tokens without expiration info are considered valid
+        """
+        if not token or not token.get('accessToken'):
+            return False
+        expires_at = TokenCache.expires_at(token)
+        return expires_at is None or expires_at - margin > time.time()
+
+    def _load_file(self):
+        """
+        Returns tokens saved in the encrypted file
+        """
+        if not self.filename or not exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, 'rb') as stream:
+                return json.loads(self.fernet.decrypt(stream.read()))
+        except (InvalidToken, ValueError) as err:
+            logging.error('TOKEN_CACHE: Invalid Cache File: %s', self.filename)
+            logging.error(err)
+            return {}
+
+    def _save_file(self, tokens):
+        """
+        Saves tokens to the encrypted file
+        """
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'wb') as stream:
+            stream.write(self.fernet.encrypt(json.dumps(tokens).encode('utf-8')))
+        os.replace(tmpfile, self.filename)
+
+    def get(self, key, margin=0):
+        """
+        Returns the cached token if it does not expire within margin seconds; None otherwise
+        """
+        with TokenCache.LOCK:
+            token = TokenCache.MEMORY.get(key)
+            if not TokenCache.is_valid(token, margin) and self.filename:
+                token = self._load_file().get(key)
+                if TokenCache.is_valid(token, margin):
+                    TokenCache.MEMORY[key] = token
+        if TokenCache.is_valid(token, margin):
+            return token
+        return None
+
+    def set(self, key, token):
+        """
+        Caches the token
+        """
+        with TokenCache.LOCK:
+            TokenCache.MEMORY[key] = token
+            if self.filename:
+                tokens = self._load_file()
+                tokens[key] = token
+                self._save_file(tokens)
+
 class Azure:
     """
     Handles Azure Graph API requests
@@ -15,7 +117,22 @@ class Azure:
     API_GROUPS = API_BASE + 'v1.0/groups/'
     API_USERS = API_BASE + 'v1.0/users/'
     API_USERS_QUERY = API_BASE + 'v1.0/users'
+    API_GROUPS_DELTA = API_BASE + 'v1.0/groups/delta'
+    API_OBJECTS_BY_IDS = API_BASE + 'v1.0/directoryObjects/getByIds'
+    API_BATCH = API_BASE + 'v1.0/$batch'
     DEFAULT_PAGESIZE = 100
+    DEFAULT_MAX_CONCURRENCY = 4
+    MAX_IDS_PER_REQUEST = 1000
+    MAX_BATCH_REQUESTS = 20
+    # Values allowed in the in operator of a single $filter
+    MAX_FILTER_VALUES = 15
+    TOKEN_REFRESH_MARGIN = 300
+    MAX_MEMBER_PAGESIZE = 999
+    # Seconds to connect and to wait for each response
+    DEFAULT_TIMEOUT = (10, 60)
+    # Attributes read by contact_validator and contact_utils
+    DEFAULT_MEMBER_ATTRIBUTES = ('id', 'userPrincipalName', 'givenName', 'surname', 'displayName',
+                                 'mail', 'businessPhones', 'mobilePhone')
 
     def __init__(self, client_id, secret, tenant):
         self.client_id = client_id
@@ -24,16 +141,64 @@ class Azure:
         self.token = None
         self.session = None
         self.pagesize = Azure.DEFAULT_PAGESIZE
+        self.member_attributes = list(Azure.DEFAULT_MEMBER_ATTRIBUTES)
+        self.rate_control = rate_control.RateControl('AZURE', Azure.DEFAULT_MAX_CONCURRENCY)
+        self.timeout = Azure.DEFAULT_TIMEOUT
+        self.token_cache = None
+        self.token_lock = threading.Lock()
+        # Group info keyed by AD group id
+        self.groups = {}
+        self.group_lock = threading.Lock()
 
     def setup(self):
         """
         Sets up token and session
         MUST BE cALLED ONECE before any API calls
         """
+        if not self.token and self.token_cache:
+            self.set_token(self.token_cache.get(self.token_cache_key(), Azure.TOKEN_REFRESH_MARGIN))
         if not self.token:
             self.reset_token()
         self._setup_session()
 
+    def set_token_cache(self, token_cache):
+        """
+        Sets TokenCache that keeps tokens between runs
+        """
+        self.token_cache = token_cache
+
+    def token_cache_key(self):
+        """
+        Returns the key of the token in TokenCache
+        """
+        return self.tenant + ':' + self.client_id
+
+    def _refresh_token_if_expiring(self):
+        """
+        Gets a new token and updates the session if the token expires soon
+        """
+        if not self.token or not self.token.get('accessToken'):
+            return
+        if TokenCache.is_valid(self.token, Azure.TOKEN_REFRESH_MARGIN):
+            return
+        with self.token_lock:
+            # Another thread may have refreshed the token while waiting
+            if TokenCache.is_valid(self.token, Azure.TOKEN_REFRESH_MARGIN):
+                return
+            logging.info('AZURE: Refreshing Token')
+            self.reset_token()
+            if self.session:
+                self.session.headers.update({'Authorization': 'Bearer ' + self.token['accessToken']})
+
+    def get_access_token(self):
+        """
+        Returns the access token shared with other clients such as AsyncAzure
+        Refreshes the token if it expires soon
+        """
+        self._refresh_token_if_expiring()
+        self._check_token()
+        return self.token['accessToken']
+
     def _setup_session(self):
         """
         Creates Rest session
@@ -47,10 +212,52 @@ class Azure:
                                      'Content-Type': 'application/json',
                                      'return-client-request-id': 'true'})
 
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Sets the maximum number of requests sent to Graph API at the same time
+        """
+        self.rate_control = rate_control.RateControl('AZURE', max_concurrency, self.rate_control.max_retries)
+
+    def set_timeout(self, connect=None, read=None):
+        """
+        Sets seconds to connect to Graph API and to wait for each response
+        The timeout not given keeps its default
+        """
+        self.timeout = (connect or Azure.DEFAULT_TIMEOUT[0], read or Azure.DEFAULT_TIMEOUT[1])
+
+    def set_max_retries(self, max_retries):
+        """
+        Sets the number of times a throttled request is retried
+        """
+        self.rate_control.set_max_retries(max_retries)
+
+    def set_deadline(self, deadline):
+        """
+        Sets epoch seconds after which throttled requests are not retried
+        """
+        self.rate_control.set_deadline(deadline)
+
+    def get_rate_report(self):
+        """
+        Returns the counters of requests, throttled responses and retries
+        """
+        return self.rate_control.report()
+
+    def _send(self, method, url, **kwargs):
+        """
+        Sends HTTP request through the session within the adaptive concurrency limit of the endpoint
+        Throttled requests are retried
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        family = rate_control.endpoint_family(url, Azure.API_BASE + 'v1.0/')
+        return self.rate_control.send(family, lambda: getattr(self.session, method)(url, **kwargs))
+
     def _check_setup(self):
         """
         Raises an Exception if token or session is not set up
+        Refreshes the token if it expires soon
         """
+        self._refresh_token_if_expiring()
         self._check_token()
         self._check_session()
 
@@ -84,7 +291,12 @@ class Azure:
         """
         Resets token
         """
-        self.set_token(self.get_token())
+        token = self.get_token()
+        if token and token.get('expiresIn') and not token.get('expiresAt'):
+            token['expiresAt'] = time.time() + int(token['expiresIn'])
+        self.set_token(token)
+        if self.token_cache and token:
+            self.token_cache.set(self.token_cache_key(), token)
 
     def get_token(self):
         """
@@ -93,7 +305,7 @@ class Azure:
         if not self.client_id or not self.secret or not self.tenant:
             logging.error('AZURE.API.get_token: Invalid Parameter')
             raise exceptions.AzureException('AZURE.API.get_token: Invalid parameter')
-        context = adal.AuthenticationContext(self.authority_url())
+        context = adal.AuthenticationContext(self.authority_url(), timeout=self.timeout)
         try:
             token = context.acquire_token_with_client_credentials(
                 Azure.API_BASE, self.client_id, self.secret)
@@ -114,6 +326,14 @@ class Azure:
         """
         self.pagesize = pagesize
 
+    def set_member_attributes(self, attributes):
+        """
+        Sets the attributes of group members fetched from Graph API
+        id and userPrincipalName are always fetched
+        """
+        required = [attr for attr in ('id', 'userPrincipalName') if attr not in attributes]
+        self.member_attributes = required + list(attributes)
+
     def authority_url(self):
         """
         Returns authority URL for authentication context
@@ -127,6 +347,24 @@ class Azure:
         """
         return Azure.API_GROUPS + group_id + '/members'
 
+    def user_members_url(self, group_id):
+        """
+        Returns group members api URL casted to users; devices and nested groups are excluded
+        """
+        return self.group_members_url(group_id) + '/microsoft.graph.user'
+
+    def member_select(self):
+        """
+        Returns $select parameter that fetches only member attributes
+        """
+        return f"$select={','.join(self.member_attributes)}"
+
+    def member_query(self):
+        """
+        Returns query string that fetches only member attributes with the maximum page size
+        """
+        return f"?{self.member_select()}&$top={Azure.MAX_MEMBER_PAGESIZE}"
+
     def paged_group_members_url(self, group_id, page=1):
         """
         Returns group members api URL
@@ -159,7 +397,7 @@ class Azure:
         self._check_setup()
         url = self.paged_group_members_url(group_id, page=1)
         try:
-            response = self.session.get(url)
+            response = self._send('get', url)
             if response.status_code == 200:
                 return response.json()['value']
         except Exception as err:
@@ -176,13 +414,13 @@ class Azure:
             logging.error('AZURE.GET_GROUP_MEMBERS: Invalid Group ID')
             raise exceptions.AzureException('AZURE.GET_GROUP_MEMBERS: Invalid Group ID')
         self._check_setup()
-        url = self.group_members_url(group_id)
-        #Adds Skip token for next page
+        url = self.user_members_url(group_id) + self.member_query()
+        #Adds Skip token for next page; nextLink keeps $select and $top
         if skip_token is not None:
-            url = self.group_members_url(group_id) + "?" + skip_token
+            url = self.user_members_url(group_id) + "?" + skip_token
         # Will manually search through all groups if Group ID is empty
         try:
-            response = self.session.get(url)
+            response = self._send('get', url)
             if response.status_code == 200:
                 return response.json()
         except Exception as err:
@@ -193,48 +431,120 @@ class Azure:
 
     def get_group_name(self, group_id, return_json=False):
         """
-        Fetches Azure AD Group Members
+        Fetches Azure AD Group Name
+        Returns the cached group info if the group is already fetched
         """
         if not group_id:
             logging.error('AZURE.get_group_name: Invalid Group ID')
             raise exceptions.AzureException('AZURE.GET_GROUP_NAME: Invalid Group ID')
+        with self.group_lock:
+            group = self.groups.get(group_id)
+        if not group:
+            group = self._get_group(group_id)
+        if return_json is False:
+            return group['displayName']
+        return dict(group)
+
+    def _get_group(self, group_id):
+        """
+        Fetches Azure AD Group info and caches it
+        """
         self._check_setup()
         url = self.group_url(group_id)
         try:
-            response = self.session.get(url)
+            response = self._send('get', url)
             if response.status_code == 200:
-                if return_json is False:
-                    return response.json()['displayName']
-                return response.json()
+                group = response.json()
+                with self.group_lock:
+                    self.groups[group_id] = group
+                return group
         except Exception as err:
             logging.error(err)
             raise exceptions.AzureException() from err
         Azure._log_unexpected_response('get_group_name', response)
         raise exceptions.AzureException('AZURE.GET_GROUP_NAME: Unexpected Response')
 
+    def get_groups(self, group_ids):
+        """
+        Fetches Azure AD Group info through JSON batching and caches it
+        Returns the dictionary(<group id>, <group info>)
+        Groups failed in a batch are left out; get_group_name fetches them one by one
+        """
+        self._check_setup()
+        with self.group_lock:
+            missing = [gid for gid in dict.fromkeys(group_ids) if gid not in self.groups]
+        for i in range(0, len(missing), Azure.MAX_BATCH_REQUESTS):
+            self._get_group_batch(missing[i:i + Azure.MAX_BATCH_REQUESTS])
+        with self.group_lock:
+            return {gid: self.groups[gid] for gid in group_ids if gid in self.groups}
+
+    def _get_group_batch(self, group_ids):
+        """
+        Fetches up to MAX_BATCH_REQUESTS groups with a single $batch request
+        """
+        data = {'requests': [{'id': str(i), 'method': 'GET', 'url': '/groups/' + gid}
+                             for i, gid in enumerate(group_ids)]}
+        try:
+            response = self._send('post', Azure.API_BATCH, json=data)
+            if response.status_code == 200:
+                for res in response.json()['responses']:
+                    gid = group_ids[int(res['id'])]
+                    if res.get('status') != 200:
+                        logging.warning('AZURE._GET_GROUP_BATCH: Failed to Fetch Group %s (%s)',
+                                        gid, res.get('status'))
+                        continue
+                    with self.group_lock:
+                        self.groups[gid] = res['body']
+                return
+        except Exception as err:
+            logging.error(err)
+            raise exceptions.AzureException() from err
+        Azure._log_unexpected_response('_get_group_batch', response)
+        raise exceptions.AzureException('AZURE._GET_GROUP_BATCH: Unexpected Response')
+
+    def iter_group_member_pages(self, group_id):
+        """
+        Yields each page of AD group members following @odata.nextLink
+        The next page is fetched while the caller processes the current one
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            data = self.get_group_members(group_id, None)
+            while True:
+                future = None
+                # Checks if there is a next page and if so, starts fetching it
+                if data.get("@odata.nextLink") is not None:
+                    skip_token = data["@odata.nextLink"].split('?')
+                    future = executor.submit(self.get_group_members, group_id, skip_token[1])
+                yield data["value"]
+                if not future:
+                    break
+                data = future.result()
+
+    def iter_group_members(self, group_id):
+        """
+        Yields each member of AD group as pages arrive
+        """
+        for page in self.iter_group_member_pages(group_id):
+            yield from page
+
     def get_all_group_members(self, group_id):
         """
         Will go through all pages of a AD Group and then returns the data
         """
-        ad_group_data = []
-        data = self.get_group_members(group_id, None)
-        ad_group_data = ad_group_data + data["value"]
-        # Checks if there is a next page and if so, does the call again until there is no next page
-        if data.get("@odata.nextLink") is not None:
-            while data.get("@odata.nextLink") is not None:
-                skip_token = data["@odata.nextLink"].split('?')
-                data = self.get_group_members(group_id, skip_token[1])
-                ad_group_data = ad_group_data + data["value"]
-        return ad_group_data
+        return list(self.iter_group_members(group_id))
 
-    def get_all_group_members_map(self, group_id):
+    def get_all_group_members_map(self, group_id, registry=None):
         """
         Returns the Dictionary(<userPrincipalName>, <Contact>) of all group members
+        Members are validated while the following pages are being fetched
+        Members already validated in the run are taken from ContactRegistry if given
         """
         dictionary = {}
-        members = self.get_all_group_members(group_id)
-        for contact in members:
-            contact = contact_validator.validate_and_fix_azure_contact(contact)
+        for contact in self.iter_group_members(group_id):
+            if registry:
+                contact = registry.validate(contact)
+            else:
+                contact = contact_validator.validate_and_fix_azure_contact(contact)
             dictionary[contact['userPrincipalName']] = contact
         return dictionary
 
@@ -242,10 +552,148 @@ class Azure:
     # Delete this function after it does
     def get_sorted_group_members(self, group_id):
         """
-        Fetches All Azure AD Group Members ordered by userPrincipalName
+        Fetches All Azure AD Group Members ordered by userPrincipalName; see contact_utils.merge_key
+        """
+        return sorted(self.iter_group_members(group_id),
+                      key=(lambda con: contact_utils.merge_key(con.get('userPrincipalName'))))
+
+    def iter_sorted_group_members(self, group_id, run_size=None):
+        """
+        Yields validated AD Group Members ordered by userPrincipalName; see contact_utils.merge_key
+        Members are sorted on disk in runs of run_size; memory use does not depend on the group size
+        """
+        members = (contact_validator.validate_and_fix_azure_contact(con) for con in self.iter_group_members(group_id))
+        key = (lambda con: contact_utils.merge_key(con.get('userPrincipalName')))
+        return external_sort.external_sort(members, key, run_size,
+                                           encode=contact_records.to_json_data,
+                                           decode=contact_records.AdContact.from_dict)
+
+    def get_group_member_count(self, group_id):
+        """
+        Returns the number of users in AD group without fetching them
+        """
+        if not group_id:
+            logging.error('AZURE.GET_GROUP_MEMBER_COUNT: Invalid Group ID')
+            raise exceptions.AzureException('AZURE.GET_GROUP_MEMBER_COUNT: Invalid Group ID')
+        self._check_setup()
+        url = self.user_members_url(group_id) + '/$count'
+        try:
+            # $count requires the advanced query header
+            response = self._send('get', url, headers={'ConsistencyLevel': 'eventual'})
+            if response.status_code == 200:
+                return int(response.text)
+        except Exception as err:
+            logging.error(err)
+            raise exceptions.AzureException() from err
+        Azure._log_unexpected_response('get_group_member_count', response)
+        raise exceptions.AzureException('AZURE.GET_GROUP_MEMBER_COUNT: Unexpected Response')
+
+    def group_delta_url(self, group_id):
+        """
+        Returns group delta api URL that tracks the members of the group
         """
-        members = self.get_all_group_members(group_id)
-        return sorted(members, key=(lambda con: con.get('userPrincipalName')))
+        return Azure.API_GROUPS_DELTA + f"?$filter=id eq '{group_id}'&$select=members"
+
+    def _get_delta_page(self, url):
+        """
+        Fetches a page of group delta
+        Raises AzureDeltaTokenException if the delta token is rejected
+        """
+        self._check_setup()
+        try:
+            response = self._send('get', url)
+            if response.status_code == 200:
+                return response.json()
+        except Exception as err:
+            logging.error(err)
+            raise exceptions.AzureException() from err
+        # Graph returns 410 Gone (or 400 for a malformed token) when a full resync is required
+        if response.status_code in (400, 410):
+            logging.info('AZURE._GET_DELTA_PAGE: Delta Token Rejected (%s)', response.status_code)
+            raise exceptions.AzureDeltaTokenException('AZURE._GET_DELTA_PAGE: Delta Token Rejected')
+        Azure._log_unexpected_response('_get_delta_page', response)
+        raise exceptions.AzureException('AZURE._GET_DELTA_PAGE: Unexpected Response')
+
+    def get_latest_delta_link(self, group_id):
+        """
+        Returns the deltaLink that represents the current state of the group
+        Changes made after this call are returned by get_group_member_delta
+        """
+        if not group_id:
+            logging.error('AZURE.GET_LATEST_DELTA_LINK: Invalid Group ID')
+            raise exceptions.AzureException('AZURE.GET_LATEST_DELTA_LINK: Invalid Group ID')
+        data = self._get_delta_page(self.group_delta_url(group_id) + '&$deltatoken=latest')
+        if '@odata.deltaLink' not in data:
+            logging.error('AZURE.GET_LATEST_DELTA_LINK: No Delta Link')
+            logging.error(data)
+            raise exceptions.AzureException('AZURE.GET_LATEST_DELTA_LINK: No Delta Link')
+        return data['@odata.deltaLink']
+
+    def get_group_member_delta(self, group_id, delta_link):
+        """
+        Returns the AD object ids of users added to and removed from the group since delta_link
+        {'added': [<id>], 'removed': [<id>], 'deltaLink': <next deltaLink>}
+        """
+        if not group_id or not delta_link:
+            logging.error('AZURE.GET_GROUP_MEMBER_DELTA: Invalid Arguments')
+            raise exceptions.AzureException('AZURE.GET_GROUP_MEMBER_DELTA: Invalid Arguments')
+        added = {}
+        removed = {}
+        data = self._get_delta_page(delta_link)
+        while True:
+            for group in data.get('value', []):
+                for member in group.get('members@delta', []):
+                    if member.get('@odata.type', '#microsoft.graph.user') != '#microsoft.graph.user':
+                        continue
+                    # The later entry wins if a member is added and removed within the window
+                    if '@removed' in member:
+                        added.pop(member['id'], None)
+                        removed[member['id']] = True
+                    else:
+                        removed.pop(member['id'], None)
+                        added[member['id']] = True
+            if data.get('@odata.nextLink') is None:
+                break
+            data = self._get_delta_page(data['@odata.nextLink'])
+        if '@odata.deltaLink' not in data:
+            logging.error('AZURE.GET_GROUP_MEMBER_DELTA: No Delta Link')
+            raise exceptions.AzureException('AZURE.GET_GROUP_MEMBER_DELTA: No Delta Link')
+        return {'added': list(added), 'removed': list(removed), 'deltaLink': data['@odata.deltaLink']}
+
+    def get_users_by_ids(self, user_ids):
+        """
+        Fetches users by AD object ids; only member attributes are fetched
+        """
+        users = []
+        self._check_setup()
+        url = Azure.API_OBJECTS_BY_IDS + '?' + self.member_select()
+        for i in range(0, len(user_ids), Azure.MAX_IDS_PER_REQUEST):
+            data = {'ids': user_ids[i:i + Azure.MAX_IDS_PER_REQUEST], 'types': ['user']}
+            try:
+                response = self._send('post', url, json=data)
+                if response.status_code == 200:
+                    users += response.json()['value']
+                    continue
+            except Exception as err:
+                logging.error(err)
+                raise exceptions.AzureException() from err
+            Azure._log_unexpected_response('get_users_by_ids', response)
+            raise exceptions.AzureException('AZURE.GET_USERS_BY_IDS: Unexpected Response')
+        return users
+
+    def get_group_member_changes(self, group_id, delta_link):
+        """
+        Returns the members added to and removed from the group since delta_link
+        {'added': {<userPrincipalName>: <Contact>}, 'removed': [<id>], 'deltaLink': <next deltaLink>}
+        Raises AzureDeltaTokenException if delta_link is rejected; a full sync is required then
+        """
+        delta = self.get_group_member_delta(group_id, delta_link)
+        added = {}
+        if delta['added']:
+            for contact in self.get_users_by_ids(delta['added']):
+                contact = contact_validator.validate_and_fix_azure_contact(contact)
+                added[contact['userPrincipalName']] = contact
+        return {'added': added, 'removed': delta['removed'], 'deltaLink': delta['deltaLink']}
 
     def user_filter_url(self, filter_string):
         """
@@ -256,41 +704,69 @@ class Azure:
     def generate_email_filter_string(self, ad_user_emails):
         """
         Generates string used for filter request
+        Emails are matched exactly with the in operator; up to MAX_FILTER_VALUES emails are allowed
         """
         if not ad_user_emails or isinstance(ad_user_emails, list) is False:
             raise exceptions.AzureException('AZURE.GENERATE_EMAIL_FILTER_STRING: Invalid Type')
-        filter_string = "?$filter="
-        count = 0
-        for email in ad_user_emails:
-            filter_string = filter_string + "startswith(mail, '" + email + "')"
-            count = count + 1
-            if count != len(ad_user_emails):
-                filter_string = filter_string + " or "
-        return filter_string
+        if len(ad_user_emails) > Azure.MAX_FILTER_VALUES:
+            logging.error('AZURE.GENERATE_EMAIL_FILTER_STRING: Too Many Emails')
+            raise exceptions.AzureException('AZURE.GENERATE_EMAIL_FILTER_STRING: Too Many Emails')
+        # Single quotes in OData string literals are escaped by doubling them
+        values = ','.join("'" + email.replace("'", "''") + "'" for email in ad_user_emails)
+        return "?$filter=mail in (" + values + ")"
+
+    def generate_email_filter_strings(self, ad_user_emails):
+        """
+        Generates filter strings for the emails divided into chunks of MAX_FILTER_VALUES
+        """
+        if not ad_user_emails or isinstance(ad_user_emails, list) is False:
+            raise exceptions.AzureException('AZURE.GENERATE_EMAIL_FILTER_STRINGS: Invalid Type')
+        emails = list(dict.fromkeys(ad_user_emails))
+        size = Azure.MAX_FILTER_VALUES
+        return [self.generate_email_filter_string(emails[i:i + size]) for i in range(0, len(emails), size)]
+
+    def _get_users_with_filter(self, filter_string):
+        """
+        Fetches all the users matching the filter following @odata.nextLink
+        """
+        users = []
+        url = self.user_filter_url(filter_string)
+        while url:
+            try:
+                response = self._send('get', url)
+                if response.status_code == 200:
+                    data = response.json()
+                    users += data['value']
+                    url = data.get('@odata.nextLink')
+                    continue
+            except Exception as err:
+                logging.error(err)
+                raise exceptions.AzureException() from err
+            Azure._log_unexpected_response('get_users_with_filters', response)
+            raise exceptions.AzureException('AZURE.GET_USERS_WITH_FILTERS: Unexpected Response')
+        return users
 
     def get_users_with_filters_map(self, ad_user_emails):
         """
         Get users specified in config file
+        Emails are looked up in chunks of MAX_FILTER_VALUES sent at the same time
         """
         if not ad_user_emails:
             logging.error('AZURE.get_users_with_filters: No User Id Provided')
             raise exceptions.AzureException('AZURE.GET_USERS_WITH_FILTERS: No User Id Provided')
-        dictionary = {}
-        filter_string = self.generate_email_filter_string(ad_user_emails)
+        filters = self.generate_email_filter_strings(ad_user_emails)
         self._check_setup()
-        url = self.user_filter_url(filter_string)
-        try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                for contact in response.json()["value"]:
-                    contact = contact_validator.validate_and_fix_azure_contact(contact)
-                    dictionary[contact['mail']] = contact
-                return dictionary
-        except Exception as err:
-            logging.error(err)
-            raise exceptions.AzureException() from err
-        Azure._log_unexpected_response('get_users_with_filters', response)
-        raise exceptions.AzureException('AZURE.GET_USERS_WITH_FILTERS: Unexpected Response')
+        if len(filters) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(filters), self.rate_control.max_concurrency)) as executor:
+                chunks = list(executor.map(self._get_users_with_filter, filters))
+        else:
+            chunks = [self._get_users_with_filter(filter_string) for filter_string in filters]
+        dictionary = {}
+        for users in chunks:
+            for contact in users:
+                contact = contact_validator.validate_and_fix_azure_contact(contact)
+                dictionary[contact['mail']] = contact
+        return dictionary
 
     def get_group_emails(self, ad_users, ad_group_ids):
         """
@@ -299,6 +775,7 @@ class Azure:
         if not ad_group_ids or  not ad_users:
             logging.error('AZURE.get_group_emails: INVALID ARGUMENTS')
             raise exceptions.AzureException('AZURE.GET_GROUP_EMAILS: INVALID ARGUMENTS')
+        self.get_groups(ad_group_ids)
         for gid_ad in ad_group_ids:
             group = self.get_group_name(gid_ad, True)
             group = contact_validator.validate_and_fix_azure_contact(group)
@@ -1,6 +1,7 @@
 """
 Provides iterator for azure group members
 """
+import itertools
 import math
 from . import base_iterator 
 from . import azure
@@ -8,11 +9,14 @@ from . import azure
 class AzureGroupMemberIterator(base_iterator.BaseIterator):
     """
     Iterates azure group members
+    If run_size is given, streams validated members sorted on disk instead of keeping them all in memory
     """
-    def __init__(self, api, group_id):
+    def __init__(self, api, group_id, run_size=None):
         super().__init__(api, group_id)
         self.pagesize = azure.Azure.DEFAULT_PAGESIZE
         self.first_time = True
+        self.run_size = run_size
+        self.stream = None
 
     # Graph API currently does not support OrderBy
     # Use Azure.get_sorted_group_members instead of get_paged_group_members
@@ -23,6 +27,9 @@ class AzureGroupMemberIterator(base_iterator.BaseIterator):
         """
         if self.no_more_data:
             return
+        if self.run_size:
+            self._get_next_streamed_page()
+            return
         if self.first_time:
             self.members = self.api.get_sorted_group_members(self.group_id)
             self.index = 0
@@ -32,3 +39,17 @@ class AzureGroupMemberIterator(base_iterator.BaseIterator):
         else:
             self.nom = 0
             self.no_more_data = True
+
+    def _get_next_streamed_page(self):
+        """
+        Takes the next page of members from the sorted stream
+        """
+        if self.stream is None:
+            self.stream = self.api.iter_sorted_group_members(self.group_id, self.run_size)
+        self.members = list(itertools.islice(self.stream, self.pagesize))
+        self.index = 0
+        self.nom = len(self.members)
+        if self.nom == 0:
+            self.no_more_data = True
+        else:
+            self.current_page += 1
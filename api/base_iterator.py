@@ -78,6 +78,11 @@ class BaseIterator:
         self.pagesize = pagesize
         self.api.set_pagesize(pagesize)
 
+    def close(self):
+        """
+        Stops fetching members; nothing to stop unless pages are fetched ahead
+        """
+
     def show(self):
         """
         Prints the status of the instance
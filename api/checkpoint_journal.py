@@ -0,0 +1,151 @@
+"""
+Records the progress of a sync run so that an interrupted run can be resumed
+"""
+import json
+import logging
+import os
+import threading
+import time
+from os.path import exists
+from . import contact_records
+from . import exceptions
+
+class CheckpointJournal:
+    """
+    Appends an entry to the journal file for each completed group and each applied write batch
+    Member writes are recorded per Everbridge group and operation by externalId
+    Upserts are not recorded; they are resent so that AD changes since the interruption are not lost
+    The file is removed when the run completes; a run left unfinished is resumed by the next run
+    """
+    DEFAULT_MAX_AGE = 24 * 60 * 60
+    ADD_MEMBERS = 'add'
+    REMOVE_MEMBERS = 'remove'
+
+    def __init__(self, filename, max_age=None):
+        self.filename = filename
+        self.max_age = max_age or CheckpointJournal.DEFAULT_MAX_AGE
+        self.started_at = None
+        self.groups = {}
+        self.batches = {}
+        self.stream = None
+        self.truncated = False
+        self.lock = threading.Lock()
+
+    def open(self):
+        """
+        Resumes the unfinished run recorded in the file if any; starts a new run otherwise
+        Runs older than max_age are not resumed since AD and Everbridge may have changed since
+        """
+        self.groups = {}
+        self.batches = {}
+        self.started_at = None
+        self.truncated = False
+        if exists(self.filename):
+            self._replay()
+            if self.started_at and time.time() - self.started_at > self.max_age:
+                logging.info('CHECKPOINT_JOURNAL.OPEN: Discarded Expired Journal: %s', self.filename)
+                self.groups = {}
+                self.batches = {}
+                self.started_at = None
+        try:
+            if self.started_at:
+                logging.info('CHECKPOINT_JOURNAL.OPEN: Resuming Run; %d Groups Finished', len(self.groups))
+                # pylint: disable=consider-using-with
+                self.stream = open(self.filename, 'a')
+                if self.truncated:
+                    # Keeps the next entry off the incomplete last line
+                    self.stream.write('\n')
+            else:
+                self.started_at = time.time()
+                self.stream = open(self.filename, 'w')
+                self._append({'type': 'start', 'at': self.started_at})
+        except OSError as err:
+            logging.error('CHECKPOINT_JOURNAL.OPEN: Cannot Write Journal: %s', self.filename)
+            logging.error(err)
+            raise exceptions.CheckpointJournalException('CHECKPOINT_JOURNAL.OPEN: Cannot Write Journal') from err
+        return self
+
+    def _replay(self):
+        """
+        Loads the entries in the file
+        An incomplete last line is ignored; the process may have stopped while writing it
+        """
+        try:
+            with open(self.filename) as stream:
+                lines = stream.read().split('\n')
+        except OSError as err:
+            logging.error('CHECKPOINT_JOURNAL.OPEN: Invalid Journal File: %s', self.filename)
+            logging.error(err)
+            raise exceptions.CheckpointJournalException('CHECKPOINT_JOURNAL.OPEN: Invalid Journal File') from err
+        # The last item is empty if the last line is complete
+        self.truncated = bool(lines[-1])
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry['type'] == 'start':
+                self.started_at = entry['at']
+            elif entry['type'] == 'group':
+                self.groups[entry['group']] = {'name': entry['name'], 'result': entry['result']}
+            elif entry['type'] == 'batch':
+                committed = self.batches.setdefault(str(entry['group']), {}).setdefault(entry['op'], set())
+                committed.update(entry['ids'])
+
+    def _append(self, entry):
+        """
+        Writes the entry and flushes it to the disk
+        """
+        with self.lock:
+            self.stream.write(json.dumps(entry) + '\n')
+            self.stream.flush()
+            os.fsync(self.stream.fileno())
+
+    def get_group_result(self, group_id):
+        """
+        Returns the name and the result of AD group finished in the run; None if not finished
+        """
+        group = self.groups.get(group_id)
+        if not group:
+            return None
+        return group['name'], group['result']
+
+    def finish_group(self, group_id, name, result):
+        """
+        Records AD group finished with the result
+        """
+        result = contact_records.to_json_data(result)
+        self.groups[group_id] = {'name': name, 'result': result}
+        self._append({'type': 'group', 'group': group_id, 'name': name, 'result': result})
+
+    def get_committed(self, group_id, operation):
+        """
+        Returns the set of externalIds written to Everbridge group by the operation before the run was interrupted
+        """
+        return self.batches.get(str(group_id), {}).get(operation, frozenset())
+
+    def commit_batch(self, group_id, operation, external_ids):
+        """
+        Records the batch written to Everbridge group by the operation
+        """
+        if not external_ids:
+            return
+        self._append({'type': 'batch', 'group': group_id, 'op': operation, 'ids': list(external_ids)})
+
+    def finish(self):
+        """
+        Removes the journal after the run completes
+        """
+        self.close()
+        if exists(self.filename):
+            os.remove(self.filename)
+        self.groups = {}
+        self.batches = {}
+
+    def close(self):
+        """
+        Closes the journal file leaving it for the next run
+        """
+        if self.stream:
+            self.stream.close()
+            self.stream = None
@@ -0,0 +1,135 @@
+"""
+Compact contact records used in place of Graph and Everbridge JSON dictionaries
+"""
+from collections.abc import MutableMapping
+
+class Record(MutableMapping):
+    """
+    Dictionary-like record that keeps known attributes in slots
+    Unknown attributes are kept in a dictionary created only when needed
+    CONSTANTS are attributes shared by all the records of the class; they are not stored per record
+    Constant attributes cannot be deleted
+    """
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    CONSTANTS = {}
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data:
+            for key, val in data.items():
+                self[key] = val
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns the record made from the dictionary; returns data as it is if already the record
+        """
+        if isinstance(data, cls):
+            return data
+        return cls(data)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        if key in self.CONSTANTS:
+            return self.CONSTANTS[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, val):
+        if key in self.FIELDS:
+            setattr(self, key, val)
+            return
+        if key in self.CONSTANTS:
+            const = self.CONSTANTS[key]
+            # 0 == False; the type must match as well
+            if type(val) is type(const) and val == const:
+                if self._extra:
+                    self._extra.pop(key, None)
+                return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = val
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+                return
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra and key in self._extra and key not in self.CONSTANTS:
+            del self._extra[key]
+            return
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        extra = self._extra or {}
+        for key in self.CONSTANTS:
+            if key not in extra:
+                yield key
+        yield from extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def copy(self):
+        """
+        Returns a shallow copy of the record
+        """
+        return type(self)(self)
+
+    def to_dict(self):
+        """
+        Returns the dictionary for JSON encoding
+        """
+        return {key: to_json_data(val) for key, val in self.items()}
+
+class AdContact(Record):
+    """
+    Azure AD user validated for the sync
+    """
+    FIELDS = ('id', 'userPrincipalName', 'givenName', 'surname', 'displayName', 'mail',
+              'businessPhones', 'mobilePhone', 'fixed', 'errors')
+    __slots__ = FIELDS
+
+class EverbridgeContact(Record):
+    """
+    Everbridge contact converted from AD contact
+    """
+    # The default 'Employee' record type; see contact_utils.convert_to_everbridge
+    RECORD_TYPE_ID = 892807736729062
+    FIELDS = ('id', 'externalId', 'firstName', 'lastName', 'paths', 'groups', 'errors', 'fingerprint')
+    CONSTANTS = {'recordTypeId': RECORD_TYPE_ID}
+    __slots__ = FIELDS
+
+class ContactPath(Record):
+    """
+    Everbridge contact path; attributes common to all the paths are not stored per path
+    """
+    FIELDS = ('pathId', 'countryCode', 'value', 'phoneExt')
+    CONSTANTS = {'waitTime': 0, 'status': 'A', 'skipValidation': False}
+    __slots__ = FIELDS
+
+def to_json_data(data):
+    """
+    Returns data with records replaced by dictionaries; called before sending data or encoding JSON
+    """
+    if isinstance(data, Record):
+        return data.to_dict()
+    if isinstance(data, list):
+        return [to_json_data(val) for val in data]
+    if isinstance(data, dict):
+        return {key: to_json_data(val) for key, val in data.items()}
+    return data
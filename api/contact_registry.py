@@ -0,0 +1,108 @@
+"""
+Shares AD contacts and Everbridge contacts among groups synced in a run
+"""
+import threading
+from . import contact_utils
+from . import contact_validator
+
+class ContactRegistry:
+    """
+    Keeps contacts by userPrincipalName (externalId in Everbridge) for a run
+    Each AD contact is validated and converted once; each contact is upserted at most once
+    """
+    UPSERT_PENDING = 'PENDING'
+    UPSERT_DONE = 'DONE'
+    UPSERT_FAILED = 'FAILED'
+
+    def __init__(self):
+        self.ad_contacts = {}
+        self.converted = {}
+        self.everbridge_contacts = {}
+        self.upserts = {}
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def validate(self, contact):
+        """
+        Returns the validated AD contact; validates it only the first time
+        """
+        upn = contact.get('userPrincipalName')
+        with self.lock:
+            validated = self.ad_contacts.get(upn)
+        if validated:
+            return validated
+        validated = contact_validator.validate_and_fix_azure_contact(contact)
+        with self.lock:
+            # Validation may fix userPrincipalName
+            self.ad_contacts[upn] = validated
+            return self.ad_contacts.setdefault(validated['userPrincipalName'], validated)
+
+    def convert(self, contact, ever_id=None):
+        """
+        Returns a copy of Everbridge contact converted from the AD contact; converts it only the first time
+        """
+        upn = contact['userPrincipalName']
+        with self.lock:
+            converted = self.converted.get(upn)
+        if not converted:
+            converted = contact_utils.convert_to_everbridge(contact)
+            with self.lock:
+                converted = self.converted.setdefault(upn, converted)
+        # ContactTracker removes errors from the contact it keeps
+        converted = converted.copy()
+        if ever_id:
+            converted['id'] = ever_id
+        return converted
+
+    def add_everbridge_contact(self, contact):
+        """
+        Keeps Everbridge contact found in a group
+        """
+        with self.lock:
+            self.everbridge_contacts[contact['externalId']] = contact
+
+    def get_everbridge_contact(self, external_id):
+        """
+        Returns Everbridge contact found in any group in the run; None if not found
+        """
+        with self.lock:
+            return self.everbridge_contacts.get(external_id)
+
+    def claim_upserts(self, contacts):
+        """
+        Returns the contacts the caller must upsert and the externalIds upserted by other groups
+        """
+        claimed = []
+        others = []
+        with self.lock:
+            for contact in contacts:
+                external_id = contact['externalId']
+                if external_id in self.upserts:
+                    others.append(external_id)
+                else:
+                    self.upserts[external_id] = ContactRegistry.UPSERT_PENDING
+                    claimed.append(contact)
+        return claimed, others
+
+    def finish_upserts(self, contacts, failed_ids):
+        """
+        Marks the claimed contacts as upserted or failed
+        """
+        with self.condition:
+            for contact in contacts:
+                external_id = contact['externalId']
+                if external_id in failed_ids:
+                    self.upserts[external_id] = ContactRegistry.UPSERT_FAILED
+                else:
+                    self.upserts[external_id] = ContactRegistry.UPSERT_DONE
+            self.condition.notify_all()
+
+    def wait_upserts(self, external_ids):
+        """
+        Waits until other groups finish upserting the contacts
+        Returns externalIds failed to be upserted
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: all(
+                self.upserts[eid] != ContactRegistry.UPSERT_PENDING for eid in external_ids))
+            return [eid for eid in external_ids if self.upserts[eid] == ContactRegistry.UPSERT_FAILED]
@@ -7,19 +7,35 @@ from . import exceptions
 class ContactTracker:
     """
     Keeps track of contacts in the list according to the operation
+    If keep_contacts is False, only counts them; the listener must handle each contact then
     """
     ERROR_CONTACT = 'ERROR_CONTACT'
     INSERT_CONTACT = 'INSERT_CONTACT'
     UPDATE_CONTACT = 'UPDATE_CONTACT'
     REMOVE_MEMBER = 'REMOVE_MEMBER'
 
-    def __init__(self):
+    def __init__(self, keep_contacts=True):
         self.error_contacts = []
         self.new_contacts = []
         self.updated_contacts = []
         self.obsolete_contacts = []
         self.obsolete_members = []
         self.new_members = []
+        self.failed_contacts = []
+        self.suppressed_updates = 0
+        self.listener = None
+        self.keep_contacts = keep_contacts
+        self.counts = {ContactTracker.ERROR_CONTACT: 0, ContactTracker.INSERT_CONTACT: 0,
+                       ContactTracker.UPDATE_CONTACT: 0, ContactTracker.REMOVE_MEMBER: 0}
+        self.deleted_count = 0
+        self.added_count = 0
+        self.failed_count = 0
+
+    def set_failed_contacts(self, contacts):
+        """
+        Sets contacts that Everbridge failed to upsert
+        """
+        self.failed_contacts = contacts
 
     def set_new_members(self, members):
         """
@@ -27,26 +43,71 @@ class ContactTracker:
         """
         self.new_members = members
 
+    def set_obsolete_members(self, members):
+        """
+        Sets obsolete members
+        """
+        self.obsolete_members = members
+
+    def set_listener(self, listener):
+        """
+        Sets the function called with optype and contact for each contact pushed except errors
+        """
+        self.listener = listener
+
+    def add_failed_contacts(self, contacts):
+        """
+        Adds contacts that Everbridge failed to upsert
+        """
+        self.failed_count += len(contacts)
+        if self.keep_contacts:
+            self.failed_contacts = self.failed_contacts + contacts
+
+    def add_new_members(self, members):
+        """
+        Adds members added to the group
+        """
+        self.added_count += len(members)
+        if self.keep_contacts:
+            self.new_members = self.new_members + members
+
+    def add_deleted_contacts(self, ids):
+        """
+        Adds IDs of contacts deleted since they belong to no groups
+        """
+        self.deleted_count += len(ids)
+        if self.keep_contacts:
+            self.obsolete_contacts = self.obsolete_contacts + ids
+
+    def count_suppressed_update(self):
+        """
+        Counts a contact that differs from Everbridge only in path order, format or server attributes
+        """
+        self.suppressed_updates += 1
+
     def push(self, optype, contact):
         """
         Keeps track of contacts in the list according to the operation
         """
         if contact.get('errors', False):
             del contact['errors']
-            self.error_contacts.append(contact)
+            self._keep(ContactTracker.ERROR_CONTACT, contact)
         else:
             contact.pop('errors', None)
-            if optype == ContactTracker.INSERT_CONTACT:
-                self.new_contacts.append(contact)
-            elif optype == ContactTracker.UPDATE_CONTACT:
-                self.updated_contacts.append(contact)
-            elif optype == ContactTracker.REMOVE_MEMBER:
-                self.obsolete_members.append(contact)
-            elif optype == ContactTracker.ERROR_CONTACT:
-                self.error_contacts.append(contact)
-            else:
+            if optype not in self.counts:
                 msg = 'CONTACT_TRACKER.PUSH: OPTYPE NOT SUPPORTED ' + optype
                 raise exceptions.ContactTrackerException(msg)
+            self._keep(optype, contact)
+            if self.listener and optype != ContactTracker.ERROR_CONTACT:
+                self.listener(optype, contact)
+
+    def _keep(self, optype, contact):
+        """
+        Counts the contact and keeps it in the list according to the operation
+        """
+        self.counts[optype] += 1
+        if self.keep_contacts:
+            self.get_contacts(optype).append(contact)
 
     def get_contacts(self, optype):
         """
@@ -68,23 +129,12 @@ class ContactTracker:
         """
         return self.updated_contacts + self.new_contacts
 
-    def get_inserted_contact_external_ids(self, per=100):
+    def get_inserted_external_id_list(self):
         """
-        Returns the list of externalIds from new_contacts
-        The list is divided into sublists per given number (default 100)
+        Returns the list of externalIds of new_contacts that were upserted successfully
         """
-        filters = []
-        ids = ""
-        cnt = 0
-        for contact in self.new_contacts:
-            cnt += 1
-            ids += '&externalIds=' + contact['externalId']
-            if cnt % per == 0:
-                filters.append(ids)
-                ids = ""
-        if ids:
-            filters.append(ids)
-        return filters
+        failed = {contact['externalId'] for contact in self.failed_contacts}
+        return [con['externalId'] for con in self.new_contacts if con['externalId'] not in failed]
 
     def get_remove_member_ids(self):
         """
@@ -96,23 +146,51 @@ class ContactTracker:
         """
         Returns the IDs of contacts which do/will not belong to any groups
         """
-        self.obsolete_contacts = []
-        for contact in self.obsolete_members:
-            # groups attribute contains ids of groups which the user belongs to
-            # we should delete the contact if the user belongs to only the current one
-            if 'groups' in contact:
-                if len(contact['groups']) == 1:
-                    self.obsolete_contacts.append(contact['id'])
+        self.obsolete_contacts = [con['id'] for con in self.obsolete_members
+                                  if ContactTracker.is_obsolete_contact(con)]
         return self.obsolete_contacts
 
+    @staticmethod
+    def is_obsolete_contact(contact):
+        """
+        Returns True if the contact removed from the group belongs to no other groups
+        """
+        # groups attribute contains ids of groups which the user belongs to
+        # we should delete the contact if the user belongs to only the current one
+        return 'groups' in contact and len(contact['groups']) == 1
+
     def report(self):
         """
         Returns size of each list
         """
-        return {
+        if not self.keep_contacts:
+            return self._report_counts()
+        report = {
             'inserted_contacts': len(self.new_contacts),
             'updated_contacts': len(self.updated_contacts),
             'deleted_contacts': len(self.obsolete_contacts),
             'added_members': len(self.new_members),
             'removed_members': len(self.obsolete_members),
             'error_contacts': len(self.error_contacts)}
+        if self.failed_contacts:
+            report['failed_contacts'] = len(self.failed_contacts)
+        if self.suppressed_updates:
+            report['suppressed_updates'] = self.suppressed_updates
+        return report
+
+    def _report_counts(self):
+        """
+        Returns the number of contacts counted for each operation
+        """
+        report = {
+            'inserted_contacts': self.counts[ContactTracker.INSERT_CONTACT],
+            'updated_contacts': self.counts[ContactTracker.UPDATE_CONTACT],
+            'deleted_contacts': self.deleted_count,
+            'added_members': self.added_count,
+            'removed_members': self.counts[ContactTracker.REMOVE_MEMBER],
+            'error_contacts': self.counts[ContactTracker.ERROR_CONTACT]}
+        if self.failed_count:
+            report['failed_contacts'] = self.failed_count
+        if self.suppressed_updates:
+            report['suppressed_updates'] = self.suppressed_updates
+        return report
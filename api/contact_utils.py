@@ -1,6 +1,55 @@
 """
 Contact Utility Functions
 """
+import hashlib
+import json
+from . import contact_records
+
+FINGERPRINT_KEYS = ('externalId', 'firstName', 'lastName', 'recordTypeId')
+
+def merge_key(external_id):
+    """
+    Returns the key AD members and Everbridge members are ordered and matched by
+    userPrincipalName and externalId are compared case-insensitively
+    """
+    return (external_id or '').casefold()
+
+def normalize_path_value(value):
+    """
+    Returns path value comparable regardless of its format
+    Emails are lowercased; phone numbers are reduced to digits without the US country code
+    """
+    value = str(value or '').strip()
+    if '@' in value:
+        return value.lower()
+    digits = ''.join(ch for ch in value if ch.isdigit())
+    if len(digits) == 11 and digits.startswith('1'):
+        return digits[1:]
+    return digits
+
+def canonical_paths(paths):
+    """
+    Returns sorted (pathId, value, extension) of paths; other path attributes are ignored
+    """
+    return sorted((str(path.get('pathId')),
+                   normalize_path_value(path.get('value')),
+                   normalize_path_value(path.get('phoneExt'))) for path in paths or [])
+
+def fingerprint(contact):
+    """
+    Returns the content hash of Everbridge Contact
+    Only attributes the sync sets count; paths count regardless of their order and format
+    """
+    content = [contact.get(key) or '' for key in FINGERPRINT_KEYS]
+    content.append(canonical_paths(contact.get('paths')))
+    return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+def get_fingerprint(contact):
+    """
+    Returns the fingerprint stored with the contact; computes it if not stored
+    """
+    return contact.get('fingerprint') or fingerprint(contact)
+
 def extract_attributes_for_comparison(contact):
     """
     Returns Everbridge Contact which has the minimum set of attributes needed for comparison
@@ -11,6 +60,13 @@ def extract_attributes_for_comparison(contact):
 def is_different(con_ad, con_ev):
     """
     Returns True if Everbridge Contact is different from AD Contact
+    Paths are compared by pathId, value and extension regardless of their order and format
+    """
+    return fingerprint(con_ad) != get_fingerprint(con_ev)
+
+def is_literally_different(con_ad, con_ev):
+    """
+    Returns True if the attributes for comparison are not exactly the same
     """
     extracted_ad = extract_attributes_for_comparison(con_ad)
     extracted_ev = extract_attributes_for_comparison(con_ev)
@@ -27,13 +83,12 @@ def convert_to_everbridge(contact, ever_id=None):
     # There is only 1 record type in the org but more can be added.
     # To manage Record Types, go to Settings -> Contacts and Groups-> Contact Record Types.
     # https://api.everbridge.net/rest/recordTypes/org
-    new_contact = {
-        'firstName': contact['givenName'],
-        'lastName': contact['surname'],
-        'externalId': contact['userPrincipalName'],
-        'recordTypeId': 892807736729062,
-        'paths': create_everbridge_contact_paths(contact)
-    }
+    new_contact = contact_records.EverbridgeContact()
+    new_contact['firstName'] = contact['givenName']
+    new_contact['lastName'] = contact['surname']
+    new_contact['externalId'] = contact['userPrincipalName']
+    new_contact['recordTypeId'] = contact_records.EverbridgeContact.RECORD_TYPE_ID
+    new_contact['paths'] = create_everbridge_contact_paths(contact)
     new_contact['errors'] = contact.get('errors', False)
     if ever_id:
         new_contact['id'] = ever_id
@@ -62,13 +117,10 @@ def create_email_path(email):
     """
     Creates EverBridge Email path
     """
-    return {
-        'waitTime': 0,
-        'status': 'A',
-        'pathId': 241901148045316,
-        'value': email,
-        'skipValidation': False
-    }
+    path = contact_records.ContactPath()
+    path['pathId'] = 241901148045316
+    path['value'] = email
+    return path
 
 def create_business_phone_path(phone):
     """
@@ -78,13 +130,7 @@ def create_business_phone_path(phone):
     # pylint: disable=unused-variable
     if 'x' in phone:
         phone, extension, *ignore = phone.split('x')
-    path = {
-        'waitTime': 0,
-        'status': 'A',
-        'pathId': 241901148045321,
-        'countryCode': 'US',
-        'value': phone,
-        'skipValidation': False}
+    path = create_phone_path(241901148045321, phone)
     if extension:
         path['phoneExt'] = extension
     return path
@@ -93,24 +139,20 @@ def create_mobile_phone_path(mobile_phone):
     """
     Creates EverBridge business phone path
     """
-    return {
-        'waitTime': 0,
-        'status': 'A',
-        'pathId': 241901148045319,
-        'countryCode': 'US',
-        'value': mobile_phone,
-        'skipValidation': False
-    }
+    return create_phone_path(241901148045319, mobile_phone)
 
 def create_sms_path(mobile_phone):
     """
     Creates EverBridge SMS path
     """
-    return {
-        'waitTime': 0,
-        'status': 'A',
-        'pathId': 241901148045324,
-        'countryCode': 'US',
-        'value': mobile_phone,
-        'skipValidation': False
-    }
+    return create_phone_path(241901148045324, mobile_phone)
+
+def create_phone_path(path_id, phone):
+    """
+    Creates EverBridge phone path in US
+    """
+    path = contact_records.ContactPath()
+    path['pathId'] = path_id
+    path['countryCode'] = 'US'
+    path['value'] = phone
+    return path
@@ -3,6 +3,7 @@ Contact Validation Functions
 """
 import re
 import logging
+from . import contact_records
 
 class ContactValidationResult:
     """
@@ -264,7 +265,9 @@ def fix_azure_contact(contact, validated):
 def validate_and_fix_azure_contact(contact):
     """
     Validates valuees in AD Contact and fixes errors if possible
+    Returns the fixed contact as AdContact record
     """
+    contact = contact_records.AdContact.from_dict(contact)
     rslt = validate_azure_contact(contact)
     contact['errors'] = True
     if rslt.has_valid_name() and rslt.has_valid_paths():
@@ -0,0 +1,170 @@
+"""
+Keeps Azure AD group delta links between runs
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from os.path import exists
+from . import exceptions
+
+class DeltaState:
+    """
+    Stores deltaLink and members (AD object id => userPrincipalName) per AD group in SQLite
+    Each group is a row; saving writes only the groups changed since the last save
+    """
+    DEFAULT_FULL_SYNC_INTERVAL = 24 * 60 * 60
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS groups ('
+        ' group_id TEXT PRIMARY KEY, delta_link TEXT, full_sync_at REAL NOT NULL, members TEXT NOT NULL)',)
+    SQLITE_HEADER = b'SQLite format 3\x00'
+
+    def __init__(self, filename, full_sync_interval=None):
+        self.filename = filename
+        self.full_sync_interval = full_sync_interval or DeltaState.DEFAULT_FULL_SYNC_INTERVAL
+        self.groups = {}
+        self.changed = set()
+        self.conn = None
+        # Groups may be synced concurrently
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Opens the state file and loads the state of every group
+        Converts the JSON file of earlier versions
+        """
+        legacy = self._open()
+        try:
+            rows = self.conn.execute(
+                'SELECT group_id, delta_link, full_sync_at, members FROM groups').fetchall()
+        except sqlite3.Error as err:
+            logging.error('DELTA_STATE.LOAD: Invalid State File: %s', self.filename)
+            logging.error(err)
+            raise exceptions.AzureException('DELTA_STATE.LOAD: Invalid State File') from err
+        self.groups = {}
+        for group_id, delta_link, full_sync_at, members in rows:
+            self.groups[group_id] = {
+                'deltaLink': delta_link,
+                'fullSyncAt': full_sync_at,
+                'members': json.loads(members)}
+        self.changed = set()
+        if legacy:
+            self.groups.update(legacy)
+            self.changed.update(legacy)
+            self.save()
+        return self
+
+    def _open(self):
+        """
+        Opens the database and creates the table if not exists
+        Returns the groups in the JSON state file of earlier versions if converted
+        """
+        legacy = self._read_legacy_file()
+        try:
+            self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+            with self.conn:
+                for sql in DeltaState.SCHEMA:
+                    self.conn.execute(sql)
+        except sqlite3.Error as err:
+            logging.error('DELTA_STATE.OPEN: Invalid State File: %s', self.filename)
+            logging.error(err)
+            raise exceptions.AzureException('DELTA_STATE.OPEN: Invalid State File') from err
+        return legacy
+
+    def _read_legacy_file(self):
+        """
+        Returns the groups in the JSON state file of earlier versions and removes the file
+        Returns None if the file does not exist or is already SQLite
+        """
+        if not exists(self.filename) or os.path.getsize(self.filename) == 0:
+            return None
+        try:
+            with open(self.filename, 'rb') as stream:
+                if stream.read(len(DeltaState.SQLITE_HEADER)) == DeltaState.SQLITE_HEADER:
+                    return None
+            with open(self.filename) as stream:
+                groups = json.load(stream)
+        except Exception as err:
+            logging.error('DELTA_STATE.LOAD: Invalid State File: %s', self.filename)
+            logging.error(err)
+            raise exceptions.AzureException('DELTA_STATE.LOAD: Invalid State File') from err
+        os.remove(self.filename)
+        return groups
+
+    def save(self):
+        """
+        Writes the groups changed since the last save in one transaction
+        """
+        if not self.conn:
+            self._open()
+        with self.lock:
+            updated = [(group_id, group.get('deltaLink'), group.get('fullSyncAt', 0),
+                        json.dumps(group.get('members', {})))
+                       for group_id, group in self.groups.items() if group_id in self.changed]
+            removed = [(group_id,) for group_id in self.changed if group_id not in self.groups]
+            self.changed = set()
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO groups (group_id, delta_link, full_sync_at, members)'
+                    ' VALUES (?, ?, ?, ?)', updated)
+                self.conn.executemany('DELETE FROM groups WHERE group_id = ?', removed)
+
+    def close(self):
+        """
+        Closes the state file
+        """
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def get_delta_link(self, group_id):
+        """
+        Returns deltaLink of the group if the saved state is still usable; None otherwise
+        """
+        group = self.groups.get(group_id)
+        if not group or not group.get('deltaLink'):
+            return None
+        # Membership deltas do not carry attribute changes; resync everything periodically
+        if time.time() - group.get('fullSyncAt', 0) > self.full_sync_interval:
+            return None
+        return group['deltaLink']
+
+    def get_members(self, group_id):
+        """
+        Returns the dictionary(<AD object id>, <userPrincipalName>) of the group
+        """
+        group = self.groups.get(group_id)
+        if not group:
+            return {}
+        return group.get('members', {})
+
+    def set_full_sync(self, group_id, delta_link, members):
+        """
+        Replaces the state of the group after a full sync
+        """
+        with self.lock:
+            self.groups[group_id] = {
+                'deltaLink': delta_link,
+                'fullSyncAt': time.time(),
+                'members': members}
+            self.changed.add(group_id)
+
+    def set_delta_sync(self, group_id, delta_link, members):
+        """
+        Updates deltaLink and members of the group after an incremental sync
+        """
+        with self.lock:
+            group = self.groups.setdefault(group_id, {'fullSyncAt': 0})
+            group['deltaLink'] = delta_link
+            group['members'] = members
+            self.changed.add(group_id)
+
+    def reset(self, group_id):
+        """
+        Forgets the state of the group
+        """
+        with self.lock:
+            self.groups.pop(group_id, None)
+            self.changed.add(group_id)
@@ -2,9 +2,240 @@
 Requests Client Crediential Token and then performs API call to get Login Events
 """
 import base64
+import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists
 import requests
+from . import contact_records
 from . import exceptions 
+from . import rate_control
+
+class GroupDirectory:
+    """
+    Keeps Everbridge group ids by group name
+    Filled by listing all groups of the org; optionally saved in a file until the TTL passes
+    """
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, filename=None, ttl=None):
+        self.filename = filename
+        self.ttl = ttl or GroupDirectory.DEFAULT_TTL
+        self.groups = None
+        self.loaded_at = 0
+        self.lock = threading.RLock()
+
+    def is_loaded(self):
+        """
+        Returns True if the directory holds groups that are not older than the TTL
+        """
+        return self.groups is not None and time.time() - self.loaded_at <= self.ttl
+
+    def load(self):
+        """
+        Loads groups from the file if it is not older than the TTL
+        Returns True if loaded
+        """
+        if not self.filename or not exists(self.filename):
+            return False
+        try:
+            with open(self.filename) as stream:
+                data = json.load(stream)
+            if time.time() - data['loadedAt'] > self.ttl:
+                return False
+            with self.lock:
+                self.groups = data['groups']
+                self.loaded_at = data['loadedAt']
+        except (ValueError, KeyError, TypeError) as err:
+            logging.error('GROUP_DIRECTORY.LOAD: Invalid Cache File: %s', self.filename)
+            logging.error(err)
+            return False
+        return True
+
+    def save(self):
+        """
+        Saves groups to the file if the filename is given
+        """
+        if not self.filename:
+            return
+        tmpfile = self.filename + '.tmp'
+        with self.lock:
+            with open(tmpfile, 'w') as stream:
+                json.dump({'loadedAt': self.loaded_at, 'groups': self.groups}, stream)
+            os.replace(tmpfile, self.filename)
+
+    def fill(self, groups):
+        """
+        Replaces the directory with the list of groups
+        """
+        with self.lock:
+            self.groups = {group['name']: group['id'] for group in groups if 'name' in group}
+            self.loaded_at = time.time()
+            self.save()
+
+    def get(self, name):
+        """
+        Returns the group id; None if not found
+        """
+        with self.lock:
+            return (self.groups or {}).get(name)
+
+    def add(self, name, group_id):
+        """
+        Adds the group
+        """
+        with self.lock:
+            if self.groups is None:
+                return
+            self.groups[name] = group_id
+            self.save()
+
+    def remove(self, group_id):
+        """
+        Removes the group by group id
+        """
+        with self.lock:
+            if self.groups is None:
+                return
+            for name in [name for name, gid in self.groups.items() if gid == group_id]:
+                del self.groups[name]
+            self.save()
+
+# Requests that failed with these errors may succeed when retried
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def is_server_error(res):
+    """
+    Returns True if the response reports 5xx status
+    """
+    status = res.get('status') if isinstance(res, dict) else None
+    return isinstance(status, int) and status >= 500
+
+def is_transient_error(error, transient_errors=TRANSIENT_ERRORS):
+    """
+    Returns True if the request may succeed when retried
+    i.e. Everbridge responded with 5xx status, the connection failed or the request timed out
+    """
+    return isinstance(error, exceptions.EverbridgeServerException) or \
+        isinstance(error.__cause__, transient_errors)
+
+def raise_unexpected(caller, res):
+    """
+    Logs the unexpected response and raises EverbridgeException
+    Raises EverbridgeServerException if the response reports 5xx status
+    """
+    msg = caller + ': Unexpected Response'
+    logging.error(msg)
+    logging.error(res)
+    if is_server_error(res):
+        raise exceptions.EverbridgeServerException(msg)
+    raise exceptions.EverbridgeException(msg)
+
+def check_response(caller, res, key):
+    """
+    Returns the value of key in the response; raises EverbridgeException if missing
+    """
+    if not res or key not in res:
+        raise_unexpected(caller, res)
+    return res[key]
+
+def check_code(caller, rslt):
+    """
+    Raises EverbridgeException unless the response of the write request has code 100
+    """
+    if not rslt or rslt.get('code') != 100:
+        raise_unexpected(caller, rslt)
+    return rslt
+
+def check_message(caller, rslt):
+    """
+    Raises EverbridgeException unless the response of the group request has message OK
+    """
+    if not rslt or rslt.get('message') != 'OK':
+        logging.error('%s: Unexpected Response', caller)
+        logging.error(rslt)
+        raise exceptions.EverbridgeException(caller + ': Failed')
+    return rslt
+
+def api_url(base, org, param=None):
+    """
+    Returns the API URL of the org
+    """
+    rslt = base + org
+    if param:
+        rslt += '/' + str(param)
+    return rslt
+
+def external_ids_params(external_ids):
+    """
+    Returns the query string of contacts by externalIds; e.g. '&externalIds=aaa&externalIds=bbb'
+    """
+    return '?sortBy=externalId&direction=ASC&searchType=AND' + external_ids
+
+def external_id_filters(external_ids, per=100):
+    """
+    Returns the externalIds query strings of per given number (default 100) externalIds
+    """
+    return [''.join('&externalIds=' + exid for exid in external_ids[i:i + per])
+            for i in range(0, len(external_ids), per)]
+
+def groups_page_params(pagesize, page):
+    """
+    Returns the query string of a page of groups
+    """
+    return f"?pageSize={pagesize}&pageNumber={page}"
+
+def group_members_params(group_id, pagesize, page):
+    """
+    Returns the query string of a page of group members ordered by externalId
+    """
+    return f"?groupIds={group_id}&pageSize={pagesize}&pageNumber={page}&sortBy=externalId&direction=ASC"
+
+def contact_count_params(group_id=None):
+    """
+    Returns the query string of a page of one contact that carries totalCount
+    """
+    params = "?pageSize=1&pageNumber=1"
+    if group_id:
+        params += f"&groupIds={group_id}"
+    return params
+
+def group_contacts_params(group_id, id_type='id'):
+    """
+    Returns the parameters of adding contacts to or removing contacts from the group
+    id_type: contacts are given by ids (id) or externalIds (externalId)
+    """
+    return 'contacts?byType=id&groupId=' + str(group_id) + '&idType=' + id_type
+
+def upsert_chunks(contacts):
+    """
+    Divides contacts into chunks of MAX_UPSERT_CONTACTS
+    """
+    size = Everbridge.MAX_UPSERT_CONTACTS
+    return [contacts[i:i + size] for i in range(0, len(contacts), size)]
+
+def merge_upsert_results(caller, contacts, chunks, results):
+    """
+    Merges [result, error] of the chunks into one upsert result
+    Raises EverbridgeException if all the chunks failed
+    """
+    succeeded = []
+    failed = []
+    error = None
+    for chunk, (rslt, err) in zip(chunks, results):
+        if err:
+            failed += chunk
+            error = err
+        else:
+            succeeded.append(rslt)
+    if chunks and not succeeded:
+        raise exceptions.EverbridgeException(caller + ': Failed') from error
+    if failed:
+        logging.error('%s: %d of %d Contacts Failed', caller, len(failed), len(contacts))
+    return {'code': 100, 'message': 'OK', 'results': succeeded, 'failed_contacts': failed}
 
 class Everbridge:
     """
@@ -15,6 +246,11 @@ class Everbridge:
     API_CONTACTS_GROUPS = API_BASE + 'contacts/groups/'
     API_GROUPS = API_BASE + 'groups/'
     DEFAULT_PAGESIZE = 100
+    DEFAULT_MAX_CONCURRENCY = 4
+    MAX_UPSERT_CONTACTS = 1000
+    UPSERT_RETRIES = 2
+    # Seconds to connect and to wait for each response
+    DEFAULT_TIMEOUT = (10, 60)
 
     def __init__(self, org, username, password):
         self.headers = Everbridge.create_authheader(username, password)
@@ -22,6 +258,10 @@ class Everbridge:
         self.session.headers.update(self.headers)
         self.org = org
         self.pagesize = Everbridge.DEFAULT_PAGESIZE
+        self.max_concurrency = Everbridge.DEFAULT_MAX_CONCURRENCY
+        self.rate_control = rate_control.RateControl('EVERBRIDGE', self.max_concurrency)
+        self.timeout = Everbridge.DEFAULT_TIMEOUT
+        self.group_directory = None
 
     @staticmethod
     def create_authheader(username, password):
@@ -43,32 +283,70 @@ class Everbridge:
         """
         self.pagesize = pagesize
 
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Sets the maximum number of requests sent to Everbridge API at the same time
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_control = rate_control.RateControl('EVERBRIDGE', max_concurrency, self.rate_control.max_retries)
+
+    def set_timeout(self, connect=None, read=None):
+        """
+        Sets seconds to connect to Everbridge API and to wait for each response
+        The timeout not given keeps its default
+        """
+        self.timeout = (connect or Everbridge.DEFAULT_TIMEOUT[0], read or Everbridge.DEFAULT_TIMEOUT[1])
+
+    def set_max_retries(self, max_retries):
+        """
+        Sets the number of times a throttled request is retried
+        """
+        self.rate_control.set_max_retries(max_retries)
+
+    def set_deadline(self, deadline):
+        """
+        Sets epoch seconds after which throttled requests are not retried
+        """
+        self.rate_control.set_deadline(deadline)
+
+    def get_rate_report(self):
+        """
+        Returns the counters of requests, throttled responses and retries
+        """
+        return self.rate_control.report()
+
+    def _send(self, method, url, **kwargs):
+        """
+        Sends HTTP request through the session within the adaptive concurrency limit of the endpoint
+        Throttled requests are retried
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        family = rate_control.endpoint_family(url, Everbridge.API_BASE)
+        return self.rate_control.send(family, lambda: getattr(self.session, method)(url, **kwargs))
+
+    def set_group_directory(self, group_directory):
+        """
+        Sets GroupDirectory that serves group ids by name
+        """
+        self.group_directory = group_directory
+
     def contacts_url(self, param=None):
         """
         Returns authority URL for authentication context
         """
-        url = Everbridge.API_CONTACTS +  self.org
-        if param:
-            url += '/' + str(param)
-        return url
+        return api_url(Everbridge.API_CONTACTS, self.org, param)
 
     def groups_url(self, param=None):
         """
         Returns authority URL for authentication context
         """
-        url = Everbridge.API_GROUPS +  self.org
-        if param:
-            url += '/' + str(param)
-        return url
+        return api_url(Everbridge.API_GROUPS, self.org, param)
 
     def contacts_groups_url(self, param=None):
         """
         Returns authority URL for authentication context
         """
-        url = Everbridge.API_CONTACTS_GROUPS +  self.org
-        if param:
-            url += '/' + str(param)
-        return url
+        return api_url(Everbridge.API_CONTACTS_GROUPS, self.org, param)
 
     def update_header(self, header):
         """
@@ -88,7 +366,7 @@ class Everbridge:
         Sends POST HTTP request
         """
         try:
-            resp = self.session.post(url, json=data)
+            resp = self._send('post', url, json=contact_records.to_json_data(data))
             return resp.json()
         except Exception as error:
             logging.error(error)
@@ -100,9 +378,9 @@ class Everbridge:
         """
         try:
             if data:
-                resp = self.session.delete(url, json=data)
+                resp = self._send('delete', url, json=contact_records.to_json_data(data))
             else:
-                resp = self.session.delete(url)
+                resp = self._send('delete', url)
             return resp.json()
         except Exception as error:
             logging.error(error)
@@ -114,9 +392,9 @@ class Everbridge:
         """
         try:
             if data:
-                resp = self.session.get(url, json=data)
+                resp = self._send('get', url, json=contact_records.to_json_data(data))
             else:
-                resp = self.session.get(url)
+                resp = self._send('get', url)
             return resp.json()
         except Exception as error:
             logging.error(error)
@@ -127,7 +405,7 @@ class Everbridge:
         Sends PUT HTTP request
         """
         try:
-            resp = self.session.put(url, json=data)
+            resp = self._send('put', url, json=contact_records.to_json_data(data))
             return resp.json()
         except Exception as error:
             logging.error(error)
@@ -140,32 +418,68 @@ class Everbridge:
         if not external_ids:
             msg = 'EVERBRIDGE.GET_CONTACTS_BY_EXTERNAL_IDS: No External IDs Provided'
             raise exceptions.EverbridgeException(msg)
-        url = self.contacts_url('?sortBy=externalId&direction=ASC&searchType=AND' + external_ids)
-        res = self._get(url)
-        if 'page' not in res:
-            msg = 'EVERBRIDGE.GET_CONTACTS_BY_EXTERNAL_IDS: Unexpected Response'
-            logging.error(msg)
-            logging.error(res)
-            raise exceptions.EverbridgeException(msg)
-        if 'data' not in res['page']:
-            return []
-        return res['page']['data']
+        res = self._get(self.contacts_url(external_ids_params(external_ids)))
+        return check_response('EVERBRIDGE.GET_CONTACTS_BY_EXTERNAL_IDS', res, 'page').get('data') or []
+
+    def get_contacts_by_external_id_list(self, external_ids, per=100):
+        """
+        Gets contacts from Everbridge by the list of externalIds
+        The list is divided into requests per given number (default 100) sent at the same time
+        """
+        filters = external_id_filters(external_ids, per)
+        if len(filters) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(filters), self.max_concurrency)) as executor:
+                pages = list(executor.map(self.get_contacts_by_external_ids, filters))
+        else:
+            pages = [self.get_contacts_by_external_ids(ids) for ids in filters]
+        return [contact for page in pages for contact in page]
+
+    def _upsert_chunk(self, contacts):
+        """
+        Upserts contacts to everbridge org in a single request
+        """
+        rslt = self._post(self.contacts_url('batch?version=1'), data=contacts)
+        return check_code('EVERBRIDGE.UPSERT_CONTACTS', rslt)
+
+    def _upsert_chunk_with_retry(self, contacts):
+        """
+        Upserts contacts and retries only this chunk if it fails transiently; see is_transient_error
+        Waits before each retry with the backoff of RateControl; does not retry after the deadline
+        Returns [result, None] if succeeds; [None, error] otherwise
+        """
+        error = None
+        for attempt in range(Everbridge.UPSERT_RETRIES + 1):
+            if attempt:
+                delay = self.rate_control.limit_delay(self.rate_control.get_retry_delay(None, attempt - 1))
+                if delay is None:
+                    break
+                time.sleep(delay)
+            try:
+                return [self._upsert_chunk(contacts), None]
+            except exceptions.EverbridgeException as err:
+                error = err
+                logging.error('EVERBRIDGE.UPSERT_CONTACTS: %d Contacts Failed (Attempt %d)',
+                              len(contacts), attempt + 1)
+                if not is_transient_error(err):
+                    break
+        return [None, error]
 
     def upsert_contacts(self, contacts):
         """
         Upserts contacts to everbridge org
         ?Version determines the batch API for insert values are 0 or 1
+        Contacts are sent in chunks of MAX_UPSERT_CONTACTS at the same time
+        Returns {'code': 100, 'message': 'OK', 'results': [<chunk result>], 'failed_contacts': [<contact>]}
         """
         if contacts is None:
             raise exceptions.EverbridgeException('EVERBRIDGE.UPSERT_CONTACTS: No Contacts Provided')
-        # TODO MAX contacts 1000
-        url = self.contacts_url('batch?version=1')
-        rslt = self._post(url, data=contacts)
-        if not rslt or 'code' not in rslt or rslt['code'] != 100:
-            logging.error('EVERBRIDGE.UPSERT_CONTACTS: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.UPSERT_CONTACTS: Unexpected Response')
-        return rslt
+        chunks = upsert_chunks(contacts)
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), self.max_concurrency)) as executor:
+                results = list(executor.map(self._upsert_chunk_with_retry, chunks))
+        else:
+            results = [self._upsert_chunk_with_retry(chunk) for chunk in chunks]
+        return merge_upsert_results('EVERBRIDGE.UPSERT_CONTACTS', contacts, chunks, results)
 
     def delete_contacts(self, contacts):
         """
@@ -174,11 +488,7 @@ class Everbridge:
         if not contacts:
             raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_CONTACTS: No Contacts Provided')
         rslt = self._delete(self.contacts_url('batch'), data=contacts)
-        if not rslt or 'code' not in rslt or rslt['code'] != 100:
-            logging.error('EVERBRIDGE.DELETE_CONTACTS: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_CONTACTS: Unexpected Response')
-        return rslt
+        return check_code('EVERBRIDGE.DELETE_CONTACTS', rslt)
 
     def get_group_by_name(self, name):
         """
@@ -187,45 +497,91 @@ class Everbridge:
         """
         if not name:
             raise exceptions.EverbridgeException('EVERBRIDGE.GET_GROUP_BY_NAME: No GroupName Provided')
-        params = f"{name}?queryType=name"
-        url = self.groups_url(params)
-        res = self._get(url)
-        if 'result' not in res:
-            logging.error('EVERBRIDGE.GET_GROUP_BY_NAME: Unexpected Response')
-            logging.error(res)
-            raise exceptions.EverbridgeException('EVERBRIDGE.GET_GROUP_BY_NAME: Unexpected Response')
-        return res['result']
+        res = self._get(self.groups_url(f"{name}?queryType=name"))
+        return check_response('EVERBRIDGE.GET_GROUP_BY_NAME', res, 'result')
 
     def get_group_id_by_name(self, name):
         """
         Gets Everbridge group id by group name
+        Served from GroupDirectory if set; queries by name only if the group is not found there
         """
         if not name:
             raise exceptions.EverbridgeException('EVERBRIDGE.GET_GROUP_ID_BY_NAME: No GroupName Provided')
-        res = self.get_group_by_name(name)
-        if 'id' not in res:
-            logging.error('EVERBRIDGE.GET_GROUP_ID_BY_NAME: Unexpected Response')
-            logging.error(res)
-            raise exceptions.EverbridgeException('EVERBRIDGE.GET_GROUP_ID_BY_NAME: Unexpected Response')
-        return res['id']
+        if self.group_directory:
+            self.load_group_directory()
+            group_id = self.group_directory.get(name)
+            if group_id:
+                return group_id
+        group_id = check_response('EVERBRIDGE.GET_GROUP_ID_BY_NAME', self.get_group_by_name(name), 'id')
+        if self.group_directory and group_id:
+            self.group_directory.add(name, group_id)
+        return group_id
 
-    def get_paged_group_members(self, group_id, page=1):
+    def get_groups_page(self, page=1):
         """
-        Gets Everbridge group members that are ordered by email
+        Gets a page of Everbridge groups in the org
+        Returns the page object that contains data, totalCount and totalPageCount
+        """
+        res = self._get(self.groups_url(groups_page_params(self.pagesize, page)))
+        return check_response('EVERBRIDGE.GET_GROUPS_PAGE', res, 'page')
+
+    def get_all_groups(self):
+        """
+        Gets all Everbridge groups in the org
+        """
+        groups = []
+        page = 1
+        while True:
+            res = self.get_groups_page(page)
+            groups += res.get('data') or []
+            if page >= (res.get('totalPageCount') or 0):
+                return groups
+            page += 1
+
+    def load_group_directory(self):
+        """
+        Fills GroupDirectory from the cache file or by listing all groups unless it is fresh
+        """
+        with self.group_directory.lock:
+            if self.group_directory.is_loaded() or self.group_directory.load():
+                return
+            self.group_directory.fill(self.get_all_groups())
+            logging.info('Loaded %d Everbridge Groups', len(self.group_directory.groups))
+
+    def get_group_members_page(self, group_id, page=1):
+        """
+        Gets a page of Everbridge group members that are ordered by externalId
+        Returns the page object that contains data, totalCount and totalPageCount
         """
         if not group_id:
             raise exceptions.EverbridgeException('EVERBRIDGE.GET_PAGED_GROUP_MEMBERS: No Group ID Provided')
-        params = f"?groupIds={group_id}&pageSize={self.pagesize}&pageNumber={page}"
-        params += "&sortBy=externalId&direction=ASC"
-        url = self.contacts_url(params)
-        res = self._get(url)
-        if 'page' not in res:
-            logging.error('EVERBRIDGE.GET_GROUP_MEMBERS: Unexpected Response')
-            logging.error(res)
-            raise exceptions.EverbridgeException('EVERBRIDGE.GET_GROUP_MEMBERS: Unexpected Response')
-        if 'data' not in res['page']:
+        res = self._get(self.contacts_url(group_members_params(group_id, self.pagesize, page)))
+        return check_response('EVERBRIDGE.GET_GROUP_MEMBERS', res, 'page')
+
+    def get_contacts_page(self, page=1):
+        """
+        Gets a page of all contacts in the org that are ordered by externalId
+        Returns the page object that contains data, totalCount and totalPageCount
+        """
+        params = f"?pageSize={self.pagesize}&pageNumber={page}&sortBy=externalId&direction=ASC"
+        res = self._get(self.contacts_url(params))
+        return check_response('EVERBRIDGE.GET_CONTACTS_PAGE', res, 'page')
+
+    def get_contact_count(self, group_id=None):
+        """
+        Returns the number of contacts in the group; in the org if group_id is not given
+        """
+        res = self._get(self.contacts_url(contact_count_params(group_id)))
+        return check_response('EVERBRIDGE.GET_CONTACT_COUNT', res, 'page').get('totalCount') or 0
+
+    def get_paged_group_members(self, group_id, page=1):
+        """
+        Gets Everbridge group members that are ordered by email
+        """
+        res = self.get_group_members_page(group_id, page)
+        if 'data' not in res:
             return []
-        return res['page']['data']
+        return res['data']
 
     def delete_members_from_group(self, group_id, members):
         """
@@ -236,32 +592,21 @@ class Everbridge:
             raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: No Group ID Provided')
         if members is None:
             raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: No Members Provided')
-        params = 'contacts?byType=id&groupId=' + str(group_id) + '&idType=id'
-        url = self.groups_url(params)
-        rslt = self._delete(url, data=members)
-        if not rslt or 'code' not in rslt or rslt['code'] != 100:
-            logging.error('EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP: Unexpected Response')
-        return rslt
+        rslt = self._delete(self.groups_url(group_contacts_params(group_id)), data=members)
+        return check_code('EVERBRIDGE.DELETE_MEMBERS_FROM_GROUP', rslt)
 
-    def add_members_to_group(self, group_id, members):
+    def add_members_to_group(self, group_id, members, id_type='id'):
         """
         Inserts contacts into everbridge group
         ?byType add everbridge contacts to group by name or id
+        ?idType members are contact ids (id) or externalIds (externalId)
         """
         if not group_id:
             raise exceptions.EverbridgeException('EVERBRIDGE.ADD_MEMBERS_TO_GROUP: No Group ID Provided')
         if members is None:
             raise exceptions.EverbridgeException('EVERBRIDGE.ADD_MEMBERS_TO_GROUP: No Members Provided')
-        params = 'contacts?byType=id&groupId=' + str(group_id) + '&idType=id'
-        url = self.groups_url(params)
-        rslt = self._post(url, data=members)
-        if not rslt or 'code' not in rslt or rslt['code'] != 100:
-            logging.error('EVERBRIDGE.ADD_MEMBERS_TO_GROUP: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.ADD_MEMBERS_TO_GROUP: Unexpected Response')
-        return rslt
+        rslt = self._post(self.groups_url(group_contacts_params(group_id, id_type)), data=members)
+        return check_code('EVERBRIDGE.ADD_MEMBERS_TO_GROUP', rslt)
 
     def add_group(self, group_name, parent_id=None):
         """
@@ -270,11 +615,9 @@ class Everbridge:
         if not group_name:
             raise exceptions.EverbridgeException('EVERBRIDGE.ADD_GROUP: No Group Name Provided')
         data = {'name': group_name, 'organizationId': self.org, "parentId":parent_id}
-        rslt = self._post(self.groups_url(''), data=data)
-        if not rslt or 'message' not in rslt or rslt['message'] != 'OK':
-            logging.error('EVERBRIDGE.ADD_GROUP: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.ADD_GROUP: Failed')
+        rslt = check_message('EVERBRIDGE.ADD_GROUP', self._post(self.groups_url(''), data=data))
+        if self.group_directory and rslt.get('id'):
+            self.group_directory.add(group_name, rslt['id'])
         return rslt
 
     def delete_group(self, group_id):
@@ -284,9 +627,7 @@ class Everbridge:
         """
         if not group_id:
             raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_GROUP: No Group ID Provided')
-        rslt = self._delete(self.groups_url(group_id))
-        if not rslt or 'message' not in rslt or rslt['message'] != 'OK':
-            logging.error('EVERBRIDGE.DELETE_GROUP: Unexpected Response')
-            logging.error(rslt)
-            raise exceptions.EverbridgeException('EVERBRIDGE.DELETE_GROUP: Failed')
+        rslt = check_message('EVERBRIDGE.DELETE_GROUP', self._delete(self.groups_url(group_id)))
+        if self.group_directory:
+            self.group_directory.remove(group_id)
         return rslt
@@ -0,0 +1,93 @@
+"""
+Indexes all contacts of Everbridge org
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import contact_utils
+from . import everbridge_group_member_iterator
+
+class EverbridgeContactIndex:
+    """
+    Keeps all contacts of the org by externalId and the members of each group
+    Paging the org once is cheaper than paging each group when groups share many members
+    """
+    DEFAULT_MAX_WORKERS = 4
+    DEFAULT_RATIO = 1.0
+
+    def __init__(self, api):
+        self.api = api
+        self.contacts = {}
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def should_use(api, group_ids, ratio=None):
+        """
+        Returns True if the groups have as many members as ratio times the org contacts
+        """
+        ratio = ratio or EverbridgeContactIndex.DEFAULT_RATIO
+        org_count = api.get_contact_count()
+        member_count = sum(api.get_contact_count(gid) for gid in group_ids if gid)
+        logging.info('Everbridge Group Members: %d, Org Contacts: %d', member_count, org_count)
+        return member_count > 0 and member_count >= org_count * ratio
+
+    def load(self, max_workers=None):
+        """
+        Pages through all contacts of the org; the following pages are fetched concurrently
+        """
+        first = self.api.get_contacts_page(1)
+        self._add_page(first)
+        total_pages = everbridge_group_member_iterator.EverbridgeGroupMemberIterator.count_pages(first) or 1
+        if total_pages > 1:
+            max_workers = max_workers or EverbridgeContactIndex.DEFAULT_MAX_WORKERS
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for page in executor.map(self.api.get_contacts_page, range(2, total_pages + 1)):
+                    self._add_page(page)
+        logging.info('Indexed %d Everbridge Contacts', len(self.contacts))
+        return self
+
+    def _add_page(self, page):
+        """
+        Indexes contacts in the page
+        """
+        for contact in page.get('data') or []:
+            if contact.get('externalId'):
+                self.contacts[contact['externalId']] = contact
+            for group_id in contact.get('groups') or []:
+                self.groups.setdefault(group_id, []).append(contact)
+
+    def get_group_members(self, group_id):
+        """
+        Returns the contacts in the group ordered by externalId; see contact_utils.merge_key
+        """
+        with self.lock:
+            members = list(self.groups.get(group_id, []))
+        return sorted(members, key=(lambda con: contact_utils.merge_key(con.get('externalId'))))
+
+    def add_group_members(self, group_id, contacts):
+        """
+        Adds the group to the contacts added to the group
+        Later groups see the contacts belong to more groups
+        """
+        with self.lock:
+            members = self.groups.setdefault(group_id, [])
+            for contact in contacts:
+                indexed = self.contacts.get(contact.get('externalId'))
+                if not indexed or group_id in indexed.get('groups', []):
+                    continue
+                indexed['groups'] = indexed.get('groups', []) + [group_id]
+                members.append(indexed)
+
+    def remove_group_members(self, group_id, contacts):
+        """
+        Removes the group from the contacts removed from the group
+        Later groups see the contacts belong to fewer groups
+        """
+        ids = {con.get('id') for con in contacts}
+        with self.lock:
+            self.groups[group_id] = [con for con in self.groups.get(group_id, []) if con.get('id') not in ids]
+            for contact in contacts:
+                indexed = self.contacts.get(contact.get('externalId'))
+                if indexed and group_id in indexed.get('groups', []):
+                    indexed['groups'] = [gid for gid in indexed['groups'] if gid != group_id]
@@ -1,13 +1,107 @@
 """
 Provides iterator for everbridge group members
 """
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from . import base_iterator
 from . import everbridge
 
 class EverbridgeGroupMemberIterator(base_iterator.BaseIterator):
     """
     Iterates everbridge group members
+    Reads the page count from the first page and fetches the following pages ahead
     """
-    def __init__(self, api, group_id):
+    DEFAULT_READ_AHEAD = 4
+
+    def __init__(self, api, group_id, read_ahead=None):
         super().__init__(api, group_id)
         self.pagesize = everbridge.Everbridge.DEFAULT_PAGESIZE
+        self.read_ahead = read_ahead or EverbridgeGroupMemberIterator.DEFAULT_READ_AHEAD
+        self.total_pages = None
+        self.next_request = 2
+        self.pending = deque()
+        self.executor = None
+
+    @staticmethod
+    def count_pages(page):
+        """
+        Returns the number of pages of the group; None if unknown
+        """
+        total_pages = page.get('totalPageCount')
+        if page.get('totalCount') is not None and page.get('pageSize'):
+            counted = math.ceil(page['totalCount'] / page['pageSize'])
+            total_pages = max(total_pages or 0, counted)
+        return total_pages
+
+    def _fetch_page(self, page):
+        """
+        Fetches a page of group members
+        """
+        return self.api.get_group_members_page(self.group_id, page)
+
+    def _schedule(self):
+        """
+        Requests the following pages up to read_ahead pages beyond the current page
+        """
+        if not self.total_pages or self.read_ahead < 2:
+            return
+        while len(self.pending) < self.read_ahead and self.next_request <= self.total_pages:
+            self.pending.append(self._submit(self.next_request))
+            self.next_request += 1
+
+    def _submit(self, page):
+        """
+        Starts fetching the page and returns the future of it
+        """
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(max_workers=self.read_ahead)
+        return self.executor.submit(self._fetch_page, page)
+
+    def _get_next_page(self):
+        """
+        Fetches paged group members; returns the prefetched page if available
+        """
+        if self.no_more_data:
+            return
+        if self.total_pages is not None and self.current_page >= self.total_pages:
+            self.nom = 0
+            self.no_more_data = True
+            self.close()
+            return
+        self.current_page += 1
+        if self.pending:
+            page = self.pending.popleft().result()
+        else:
+            page = self._fetch_page(self.current_page)
+            if self.current_page == 1:
+                self.total_pages = EverbridgeGroupMemberIterator.count_pages(page)
+        self._schedule()
+        if not self.pending:
+            self.close()
+        self.members = page.get('data', [])
+        self.index = 0
+        self.nom = len(self.members)
+        # no more data if the number of memebers from the last fetch is 0
+        if self.nom == 0:
+            self.no_more_data = True
+
+    def start(self):
+        """
+        Fetches the first page and starts fetching the following pages ahead
+        The pages are consumed by next; no more than read_ahead pages are fetched beyond the current page
+        """
+        if self.current_page == 0 and not self.no_more_data:
+            self._get_next_page()
+        return self
+
+    def close(self):
+        """
+        Stops fetching pages ahead
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -8,11 +8,26 @@ class SyncRunnerException(Exception):
 class SynchronizerException(Exception):
     """ Excepton for Synchronizer """
 
+class MemberOrderException(SynchronizerException):
+    """ Excepton for group members not ordered as merging expects """
+
 class AzureException(Exception):
     """ Excepton for Azure """
 
 class EverbridgeException(Exception):
     """ Excepton for Everbridge """
 
+class EverbridgeServerException(EverbridgeException):
+    """ Excepton for Everbridge responses with 5xx status """
+
 class ContactTrackerException(Exception):
     """ Excepton for ContactTracker """
+
+class AzureDeltaTokenException(AzureException):
+    """ Excepton for rejected Azure delta tokens """
+
+class SnapshotStoreException(Exception):
+    """ Excepton for SnapshotStore """
+
+class CheckpointJournalException(Exception):
+    """ Excepton for CheckpointJournal """
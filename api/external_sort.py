@@ -0,0 +1,57 @@
+"""
+Sorts items that do not fit in memory through sorted runs on disk
+"""
+import heapq
+import json
+import tempfile
+
+DEFAULT_RUN_SIZE = 10000
+
+def external_sort(items, key, run_size=None, tmpdir=None, encode=None, decode=None):
+    """
+    Yields items ordered by key
+    encode: returns JSON serializable data of the item; decode: returns the item from the data
+    Items are sorted in runs of run_size and spilled to temporary files; the runs are merged while yielding
+    Keeps at most run_size items in memory however many items are given
+    """
+    run_size = run_size or DEFAULT_RUN_SIZE
+    runs = []
+    try:
+        run = []
+        for item in items:
+            run.append(item)
+            if len(run) >= run_size:
+                runs.append(_spill(run, key, tmpdir, encode))
+                run = []
+        if not runs:
+            # Everything fits in a single run; no need to touch the disk
+            yield from sorted(run, key=key)
+            return
+        if run:
+            runs.append(_spill(run, key, tmpdir, encode))
+        run = None
+        yield from heapq.merge(*[_read_run(stream, decode) for stream in runs], key=key)
+    finally:
+        for stream in runs:
+            stream.close()
+
+def _spill(run, key, tmpdir, encode):
+    """
+    Writes the sorted run to a temporary file and returns the file rewound
+    The file is deleted when closed
+    """
+    # pylint: disable=consider-using-with
+    stream = tempfile.TemporaryFile('w+', encoding='utf-8', dir=tmpdir)
+    for item in sorted(run, key=key):
+        stream.write(json.dumps(encode(item) if encode else item))
+        stream.write('\n')
+    stream.seek(0)
+    return stream
+
+def _read_run(stream, decode):
+    """
+    Yields each item in the run file
+    """
+    for line in stream:
+        data = json.loads(line)
+        yield decode(data) if decode else data
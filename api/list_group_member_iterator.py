@@ -0,0 +1,29 @@
+"""
+Provides iterator for group members already in memory
+"""
+from . import base_iterator
+
+class ListGroupMemberIterator(base_iterator.BaseIterator):
+    """
+    Iterates the list of group members
+    """
+    def __init__(self, group_id, members):
+        super().__init__(None, group_id)
+        self.all_members = members
+        self.first_time = True
+
+    def _get_next_page(self):
+        """
+        Returns all the members as the first page
+        """
+        if self.no_more_data:
+            return
+        if self.first_time:
+            self.members = self.all_members
+            self.index = 0
+            self.nom = len(self.members)
+            self.current_page = 1
+            self.first_time = False
+        else:
+            self.nom = 0
+            self.no_more_data = True
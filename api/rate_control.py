@@ -0,0 +1,308 @@
+"""
+Adapts API request concurrency to throttling and retries throttled requests
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+def parse_retry_after(value):
+    """
+    Returns seconds to wait given by Retry-After header; None if not given or invalid
+    Retry-After is either seconds or HTTP date
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    if not retry_at.tzinfo:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def endpoint_family(url, base):
+    """
+    Returns the first path segment after base URL; e.g. 'groups' for <base>groups/xxx/members
+    """
+    path = url[len(base):] if url.startswith(base) else url
+    return path.split('?')[0].split('/')[0]
+
+class AdaptiveLimiter:
+    """
+    Limits concurrent requests of an endpoint family in AIMD style
+    The limit is halved when throttled and grows by one after as many successful responses as the limit
+    """
+    def __init__(self, max_concurrency, min_concurrency=1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits until the number of active requests is below the limit
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.active < self.get_limit())
+            self.active += 1
+
+    def release(self):
+        """
+        Ends the active request
+        """
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        """
+        Increases the limit additively
+        """
+        with self.condition:
+            if self.limit < self.max_concurrency:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    def on_throttle(self):
+        """
+        Decreases the limit multiplicatively
+        """
+        with self.condition:
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+
+    def get_limit(self):
+        """
+        Returns the current number of requests allowed at the same time
+        """
+        return int(self.limit)
+
+class RateControl:
+    """
+    Sends requests of each endpoint family through its own AdaptiveLimiter
+    Throttled requests are retried after Retry-After or jittered exponential backoff
+    No more than max_concurrency requests are sent at the same time in total
+    Async requests are admitted by the limits of the same limiters on the event loop; see send_async
+    """
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_BASE_DELAY = 1.0
+    DEFAULT_MAX_DELAY = 60.0
+
+    def __init__(self, name, max_concurrency, max_retries=None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_retries = RateControl.DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = RateControl.DEFAULT_BASE_DELAY
+        self.max_delay = RateControl.DEFAULT_MAX_DELAY
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.limiters = {}
+        # Async requests in flight per family and in total, guarded by a condition of the event loop
+        self.async_condition = None
+        self.async_loop = None
+        self.async_active = {}
+        self.async_in_flight = 0
+        self.deadline = None
+        self.counters = {'requests': 0, 'throttled': 0, 'retries': 0, 'gave_up': 0, 'wait_seconds': 0.0}
+        self.lock = threading.Lock()
+
+    def set_max_retries(self, max_retries):
+        """
+        Sets the number of times a throttled request is retried
+        """
+        self.max_retries = max_retries
+
+    def set_deadline(self, deadline):
+        """
+        Sets epoch seconds after which throttled requests are not retried
+        """
+        self.deadline = deadline
+
+    def set_backoff(self, base_delay, max_delay=None):
+        """
+        Sets the first backoff delay in seconds and the maximum one
+        """
+        self.base_delay = base_delay
+        if max_delay is not None:
+            self.max_delay = max_delay
+
+    def get_limiter(self, family):
+        """
+        Returns AdaptiveLimiter of the endpoint family
+        """
+        with self.lock:
+            if family not in self.limiters:
+                self.limiters[family] = AdaptiveLimiter(self.max_concurrency)
+            return self.limiters[family]
+
+    def send(self, family, request):
+        """
+        Calls request and returns the response; retries while the response is throttled
+        Returns the last throttled response if retries run out
+        """
+        limiter = self.get_limiter(family)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                with self.semaphore:
+                    response = request()
+            finally:
+                limiter.release()
+            self.count('requests')
+            if response.status_code not in THROTTLED_STATUS_CODES:
+                limiter.on_success()
+                return response
+            limiter.on_throttle()
+            self.count('throttled')
+            if attempt >= self.max_retries:
+                logging.error('%s.RATE_CONTROL: %s Throttled; Gave Up After %d Retries',
+                              self.name, family, attempt)
+                self.count('gave_up')
+                return response
+            delay = self.limit_delay(self.get_delay(response, attempt))
+            if delay is None:
+                logging.error('%s.RATE_CONTROL: %s Throttled; Gave Up at Deadline', self.name, family)
+                self.count('gave_up')
+                return response
+            logging.warning('%s.RATE_CONTROL: %s Throttled (%s); Retrying in %.1f Seconds',
+                            self.name, family, response.status_code, delay)
+            self.count('retries')
+            self.count('wait_seconds', delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def open_async(self):
+        """
+        Creates the condition admitting async requests on the running event loop
+        Called when the async client is opened
+        """
+        self.async_condition = asyncio.Condition()
+        self.async_loop = asyncio.get_running_loop()
+        self.async_active = {}
+        self.async_in_flight = 0
+
+    def close_async(self):
+        """
+        Drops the condition bound to the event loop
+        Called when the async client is closed
+        """
+        self.async_condition = None
+        self.async_loop = None
+
+    async def _acquire_async(self, family, limiter):
+        """
+        Waits until the requests in flight of the family are below the limit of its AdaptiveLimiter
+        and those in total are below max_concurrency
+        """
+        if self.async_loop is not asyncio.get_running_loop():
+            # Not opened on this loop
+            self.open_async()
+        async with self.async_condition:
+            await self.async_condition.wait_for(
+                lambda: self.async_active.get(family, 0) < limiter.get_limit() and
+                self.async_in_flight < self.max_concurrency)
+            self.async_active[family] = self.async_active.get(family, 0) + 1
+            self.async_in_flight += 1
+
+    async def _release_async(self, family):
+        """
+        Ends the async request and wakes up the waiting ones
+        """
+        async with self.async_condition:
+            self.async_active[family] -= 1
+            self.async_in_flight -= 1
+            self.async_condition.notify_all()
+
+    async def send_async(self, family, request):
+        """
+        Awaits request() and returns its (status, headers, body); retries while the status is throttled
+        Requests in flight are limited by the AdaptiveLimiter of the family and max_concurrency in total
+        Nothing is held while waiting to retry
+        """
+        limiter = self.get_limiter(family)
+        attempt = 0
+        while True:
+            await self._acquire_async(family, limiter)
+            try:
+                status, headers, body = await request()
+            finally:
+                await self._release_async(family)
+            self.count('requests')
+            if status not in THROTTLED_STATUS_CODES:
+                limiter.on_success()
+                return status, headers, body
+            limiter.on_throttle()
+            self.count('throttled')
+            if attempt >= self.max_retries:
+                logging.error('%s.RATE_CONTROL: %s Throttled; Gave Up After %d Retries',
+                              self.name, family, attempt)
+                self.count('gave_up')
+                return status, headers, body
+            delay = self.limit_delay(self.get_retry_delay(headers.get('Retry-After'), attempt))
+            if delay is None:
+                logging.error('%s.RATE_CONTROL: %s Throttled; Gave Up at Deadline', self.name, family)
+                self.count('gave_up')
+                return status, headers, body
+            logging.warning('%s.RATE_CONTROL: %s Throttled (%s); Retrying in %.1f Seconds',
+                            self.name, family, status, delay)
+            self.count('retries')
+            self.count('wait_seconds', delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def limit_delay(self, delay):
+        """
+        Returns delay capped at the seconds left before the deadline; None if the deadline has passed
+        """
+        if self.deadline is None:
+            return delay
+        left = self.deadline - time.time()
+        if left <= 0:
+            return None
+        return min(delay, left)
+
+    def get_delay(self, response, attempt):
+        """
+        Returns seconds to wait before retrying the throttled response
+        """
+        return self.get_retry_delay(response.headers.get('Retry-After'), attempt)
+
+    def get_retry_delay(self, retry_after, attempt):
+        """
+        Returns seconds to wait before retrying
+        Honors Retry-After; otherwise backs off exponentially with full jitter up to max_delay
+        """
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            # Spreads the retries of the requests throttled at the same time
+            return retry_after + random.uniform(0, self.base_delay / 2)
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(backoff / 2, backoff)
+
+    def count(self, key, value=1):
+        """
+        Adds value to the counter
+        """
+        with self.lock:
+            self.counters[key] += value
+
+    def report(self):
+        """
+        Returns the counters and the current limit of each endpoint family
+        """
+        with self.lock:
+            report = dict(self.counters)
+            report['wait_seconds'] = round(report['wait_seconds'], 1)
+            report['limits'] = {family: limiter.get_limit() for family, limiter in self.limiters.items()}
+        return report
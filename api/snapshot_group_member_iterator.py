@@ -0,0 +1,10 @@
+"""
+Provides iterator for everbridge group members kept in the snapshot store
+"""
+from . import list_group_member_iterator
+
+class SnapshotGroupMemberIterator(list_group_member_iterator.ListGroupMemberIterator):
+    """
+    Iterates everbridge group members recorded at the last sync
+    Members must be ordered by externalId
+    """
@@ -0,0 +1,125 @@
+"""
+Keeps the last-synced state of Everbridge groups in SQLite
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from . import contact_records
+from . import contact_utils
+from . import exceptions
+
+class SnapshotStore:
+    """
+    Stores the Everbridge contacts last pushed or read and the group memberships
+    Contacts are indexed by externalId; memberships by group id and externalId
+    """
+    DEFAULT_RECONCILE_INTERVAL = 24 * 60 * 60
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS contacts ('
+        ' external_id TEXT PRIMARY KEY, ever_id INTEGER, data TEXT NOT NULL, updated_at REAL NOT NULL,'
+        ' fingerprint TEXT)',
+        'CREATE TABLE IF NOT EXISTS memberships ('
+        ' group_id INTEGER NOT NULL, external_id TEXT NOT NULL, PRIMARY KEY (group_id, external_id))',
+        'CREATE INDEX IF NOT EXISTS memberships_external_id ON memberships (external_id)',
+        'CREATE TABLE IF NOT EXISTS group_syncs ('
+        ' group_id INTEGER PRIMARY KEY, synced_at REAL NOT NULL, reconciled_at REAL NOT NULL)')
+
+    def __init__(self, filename, reconcile_interval=None):
+        self.filename = filename
+        self.reconcile_interval = reconcile_interval or SnapshotStore.DEFAULT_RECONCILE_INTERVAL
+        self.conn = None
+        # Groups may be synced concurrently
+        self.lock = threading.Lock()
+
+    def open(self):
+        """
+        Opens the database and creates tables if not exist
+        """
+        try:
+            self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+            with self.conn:
+                for sql in SnapshotStore.SCHEMA:
+                    self.conn.execute(sql)
+                columns = [row[1] for row in self.conn.execute('PRAGMA table_info(contacts)')]
+                if 'fingerprint' not in columns:
+                    self.conn.execute('ALTER TABLE contacts ADD COLUMN fingerprint TEXT')
+        except sqlite3.Error as err:
+            logging.error('SNAPSHOT_STORE.OPEN: Invalid Snapshot File: %s', self.filename)
+            logging.error(err)
+            raise exceptions.SnapshotStoreException('SNAPSHOT_STORE.OPEN: Invalid Snapshot File') from err
+        return self
+
+    def close(self):
+        """
+        Closes the database
+        """
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def needs_reconciliation(self, group_id):
+        """
+        Returns True if the group must be compared with every Everbridge member page
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT reconciled_at FROM group_syncs WHERE group_id = ?',
+                                    (group_id,)).fetchone()
+        return not row or time.time() - row[0] > self.reconcile_interval
+
+    def get_group_members(self, group_id):
+        """
+        Returns the contacts of the group ordered by externalId
+        Contacts whose Everbridge id is not known yet do not have id
+        Contacts have the fingerprint of their content
+        """
+        sql = ('SELECT c.ever_id, c.data, c.fingerprint FROM memberships m JOIN contacts c'
+               ' ON c.external_id = m.external_id WHERE m.group_id = ? ORDER BY m.external_id')
+        with self.lock:
+            rows = self.conn.execute(sql, (group_id,)).fetchall()
+        members = []
+        for ever_id, data, fingerprint in rows:
+            contact = json.loads(data)
+            contact.pop('id', None)
+            if ever_id:
+                contact['id'] = ever_id
+            if fingerprint:
+                contact['fingerprint'] = fingerprint
+            members.append(contact)
+        return members
+
+    def save_group(self, group_id, contacts, reconciled=False):
+        """
+        Replaces the members of the group with the contacts
+        reconciled: True if the contacts were compared with every Everbridge member page
+        """
+        now = time.time()
+        rows = []
+        for con in contacts:
+            data = {key: val for key, val in con.items() if key != 'fingerprint'}
+            rows.append((con['externalId'], con.get('id'), json.dumps(contact_records.to_json_data(data)), now,
+                         contact_utils.fingerprint(data)))
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM memberships WHERE group_id = ?', (group_id,))
+            # Keeps the known Everbridge id if the contact was just inserted to this group
+            self.conn.executemany('INSERT INTO contacts VALUES (?, ?, ?, ?, ?) ON CONFLICT (external_id) DO UPDATE'
+                                  ' SET ever_id = COALESCE(excluded.ever_id, ever_id), data = excluded.data,'
+                                  ' updated_at = excluded.updated_at, fingerprint = excluded.fingerprint', rows)
+            self.conn.executemany('INSERT INTO memberships VALUES (?, ?)',
+                                  [(group_id, row[0]) for row in rows])
+            self.conn.execute('DELETE FROM contacts WHERE external_id NOT IN'
+                              ' (SELECT external_id FROM memberships)')
+            row = self.conn.execute('SELECT reconciled_at FROM group_syncs WHERE group_id = ?',
+                                    (group_id,)).fetchone()
+            reconciled_at = now if reconciled else (row[0] if row else 0)
+            self.conn.execute('INSERT OR REPLACE INTO group_syncs VALUES (?, ?, ?)',
+                              (group_id, now, reconciled_at))
+
+    def invalidate(self, group_id):
+        """
+        Forgets the group; the next sync walks every Everbridge member page
+        """
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM group_syncs WHERE group_id = ?', (group_id,))
+            self.conn.execute('DELETE FROM memberships WHERE group_id = ?', (group_id,))
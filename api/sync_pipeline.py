@@ -0,0 +1,106 @@
+"""
+Streams diff results to Everbridge writers through bounded queues
+"""
+import logging
+import threading
+from queue import Queue
+from . import exceptions
+
+class SyncPipeline:
+    """
+    Runs each writer stage in its own thread
+    Items are batched per stage; put blocks while the stage queue is full
+    Batches of a deferred stage are held until the pipeline is closed
+    Each stage must be fed from a single thread
+    """
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_QUEUE_SIZE = 2
+
+    def __init__(self, batch_size=None, queue_size=None):
+        self.batch_size = batch_size or SyncPipeline.DEFAULT_BATCH_SIZE
+        self.queue_size = queue_size or SyncPipeline.DEFAULT_QUEUE_SIZE
+        self.stages = {}
+        self.error = None
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, writer, deferred=False):
+        """
+        Starts the stage that calls writer with each batch
+        deferred: holds the batches and writes them only on close
+        Stages are closed in the order they are added
+        """
+        queue = Queue(maxsize=self.queue_size)
+        thread = threading.Thread(target=self._run_stage, args=(name, queue, writer), daemon=True)
+        self.stages[name] = {'queue': queue, 'thread': thread, 'batch': [], 'deferred': deferred, 'held': []}
+        thread.start()
+        return self
+
+    def _run_stage(self, name, queue, writer):
+        """
+        Calls writer with each batch until the end of the queue
+        Keeps draining the queue after an error so that producers do not block
+        """
+        # pylint: disable=broad-except
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            if self.error:
+                continue
+            try:
+                writer(batch)
+            except Exception as err:
+                logging.error('SYNC_PIPELINE: Stage %s Failed', name)
+                logging.error(err)
+                with self.lock:
+                    if not self.error:
+                        self.error = err
+
+    def _check_error(self):
+        """
+        Raises the error occurred in any stage
+        """
+        if self.error:
+            raise exceptions.SynchronizerException('SYNC_PIPELINE: Stage Failed') from self.error
+
+    def put(self, name, item):
+        """
+        Adds the item to the stage; sends the batch to the stage when it is full
+        """
+        self._check_error()
+        stage = self.stages[name]
+        stage['batch'].append(item)
+        if len(stage['batch']) >= self.batch_size:
+            batch = stage['batch']
+            stage['batch'] = []
+            if stage['deferred']:
+                stage['held'].append(batch)
+            else:
+                stage['queue'].put(batch)
+
+    def close(self):
+        """
+        Sends the held and the remaining batches and waits for all the stages to finish
+        """
+        for stage in self.stages.values():
+            for batch in stage['held'] + [stage['batch']]:
+                if batch and not self.error:
+                    stage['queue'].put(batch)
+            stage['held'] = []
+            stage['batch'] = []
+            stage['queue'].put(None)
+            stage['thread'].join()
+        self._check_error()
+
+    def abort(self):
+        """
+        Stops all the stages without writing the remaining batches
+        """
+        with self.lock:
+            if not self.error:
+                self.error = exceptions.SynchronizerException('SYNC_PIPELINE: Aborted')
+        for stage in self.stages.values():
+            stage['held'] = []
+            stage['batch'] = []
+            stage['queue'].put(None)
+            stage['thread'].join()
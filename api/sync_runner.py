@@ -3,12 +3,19 @@ Runs Sync application
 """
 import json
 import logging
+import time
 from os.path import exists
 from . import azure as Azure
+from . import async_azure
+from . import async_everbridge
+from . import async_runner
+from . import checkpoint_journal
+from . import delta_state
 from . import exceptions
 from . import everbridge as Everbridge
 from . import synchronizer as Synchronizer
 from . import logger
+from . import snapshot_store
 class SyncRunner:
     """
     Runs Sync application
@@ -19,11 +26,13 @@ class SyncRunner:
         self.azure = None
         self.everbridge = None
 
-    def run(self, groups_only=False):
+    def run(self, groups_only=False, deadline=None):
         """
-        Runs Sync application
+        Runs Sync application and returns the report
+        deadline: epoch seconds the run must finish by; runTimeLimitSeconds in config sets it if not given
         """
         # pylint: disable=broad-except
+        started = time.time()
         logger.setup_logger()
         self.conf = SyncRunner.load_config(self.configfile)
         SyncRunner.check_config(self.conf)
@@ -31,12 +40,64 @@ class SyncRunner:
         self._setup_azure_api()
         self._setup_everbridge_api()
         sync = Synchronizer.Synchronizer(self.azure, self.everbridge)
+        if self.conf.get('maxWorkers'):
+            sync.set_max_workers(self.conf['maxWorkers'])
+        if self.conf.get('adDeltaStateFile'):
+            sync.set_delta_state(self._load_delta_state())
+        sync.set_org_index_mode(self.conf.get('everbridgeOrgIndex', 'never'),
+                                self.conf.get('everbridgeOrgIndexRatio'))
+        if self.conf.get('pipelineBatchSize'):
+            sync.set_pipeline(self.conf['pipelineBatchSize'], self.conf.get('pipelineQueueSize'))
+        if self.conf.get('adStreamingThreshold'):
+            sync.set_streaming(self.conf['adStreamingThreshold'], self.conf.get('adStreamingRunSize'))
+        if self.conf.get('snapshotFile'):
+            sync.set_snapshot_store(self._open_snapshot_store())
+        if self.conf.get('checkpointFile'):
+            sync.set_journal(self._create_checkpoint_journal())
+        if self.conf.get('reportSuppressedUpdates'):
+            sync.set_report_suppressed_updates(True)
+        if self.conf.get('asyncClients'):
+            sync.set_async_runner(self._create_async_runner())
+        if not deadline and self.conf.get('runTimeLimitSeconds'):
+            deadline = started + self.conf['runTimeLimitSeconds']
+        if deadline:
+            sync.set_deadline(deadline, self.conf.get('deadlineMarginSeconds'))
         #sync.run(self.conf['adGroupId'])
         #Syncs whole group or group emails only based on boolean in argument
         if groups_only:
-            sync.sync_only_group_emails(self.conf['adGroupId'], self.conf['adMemberId'], self.conf['parentGroup'])
-        else:
-            sync.run_with_map(self.conf['adGroupId'], self.conf['adMemberId'], self.conf['parentGroup'])
+            return sync.sync_only_group_emails(self.conf['adGroupId'], self.conf['adMemberId'],
+                                               self.conf['parentGroup'])
+        return sync.run_with_map(self.conf['adGroupId'], self.conf['adMemberId'], self.conf['parentGroup'])
+
+    def _create_async_runner(self):
+        """
+        Creates AsyncRunner of the async clients set up like the sync ones
+        """
+        ever = async_everbridge.AsyncEverbridge(self.conf['everbridgeOrg'],
+                                                self.conf['everbridgeUsername'],
+                                                self.conf['everbridgePassword'])
+        if self.conf.get('asyncMaxConcurrency'):
+            ever.set_max_concurrency(self.conf['asyncMaxConcurrency'])
+        if self.conf.get('throttleMaxRetries') is not None:
+            ever.set_max_retries(self.conf['throttleMaxRetries'])
+        ever.set_timeout(*self.everbridge.timeout)
+        # Shares the token, the timeouts and the cached groups of Azure
+        azure = async_azure.AsyncAzure(self.azure)
+        if self.conf.get('asyncMaxConcurrency'):
+            azure.set_max_concurrency(self.conf['asyncMaxConcurrency'])
+        if self.conf.get('throttleMaxRetries') is not None:
+            azure.set_max_retries(self.conf['throttleMaxRetries'])
+        return async_runner.AsyncRunner(everbridge=ever, azure=azure)
+
+    def _create_checkpoint_journal(self):
+        """
+        Creates CheckpointJournal recording the progress of the run in checkpointFile
+        """
+        max_age = None
+        if self.conf.get('checkpointMaxAgeHours'):
+            max_age = self.conf['checkpointMaxAgeHours'] * 60 * 60
+        return checkpoint_journal.CheckpointJournal(self.conf['checkpointFile'], max_age)
+
     @staticmethod
     def load_config(configfile):
         """
@@ -70,6 +131,8 @@ class SyncRunner:
             errors.append('everbridgeUsername Not Found')
         if 'everbridgePassword' not in conf:
             errors.append('everbridgePassword Not Found')
+        if 'tokenCacheFile' in conf and 'tokenCacheKey' not in conf:
+            errors.append('tokenCacheKey Not Found')
         if 'logLevel' in conf:
             if conf['logLevel'] not in logger.SUPPORTED_LOGLEVELS:
                 errors.append('LogLevel Not Supported: ' + conf['logLevel'])
@@ -85,8 +148,36 @@ class SyncRunner:
         self.azure = Azure.Azure(self.conf['clientId'],
                                  self.conf['clientSecret'],
                                  self.conf['adTenant'])
+        if self.conf.get('azureMaxConcurrency'):
+            self.azure.set_max_concurrency(self.conf['azureMaxConcurrency'])
+        if self.conf.get('throttleMaxRetries') is not None:
+            self.azure.set_max_retries(self.conf['throttleMaxRetries'])
+        if self.conf.get('connectTimeout') or self.conf.get('readTimeout'):
+            self.azure.set_timeout(self.conf.get('connectTimeout'), self.conf.get('readTimeout'))
+        if self.conf.get('adMemberAttributes'):
+            self.azure.set_member_attributes(self.conf['adMemberAttributes'])
+        self.azure.set_token_cache(Azure.TokenCache(self.conf.get('tokenCacheFile'),
+                                                    self.conf.get('tokenCacheKey')))
         self.azure.setup() # Retrieves token; call once before any API calls
 
+    def _load_delta_state(self):
+        """
+        Loads Azure AD delta state for incremental sync
+        """
+        interval = None
+        if self.conf.get('adDeltaFullSyncHours'):
+            interval = self.conf['adDeltaFullSyncHours'] * 60 * 60
+        return delta_state.DeltaState(self.conf['adDeltaStateFile'], interval).load()
+
+    def _open_snapshot_store(self):
+        """
+        Opens the store of Everbridge group state recorded at the last sync
+        """
+        interval = None
+        if self.conf.get('snapshotReconcileHours'):
+            interval = self.conf['snapshotReconcileHours'] * 60 * 60
+        return snapshot_store.SnapshotStore(self.conf['snapshotFile'], interval).open()
+
     def _setup_everbridge_api(self):
         """
         Sets up Everbridge API
@@ -94,3 +185,14 @@ class SyncRunner:
         self.everbridge = Everbridge.Everbridge(self.conf['everbridgeOrg'],
                                                 self.conf['everbridgeUsername'],
                                                 self.conf['everbridgePassword'])
+        if self.conf.get('everbridgeMaxConcurrency'):
+            self.everbridge.set_max_concurrency(self.conf['everbridgeMaxConcurrency'])
+        if self.conf.get('throttleMaxRetries') is not None:
+            self.everbridge.set_max_retries(self.conf['throttleMaxRetries'])
+        if self.conf.get('connectTimeout') or self.conf.get('readTimeout'):
+            self.everbridge.set_timeout(self.conf.get('connectTimeout'), self.conf.get('readTimeout'))
+        ttl = None
+        if self.conf.get('everbridgeGroupCacheHours'):
+            ttl = self.conf['everbridgeGroupCacheHours'] * 60 * 60
+        self.everbridge.set_group_directory(
+            Everbridge.GroupDirectory(self.conf.get('everbridgeGroupCacheFile'), ttl))
@@ -2,8 +2,18 @@
 Syncs Azure AD contacts to Everbridge
 """
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import async_everbridge_group_member_iterator
 from . import azure_group_member_iterator
+from . import checkpoint_journal
+from . import everbridge_contact_index
 from . import everbridge_group_member_iterator
+from . import external_sort
+from . import list_group_member_iterator
+from . import snapshot_group_member_iterator
+from . import sync_pipeline
+from . import contact_registry
 from . import contact_tracker
 from . import contact_utils
 from . import exceptions
@@ -45,10 +55,124 @@ class Synchronizer:
     """
     Syncs Azure AD contacts to Everbridge
     """
+    DEFAULT_DEADLINE_MARGIN = 60
+    MEMBER_BATCH_SIZE = 1000
+
     def __init__(self, azure, everbridge):
         self.azure = azure
         self.everbridge = everbridge
         self.report = {}
+        self.delta_state = None
+        self.snapshot_store = None
+        self.registry = None
+        self.org_index_mode = None
+        self.org_index_ratio = None
+        self.org_index = None
+        self.pipeline_batch_size = None
+        self.pipeline_queue_size = None
+        self.streaming_threshold = None
+        self.streaming_run_size = None
+        self.deadline = None
+        self.deadline_margin = None
+        self.journal = None
+        self.report_suppressed_updates = False
+        self.async_runner = None
+        self.max_workers = 1
+
+    def set_max_workers(self, max_workers):
+        """
+        Sets the number of AD groups synced at the same time
+        """
+        self.max_workers = max_workers
+
+    def set_delta_state(self, delta_state):
+        """
+        Enables incremental sync with Azure AD delta queries
+        """
+        self.delta_state = delta_state
+
+    def set_snapshot_store(self, snapshot_store):
+        """
+        Enables diffing AD groups against the Everbridge state recorded at the last sync
+        """
+        self.snapshot_store = snapshot_store
+
+    def set_org_index_mode(self, mode, ratio=None):
+        """
+        Sets when Everbridge group members are taken from the index of all org contacts
+        mode: 'auto' uses the index if the groups have as many members as ratio times the org contacts
+              'always' always uses the index; otherwise the index is not used
+        """
+        self.org_index_mode = mode
+        self.org_index_ratio = ratio
+
+    def set_pipeline(self, batch_size, queue_size=None):
+        """
+        Streams diff results to Everbridge writers in batches of batch_size while diffing
+        queue_size: the number of batches each writer queues before diffing waits
+        """
+        self.pipeline_batch_size = batch_size
+        self.pipeline_queue_size = queue_size
+
+    def set_streaming(self, threshold, run_size=None):
+        """
+        Streams AD groups with more members than threshold through sync_group in constant memory
+        run_size: the number of AD members sorted in memory before spilled to disk
+        """
+        self.streaming_threshold = threshold
+        self.streaming_run_size = run_size
+
+    def set_journal(self, journal):
+        """
+        Records finished groups and write batches so that an interrupted run is resumed
+        """
+        self.journal = journal
+
+    def set_report_suppressed_updates(self, enabled):
+        """
+        Counts contacts that differ from Everbridge only in path order, format or server attributes
+        Compares every unchanged contact once more; meant for checking the sync, not for every run
+        """
+        self.report_suppressed_updates = enabled
+
+    def set_async_runner(self, async_runner):
+        """
+        Fetches AD members and Everbridge member pages with the async clients of AsyncRunner on one event loop
+        The runner is opened and closed by run_with_map
+        """
+        self.async_runner = async_runner
+        if self.deadline:
+            for client in async_runner.clients():
+                client.set_deadline(self.deadline)
+
+    def set_deadline(self, deadline, margin=None):
+        """
+        Stops starting new groups when the run gets within margin seconds of deadline (epoch seconds)
+        Groups in progress are finished; the report has the groups synced so far
+        Throttled requests are not retried after deadline
+        """
+        self.deadline = deadline
+        self.deadline_margin = margin
+        for client in self._clients():
+            client.set_deadline(deadline)
+
+    def _clients(self):
+        """
+        Returns the API clients including the async ones of AsyncRunner
+        """
+        clients = [self.azure, self.everbridge]
+        if self.async_runner:
+            clients += self.async_runner.clients()
+        return clients
+
+    def _is_near_deadline(self):
+        """
+        Returns True if the run must not start a new group
+        """
+        if not self.deadline:
+            return False
+        margin = Synchronizer.DEFAULT_DEADLINE_MARGIN if self.deadline_margin is None else self.deadline_margin
+        return time.time() >= self.deadline - margin
 
     def run(self, ad_group_ids):
         """
@@ -94,105 +218,585 @@ class Synchronizer:
         self.report[ev_parent_name] = rslt
         logging.info("Synched %s", ev_parent_name)
         logging.info(rslt)
+        self._add_rate_report()
         return self.report
 
     def run_with_map(self, ad_group_ids, ad_users_emails, ev_parent_name):
+        """
+        Syncs Azure AD contacts to Everbridge
+        Resumes the run interrupted last time if CheckpointJournal is set
+        """
+        if self.journal:
+            self.journal.open()
+        try:
+            if self.async_runner:
+                self.async_runner.open()
+            return self._run_with_map(ad_group_ids, ad_users_emails, ev_parent_name)
+        finally:
+            if self.async_runner:
+                self.async_runner.close()
+            if self.journal:
+                self.journal.close()
+
+    def _run_with_map(self, ad_group_ids, ad_users_emails, ev_parent_name):
         """
         Syncs Azure AD contacts to Everbridge
         """
         self.report = {}
-        for gid_ad in ad_group_ids:
-            name = self.azure.get_group_name(gid_ad)
-            gid_ev = self.everbridge.get_group_id_by_name(name)
-            # Create a Everbridge group if not exist
-            if not gid_ev:
-                gid_ev = self._create_new_everbridge_group(name)
-            # Create iterators
-            itr_ev = everbridge_group_member_iterator.EverbridgeGroupMemberIterator(self.everbridge, gid_ev)
-            members_map = self.azure.get_all_group_members_map(gid_ad)
-            admap = AdContactMap(gid_ad, members_map)
-            # Sync AD group to Everbridge
-            rslt = self.sync_group_with_map(admap, itr_ev)
-            # Delete the group from Everbridge if no members exist
-            if rslt['everbridge_count'] + rslt['inserted_contacts'] - rslt['removed_members'] == 0:
-                self._delete_everbridge_group(gid_ev)
-                rslt['removed'] = True
-            self.report[name] = rslt
-            logging.info("Synched %s", name)
-            logging.info(rslt)
+        # Shares contacts among groups; a person in several groups is converted and upserted once
+        self.registry = contact_registry.ContactRegistry()
+        # Resolves group names in a few batch requests before syncing each group
+        self.azure.get_groups(ad_group_ids)
+        self.org_index = self._load_org_index(ad_group_ids)
+        skipped = []
+        if self.max_workers > 1:
+            # Each group is independent; the APIs limit their own concurrency
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self._sync_ad_group_before_deadline, ad_group_ids))
+        else:
+            results = [self._sync_ad_group_before_deadline(gid_ad) for gid_ad in ad_group_ids]
+        for name, rslt in results:
+            if rslt is None:
+                skipped.append(name)
+            else:
+                self.report[name] = rslt
+        if self._is_near_deadline():
+            logging.warning("Run deadline is near; skipped %s", ev_parent_name)
+            self._finish_report(skipped, True)
+            return self.report
         #Managed Shared Mailboxes from AD
         #Shared Mailboxes are user accounts in AD
         #Shared Mailboxes will be in the specified parent group
         #Gets individual users from AD.
         #Similar to azure.get_all_group_members but uses the $filter ODA query
-        ad_users_map = self.azure.get_users_with_filters_map(ad_users_emails)
+        if self.async_runner and self.async_runner.azure:
+            ad_users_map = self.async_runner.run(self.async_runner.azure.get_users_with_filters_map(ad_users_emails))
+        else:
+            ad_users_map = self.azure.get_users_with_filters_map(ad_users_emails)
         # Create iterators
         shared_mailbox_map = AdContactMap("", ad_users_map)
         # Create Everbridge parent group for shared mailboxes if not exist
-        iter_mailbox =  everbridge_group_member_iterator.EverbridgeGroupMemberIterator(self.everbridge, everbridge_shared_mailbox.get_parent_group(ev_parent_name, self))
+        iter_mailbox = self._create_everbridge_iterator(everbridge_shared_mailbox.get_parent_group(ev_parent_name, self))
         # Sync Shared Mailbox group to Everbridge
         rslt = self.sync_group_with_map(shared_mailbox_map, iter_mailbox)
         self.report[ev_parent_name] = rslt
         logging.info("Synched %s", ev_parent_name)
         logging.info(rslt)
+        self._finish_report(skipped)
         return self.report
 
-    def sync_group(self, itr_ad, itr_ev):
+    def _finish_report(self, skipped, mailboxes_skipped=False):
         """
-        Syncs specified AD Grdoup to Everbridge group
+        Adds the rate counters and the AD groups skipped for the deadline to the report
+        The journal is kept for the next run if any group or the shared mailboxes are skipped
+        """
+        self.org_index = None
+        if skipped or mailboxes_skipped:
+            self.report['partial'] = True
+            self.report['skipped_groups'] = skipped
+            self.report['skipped_shared_mailboxes'] = mailboxes_skipped
+        elif self.journal:
+            self.journal.finish()
+        self._add_rate_report()
+
+    def _add_rate_report(self):
+        """
+        Adds the request, throttling and retry counters of both APIs to the report
+        """
+        self.report['rate_control'] = {
+            'azure': self.azure.get_rate_report(),
+            'everbridge': self.everbridge.get_rate_report()}
+        if self.async_runner and self.async_runner.everbridge:
+            self.report['rate_control']['async_everbridge'] = self.async_runner.everbridge.get_rate_report()
+        if self.async_runner and self.async_runner.azure:
+            self.report['rate_control']['async_azure'] = self.async_runner.azure.get_rate_report()
+        logging.info("Rate control: %s", self.report['rate_control'])
+
+    def _load_org_index(self, ad_group_ids):
+        """
+        Returns the index of all Everbridge org contacts if the mode requires; None otherwise
+        """
+        if self.org_index_mode not in ('auto', 'always'):
+            return None
+        if self.org_index_mode == 'auto':
+            gids_ev = [self.everbridge.get_group_id_by_name(self.azure.get_group_name(gid)) for gid in ad_group_ids]
+            if not everbridge_contact_index.EverbridgeContactIndex.should_use(
+                    self.everbridge, gids_ev, self.org_index_ratio):
+                return None
+        index = everbridge_contact_index.EverbridgeContactIndex(self.everbridge).load()
+        if self.registry:
+            for contact in index.contacts.values():
+                self.registry.add_everbridge_contact(contact)
+        return index
+
+    def _sync_ad_group_before_deadline(self, gid_ad):
+        """
+        Syncs AD group unless the run deadline is near
+        Returns the group ID and None as the result if skipped
+        """
+        if self.journal:
+            finished = self.journal.get_group_result(gid_ad)
+            if finished:
+                logging.info("Skipped %s finished in the interrupted run", finished[0])
+                return finished[0], dict(finished[1], resumed=True)
+        if self._is_near_deadline():
+            logging.warning("Run deadline is near; skipped %s", gid_ad)
+            return gid_ad, None
+        name, rslt = self._sync_ad_group(gid_ad)
+        if self.journal:
+            self.journal.finish_group(gid_ad, name, rslt)
+        return name, rslt
+
+    def _sync_ad_group(self, gid_ad):
+        """
+        Syncs AD group to Everbridge group and returns the group name and the result
+        """
+        name = self.azure.get_group_name(gid_ad)
+        gid_ev = self.everbridge.get_group_id_by_name(name)
+        # Create a Everbridge group if not exist
+        if not gid_ev:
+            gid_ev = self._create_new_everbridge_group(name)
+        # Sync AD group to Everbridge
+        rslt = None
+        if self.delta_state:
+            rslt = self._sync_group_incrementally(gid_ad, gid_ev)
+        if not rslt:
+            rslt = self._sync_group_fully(gid_ad, gid_ev)
+        # Delete the group from Everbridge if no members exist
+        if rslt['everbridge_count'] + rslt['added_members'] - rslt['removed_members'] == 0:
+            self._delete_everbridge_group(gid_ev)
+            rslt['removed'] = True
+        logging.info("Synched %s", name)
+        logging.info(rslt)
+        return name, rslt
+
+    def _sync_group_fully(self, gid_ad, gid_ev):
+        """
+        Syncs all the members of AD group to Everbridge group
+        """
+        if self.streaming_threshold and self.azure.get_group_member_count(gid_ad) > self.streaming_threshold:
+            return self._sync_group_streaming(gid_ad, gid_ev)
+        return self._sync_group_in_memory(gid_ad, gid_ev)
+
+    def _sync_group_in_memory(self, gid_ad, gid_ev):
+        """
+        Syncs all the members of AD group loaded into memory to Everbridge group
+        """
+        delta_link = None
+        if self.delta_state:
+            # Take the delta link first so that changes during the sync are not lost
+            delta_link = self.azure.get_latest_delta_link(gid_ad)
+        itr_ev = None
+        try:
+            # Download AD members and Everbridge members at the same time
+            if self.async_runner and self.async_runner.azure:
+                future = self.async_runner.submit(
+                    self.async_runner.azure.get_all_group_members_map(gid_ad, self.registry))
+                itr_ev = Synchronizer._start_download(self._create_everbridge_iterator(gid_ev))
+                members_map = future.result()
+            else:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    future = executor.submit(self.azure.get_all_group_members_map, gid_ad, self.registry)
+                    itr_ev = Synchronizer._start_download(self._create_everbridge_iterator(gid_ev))
+                    members_map = future.result()
+            members = {con.get('id'): upn for upn, con in members_map.items()}
+            admap = AdContactMap(gid_ad, members_map)
+            rslt = self.sync_group_with_map(admap, itr_ev)
+        finally:
+            # Stops reading Everbridge pages ahead if the download or the sync failed
+            if itr_ev:
+                itr_ev.close()
+        if self.delta_state:
+            self.delta_state.set_full_sync(gid_ad, delta_link, members)
+            self.delta_state.save()
+        return rslt
+
+    def _sync_group_streaming(self, gid_ad, gid_ev):
+        """
+        Syncs huge AD group by merging AD members sorted on disk with Everbridge member pages
+        Neither the members nor the diff results are kept in memory
+        Syncs in memory instead if Everbridge members are not ordered as merging expects
+        """
+        if self.delta_state:
+            # Members are not recorded; the group is fully synced every run
+            self.delta_state.reset(gid_ad)
+            self.delta_state.save()
+        if self.snapshot_store:
+            self.snapshot_store.invalidate(gid_ev)
+        itr_ad = azure_group_member_iterator.AzureGroupMemberIterator(
+            self.azure, gid_ad, self.streaming_run_size or external_sort.DEFAULT_RUN_SIZE)
+        itr_ev = self._create_everbridge_iterator(gid_ev)
+        try:
+            return self.sync_group(itr_ad, itr_ev, streaming=True)
+        except exceptions.MemberOrderException:
+            logging.warning("Members not ordered; syncing %s in memory", gid_ad)
+        finally:
+            itr_ev.close()
+        return self._sync_group_in_memory(gid_ad, gid_ev)
+
+    def _sync_group_incrementally(self, gid_ad, gid_ev):
+        """
+        Syncs the members added to or removed from AD group since the last run
+        Returns None if a full sync is required
+        """
+        delta_link = self.delta_state.get_delta_link(gid_ad)
+        if not delta_link:
+            return None
+        try:
+            changes = self.azure.get_group_member_changes(gid_ad, delta_link)
+        except exceptions.AzureDeltaTokenException:
+            logging.info("Delta token rejected; fully resyncing %s", gid_ad)
+            self.delta_state.reset(gid_ad)
+            return None
+        members = dict(self.delta_state.get_members(gid_ad))
+        previous_count = len(members)
+        removed = [members.pop(uid) for uid in changes['removed'] if uid in members]
+        for upn, con in changes['added'].items():
+            members[con.get('id')] = upn
+        rslt = self.sync_group_changes(gid_ev, changes['added'], removed)
+        if self.snapshot_store:
+            # Membership changes are not recorded; the next full sync walks Everbridge pages
+            self.snapshot_store.invalidate(gid_ev)
+        rslt['azure_group_id'] = gid_ad
+        rslt['azure_count'] = len(members)
+        rslt['everbridge_count'] = previous_count
+        self.delta_state.set_delta_sync(gid_ad, changes['deltaLink'], members)
+        self.delta_state.save()
+        return rslt
+
+    def sync_group_changes(self, gid_ev, added, removed):
+        """
+        Applies AD membership changes to Everbridge group
+        added: Dictionary(<userPrincipalName>, <Contact>) of new AD members
+        removed: List of userPrincipalNames no longer in AD group
         """
         tracker = contact_tracker.ContactTracker()
-        con_ad = next(itr_ad)
-        con_ev = next(itr_ev)
-        while con_ad or con_ev:
-            if not con_ad and con_ev:
-                # the contact exists only in Everbridge => Delete it
+        existing = {}
+        external_ids = list(added) + removed
+        if external_ids:
+            for con in self._call_everbridge('get_contacts_by_external_id_list', external_ids):
+                existing[con['externalId']] = con
+        existing_members = []
+        for upn, con_ad in added.items():
+            con_ev = existing.get(upn)
+            if not con_ev:
+                tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, self._convert(con_ad))
+                continue
+            converted = self._convert(con_ad, con_ev['id'])
+            self._track_update(tracker, converted, con_ev)
+            if not con_ad.get('errors') and gid_ev not in con_ev.get('groups', []):
+                existing_members.append(con_ev)
+        for upn in removed:
+            con_ev = existing.get(upn)
+            if con_ev and gid_ev in con_ev.get('groups', []):
                 tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
-                con_ev = next(itr_ev)
-            elif con_ad and not con_ev:
-                # the contact exists only in AD => Insert it
-                tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, contact_utils.convert_to_everbridge(con_ad))
-                con_ad = next(itr_ad)
-            elif con_ad['userPrincipalName'] == con_ev['externalId']:
-                converted = contact_utils.convert_to_everbridge(con_ad, con_ev['id'])
-                if contact_utils.is_different(converted, con_ev):
-                    tracker.push(contact_tracker.ContactTracker.UPDATE_CONTACT, converted)
-                con_ad = next(itr_ad)
-                con_ev = next(itr_ev)
-            elif con_ad['userPrincipalName'] > con_ev['externalId']:
-                # the contact exists only in Everbridge => Delete it
-                tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
-                con_ev = next(itr_ev)
-            else:
-                # the contact exists only in AD => Insert it
-                tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, contact_utils.convert_to_everbridge(con_ad))
-                con_ad = next(itr_ad)
-        self._handle_delete(itr_ev.get_group_id(), tracker)
-        self._handle_upsert(itr_ev.get_group_id(), tracker)
+        self._handle_delete(gid_ev, tracker)
+        self._handle_upsert(gid_ev, tracker)
+        self._add_existing_members(gid_ev, existing_members, tracker)
+        report = tracker.report()
+        report['everbridge_group_id'] = gid_ev
+        report['incremental'] = True
+        return report
+
+    def sync_group(self, itr_ad, itr_ev, streaming=False):
+        """
+        Syncs specified AD Grdoup to Everbridge group
+        Members are merged by contact_utils.merge_key; raises MemberOrderException before removing or adding
+        members if either iterator is not ordered by it
+        streaming: writes diff results while merging; contacts are only counted and not shared with other groups
+        """
+        tracker = contact_tracker.ContactTracker(keep_contacts=not streaming)
+        convert = self._convert
+        pipeline = None
+        if streaming:
+            convert = contact_utils.convert_to_everbridge
+            pipeline = self._create_pipeline(itr_ev.get_group_id(), tracker, shared=False)
+        try:
+            con_ad, key_ad = Synchronizer._next_member(itr_ad, 'userPrincipalName')
+            con_ev, key_ev = Synchronizer._next_member(itr_ev, 'externalId')
+            while con_ad or con_ev:
+                if not con_ad and con_ev:
+                    # the contact exists only in Everbridge => Delete it
+                    tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
+                    con_ev, key_ev = Synchronizer._next_member(itr_ev, 'externalId', key_ev)
+                elif con_ad and not con_ev:
+                    # the contact exists only in AD => Insert it
+                    tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, convert(con_ad))
+                    con_ad, key_ad = Synchronizer._next_member(itr_ad, 'userPrincipalName', key_ad)
+                elif key_ad == key_ev:
+                    converted = convert(con_ad, con_ev['id'])
+                    self._track_update(tracker, converted, con_ev)
+                    con_ad, key_ad = Synchronizer._next_member(itr_ad, 'userPrincipalName', key_ad)
+                    con_ev, key_ev = Synchronizer._next_member(itr_ev, 'externalId', key_ev)
+                elif key_ad > key_ev:
+                    # the contact exists only in Everbridge => Delete it
+                    tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
+                    con_ev, key_ev = Synchronizer._next_member(itr_ev, 'externalId', key_ev)
+                else:
+                    # the contact exists only in AD => Insert it
+                    tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, convert(con_ad))
+                    con_ad, key_ad = Synchronizer._next_member(itr_ad, 'userPrincipalName', key_ad)
+            if pipeline:
+                pipeline.close()
+        except Exception:
+            if pipeline:
+                pipeline.abort()
+            raise
+        if not pipeline:
+            self._handle_delete(itr_ev.get_group_id(), tracker)
+            self._handle_upsert(itr_ev.get_group_id(), tracker)
         return Synchronizer._enhance_report(tracker.report(), itr_ad, itr_ev)
 
+    @staticmethod
+    def _next_member(itr, attr, last_key=None):
+        """
+        Returns the next member of the iterator and its merge key; (None, last_key) at the end
+        Raises MemberOrderException if the key is smaller than the key of the previous member
+        """
+        con = next(itr)
+        if not con:
+            return None, last_key
+        key = contact_utils.merge_key(con.get(attr))
+        if last_key is not None and key < last_key:
+            msg = f'SYNCHRONIZER.SYNC_GROUP: Members of {itr.get_group_id()} Not Ordered by {attr}'
+            logging.error(msg)
+            raise exceptions.MemberOrderException(msg)
+        return con, key
+
     def sync_group_with_map(self, admap, itr_ev):
         """
         Syncs specified AD Grdoup to Everbridge group
         """
         tracker = contact_tracker.ContactTracker()
-        con_ev = next(itr_ev)
-        while con_ev:
-            con_ad = admap.pop(con_ev['externalId'])
-            if not con_ad:
-                # the contact exists only in Everbridge => Delete it
-                tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
-            elif con_ad['userPrincipalName'] == con_ev['externalId']:
-                converted = contact_utils.convert_to_everbridge(con_ad, con_ev['id'])
-                if contact_utils.is_different(converted, con_ev):
-                    tracker.push(contact_tracker.ContactTracker.UPDATE_CONTACT, converted)
+        group_id = itr_ev.get_group_id()
+        from_snapshot = isinstance(itr_ev, snapshot_group_member_iterator.SnapshotGroupMemberIterator)
+        pipeline = None
+        # Members taken from the snapshot must be refreshed before deleting; not streamed
+        if self.pipeline_batch_size and not from_snapshot:
+            pipeline = self._create_pipeline(group_id, tracker)
+        # Everbridge members kept in the group; recorded in the snapshot store
+        members = {}
+        # Contacts found in other groups in the run are added by their Everbridge IDs
+        existing_members = []
+        try:
             con_ev = next(itr_ev)
-        for con_ad in admap.values():
-            tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, contact_utils.convert_to_everbridge(con_ad))
-        self._handle_delete(itr_ev.get_group_id(), tracker)
-        self._handle_upsert(itr_ev.get_group_id(), tracker)
+            while con_ev:
+                con_ad = admap.pop(con_ev['externalId'])
+                if not con_ad:
+                    # the contact exists only in Everbridge => Delete it
+                    tracker.push(contact_tracker.ContactTracker.REMOVE_MEMBER, con_ev)
+                elif con_ad['userPrincipalName'] == con_ev['externalId']:
+                    members[con_ev['externalId']] = con_ev
+                    if self.registry:
+                        self.registry.add_everbridge_contact(con_ev)
+                    converted = self._convert(con_ad, con_ev['id'])
+                    self._track_update(tracker, converted, con_ev)
+                con_ev = next(itr_ev)
+            for con_ad in admap.values():
+                con_ev = self.registry.get_everbridge_contact(con_ad['userPrincipalName']) if self.registry else None
+                if not con_ev:
+                    tracker.push(contact_tracker.ContactTracker.INSERT_CONTACT, self._convert(con_ad))
+                    continue
+                converted = self._convert(con_ad, con_ev['id'])
+                self._track_update(tracker, converted, con_ev)
+                if not con_ad.get('errors'):
+                    existing_members.append(con_ev)
+                    members[con_ev['externalId']] = dict(con_ev, groups=con_ev.get('groups', []) + [group_id])
+            if pipeline:
+                pipeline.close()
+            else:
+                if from_snapshot:
+                    self._refresh_obsolete_members(group_id, tracker)
+                self._handle_delete(group_id, tracker)
+                if self.org_index:
+                    self.org_index.remove_group_members(group_id, tracker.obsolete_members)
+                self._handle_upsert(group_id, tracker)
+            self._add_existing_members(group_id, existing_members, tracker)
+        except Exception:
+            if pipeline:
+                pipeline.abort()
+            if self.snapshot_store:
+                self.snapshot_store.invalidate(group_id)
+            raise
+        if self.snapshot_store:
+            self._save_snapshot(group_id, members, tracker, not from_snapshot)
         return Synchronizer._enhance_report(tracker.report(), admap, itr_ev)
 
+    def _create_pipeline(self, group_id, tracker, shared=True):
+        """
+        Returns SyncPipeline that removes members, upserts contacts and adds inserted members
+        while the group is being diffed; results are kept in the tracker
+        Members are removed and added only after the Everbridge members are read to the end
+        because the member pages are read by offset and shift when the group changes
+        shared: upserts are shared with other groups through ContactRegistry
+        """
+        pipeline = sync_pipeline.SyncPipeline(self.pipeline_batch_size, self.pipeline_queue_size)
+
+        def delete(batch):
+            batch = self._uncommitted(group_id, checkpoint_journal.CheckpointJournal.REMOVE_MEMBERS, batch)
+            batch = self._refresh_deletion_candidates(group_id, batch)
+            if not batch:
+                return
+            self._call_everbridge('delete_members_from_group', group_id, [con['id'] for con in batch])
+            obsolete = [con['id'] for con in batch if contact_tracker.ContactTracker.is_obsolete_contact(con)]
+            if obsolete:
+                self._call_everbridge('delete_contacts', obsolete)
+                tracker.add_deleted_contacts(obsolete)
+            if self.org_index:
+                self.org_index.remove_group_members(group_id, batch)
+            self._commit(group_id, checkpoint_journal.CheckpointJournal.REMOVE_MEMBERS, batch)
+
+        def upsert(batch):
+            # Upserts are always sent; AD may have changed since the last run was interrupted
+            failed = self._upsert_contacts(batch, shared)
+            if failed:
+                tracker.add_failed_contacts(failed)
+            failed_ids = {con['externalId'] for con in failed}
+            # Add newly inserted contacts by externalId; their Everbridge IDs are not needed
+            for con in batch:
+                if 'id' not in con and con['externalId'] not in failed_ids:
+                    pipeline.put('add', con['externalId'])
+
+        def add(batch):
+            batch = self._uncommitted(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS, batch)
+            if not batch:
+                return
+            self._call_everbridge('add_members_to_group', group_id, batch, 'externalId')
+            self._commit(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS, batch)
+            tracker.add_new_members(batch)
+
+        def listener(optype, contact):
+            if optype == contact_tracker.ContactTracker.REMOVE_MEMBER:
+                pipeline.put('delete', contact)
+            else:
+                pipeline.put('upsert', contact)
+
+        pipeline.add_stage('delete', delete, deferred=True).add_stage('upsert', upsert)
+        pipeline.add_stage('add', add, deferred=True)
+        tracker.set_listener(listener)
+        return pipeline
+
+    def _create_everbridge_iterator(self, gid_ev):
+        """
+        Returns the iterator of Everbridge group members
+        Members are read from the snapshot store unless the group needs reconciliation
+        Members are taken from the org contact index if loaded
+        """
+        if self.snapshot_store and not self.snapshot_store.needs_reconciliation(gid_ev):
+            members = self._load_snapshot_members(gid_ev)
+            if members is not None:
+                return snapshot_group_member_iterator.SnapshotGroupMemberIterator(gid_ev, members)
+        if self.org_index:
+            return list_group_member_iterator.ListGroupMemberIterator(gid_ev, self.org_index.get_group_members(gid_ev))
+        if self.async_runner and self.async_runner.everbridge:
+            return async_everbridge_group_member_iterator.AsyncEverbridgeGroupMemberIterator(self.async_runner, gid_ev)
+        return everbridge_group_member_iterator.EverbridgeGroupMemberIterator(self.everbridge, gid_ev)
+
+    @staticmethod
+    def _start_download(itr_ev):
+        """
+        Starts reading Everbridge pages ahead and returns the iterator
+        Only the pages read ahead are held in memory; the rest are read while diffing
+        Returns the iterator as it is if the members are already in memory
+        """
+        if isinstance(itr_ev, everbridge_group_member_iterator.EverbridgeGroupMemberIterator):
+            itr_ev.start()
+        return itr_ev
+
+    def _load_snapshot_members(self, gid_ev):
+        """
+        Returns the group members recorded in the snapshot store
+        Looks up contacts inserted at the last sync to get their Everbridge ids
+        Returns None if any of them is not found; Everbridge pages must be walked then
+        """
+        members = self.snapshot_store.get_group_members(gid_ev)
+        unknown = [con['externalId'] for con in members if not con.get('id')]
+        if not unknown:
+            return members
+        found = {con['externalId']: con for con in self._call_everbridge('get_contacts_by_external_id_list', unknown)}
+        if len(found) < len(unknown):
+            logging.info("Snapshot of %s has unknown contacts; walking Everbridge pages", gid_ev)
+            return None
+        rslt = []
+        for con in members:
+            if not con.get('id'):
+                con = found[con['externalId']]
+                if gid_ev not in con.get('groups', []):
+                    # Failed to be added to the group at the last sync
+                    continue
+            rslt.append(con)
+        return rslt
+
+    def _refresh_obsolete_members(self, group_id, tracker):
+        """
+        Replaces obsolete members taken from the snapshot with the current Everbridge contacts
+        Contacts are deleted according to their groups, which may have changed since the last sync
+        """
+        obsolete = tracker.get_contacts(contact_tracker.ContactTracker.REMOVE_MEMBER)
+        if not obsolete:
+            return
+        external_ids = [con['externalId'] for con in obsolete]
+        current = self._call_everbridge('get_contacts_by_external_id_list', external_ids)
+        tracker.set_obsolete_members([con for con in current if group_id in con.get('groups', [])])
+
+    def _refresh_deletion_candidates(self, group_id, contacts):
+        """
+        Re-reads from Everbridge the members that would be deleted from the org for belonging to no other groups
+        Their groups come from the org index loaded at the start of the run or from pages read while
+        other workers sync their groups; other groups may have added them since
+        Members no longer in the group are left out
+        """
+        if not self.org_index and self.max_workers <= 1:
+            return contacts
+        candidates = [con['externalId'] for con in contacts if contact_tracker.ContactTracker.is_obsolete_contact(con)]
+        if not candidates:
+            return contacts
+        found = self._call_everbridge('get_contacts_by_external_id_list', candidates)
+        current = {con['externalId']: con for con in found}
+        rslt = []
+        for con in contacts:
+            if contact_tracker.ContactTracker.is_obsolete_contact(con):
+                con = current.get(con['externalId'])
+                if not con or group_id not in con.get('groups', []):
+                    continue
+            rslt.append(con)
+        return rslt
+
+    def _save_snapshot(self, group_id, members, tracker, reconciled):
+        """
+        Records the group members after the sync in the snapshot store
+        """
+        failed = {con['externalId'] for con in tracker.failed_contacts}
+        for con in tracker.updated_contacts:
+            if con['externalId'] not in failed:
+                previous = members[con['externalId']]
+                members[con['externalId']] = dict(con, groups=previous.get('groups', [group_id]))
+        for con in tracker.new_contacts:
+            if con['externalId'] not in failed:
+                members[con['externalId']] = dict(con, groups=[group_id])
+        self.snapshot_store.save_group(group_id, list(members.values()), reconciled)
+
+    def _convert(self, con_ad, ever_id=None):
+        """
+        Returns Everbridge contact converted from AD contact; converted once in a run if ContactRegistry is set
+        """
+        if self.registry:
+            return self.registry.convert(con_ad, ever_id)
+        return contact_utils.convert_to_everbridge(con_ad, ever_id)
+
+    def _track_update(self, tracker, converted, con_ev):
+        """
+        Pushes the converted AD contact for update if it differs from Everbridge Contact
+        Counts contacts that differ only in path order, format or server attributes if enabled
+        """
+        if contact_utils.is_different(converted, con_ev):
+            tracker.push(contact_tracker.ContactTracker.UPDATE_CONTACT, converted)
+        elif not self.report_suppressed_updates:
+            return
+        elif 'fingerprint' not in con_ev and contact_utils.is_literally_different(converted, con_ev):
+            # Contacts in the snapshot store are the ones the sync pushed; no need to check them
+            tracker.count_suppressed_update()
+
     @staticmethod
     def _enhance_report(report, itr_ad, itr_ev):
         report['azure_group_id'] = itr_ad.get_group_id()
@@ -225,13 +829,20 @@ class Synchronizer:
         """
         Removes members from group and deletes contacts not belonging to any groups
         """
-        members = tracker.get_remove_member_ids()
-        if not members:
+        operation = checkpoint_journal.CheckpointJournal.REMOVE_MEMBERS
+        obsolete = self._uncommitted(group_id, operation, tracker.obsolete_members)
+        tracker.set_obsolete_members(self._refresh_deletion_candidates(group_id, obsolete))
+        if not tracker.obsolete_members:
             return
-        self.everbridge.delete_members_from_group(group_id, members)
-        contacts = tracker.get_delete_contact_ids()
-        if contacts:
-            self.everbridge.delete_contacts(contacts)
+        contacts = set(tracker.get_delete_contact_ids())
+
+        def delete(batch):
+            self._call_everbridge('delete_members_from_group', group_id, [con['id'] for con in batch])
+            ids = [con['id'] for con in batch if con['id'] in contacts]
+            if ids:
+                self._call_everbridge('delete_contacts', ids)
+
+        self._write_members(group_id, operation, tracker.obsolete_members, delete)
 
     def _handle_upsert(self, group_id, tracker):
         """
@@ -240,13 +851,101 @@ class Synchronizer:
         updated = tracker.get_upsert_contacts()
         if not updated:
             return
-        self.everbridge.upsert_contacts(updated)
-        new_members = []
-        # Retrieve Everbridge IDs for newly inserted contacts
-        # ids are given per 100
-        for ids in tracker.get_inserted_contact_external_ids():
-            contacts = self.everbridge.get_contacts_by_external_ids(ids)
-            new_members += [con['id'] for con in contacts]
+        # Upserts are always sent; AD may have changed since the last run was interrupted
+        failed = self._upsert_contacts(updated)
+        if failed:
+            tracker.set_failed_contacts(failed)
+        # Add newly inserted contacts by externalId; their Everbridge IDs are not needed
+        new_members = self._uncommitted(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS,
+                                        tracker.get_inserted_external_id_list())
         if new_members:
-            self.everbridge.add_members_to_group(group_id, new_members)
+            self._write_members(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS, new_members,
+                                lambda batch: self._call_everbridge('add_members_to_group', group_id, batch,
+                                                                    'externalId'))
             tracker.set_new_members(new_members)
+
+    def _add_existing_members(self, group_id, contacts, tracker):
+        """
+        Adds Everbridge contacts found in other groups to the group by their Everbridge IDs
+        """
+        contacts = self._uncommitted(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS, contacts)
+        if not contacts:
+            return
+
+        def add(batch):
+            self._call_everbridge('add_members_to_group', group_id, [con['id'] for con in batch])
+            if self.org_index:
+                self.org_index.add_group_members(group_id, batch)
+
+        self._write_members(group_id, checkpoint_journal.CheckpointJournal.ADD_MEMBERS, contacts, add)
+        tracker.set_new_members(tracker.new_members + [con['id'] for con in contacts])
+
+    def _call_everbridge(self, method, *args):
+        """
+        Calls the contact or member method of Everbridge
+        Runs the method of AsyncEverbridge on the loop of AsyncRunner instead if set
+        """
+        if self.async_runner and self.async_runner.everbridge:
+            return self.async_runner.run(getattr(self.async_runner.everbridge, method)(*args))
+        return getattr(self.everbridge, method)(*args)
+
+    def _write_members(self, group_id, operation, contacts, write):
+        """
+        Writes member changes in batches of MEMBER_BATCH_SIZE and records each batch in the journal once written
+        An interrupted run resends only the batches not recorded
+        """
+        size = Synchronizer.MEMBER_BATCH_SIZE
+        for i in range(0, len(contacts), size):
+            batch = contacts[i:i + size]
+            write(batch)
+            self._commit(group_id, operation, batch)
+
+    def _uncommitted(self, group_id, operation, contacts):
+        """
+        Returns the contacts not written by the operation before the last run was interrupted
+        contacts: contacts or externalIds
+        """
+        if not self.journal:
+            return contacts
+        committed = self.journal.get_committed(group_id, operation)
+        if not committed:
+            return contacts
+        return [con for con in contacts if Synchronizer._external_id(con) not in committed]
+
+    def _commit(self, group_id, operation, contacts):
+        """
+        Records the contacts or externalIds written by the operation in the journal
+        """
+        if self.journal:
+            self.journal.commit_batch(group_id, operation, [Synchronizer._external_id(con) for con in contacts])
+
+    @staticmethod
+    def _external_id(contact):
+        """
+        Returns externalId of the contact; returns the argument as it is if it is externalId
+        """
+        return contact if isinstance(contact, str) else contact['externalId']
+
+    def _upsert_contacts(self, contacts, shared=True):
+        """
+        Upserts contacts and returns the contacts failed to be upserted
+        Contacts upserted by other groups in the run are not upserted again unless shared is False
+        """
+        registry = self.registry if shared else None
+        upserted_elsewhere = []
+        if registry:
+            contacts, upserted_elsewhere = registry.claim_upserts(contacts)
+        failed = []
+        try:
+            if contacts:
+                failed = self._call_everbridge('upsert_contacts', contacts).get('failed_contacts') or []
+        except Exception:
+            failed = contacts
+            raise
+        finally:
+            if registry:
+                registry.finish_upserts(contacts, {con['externalId'] for con in failed})
+        if upserted_elsewhere:
+            # Other groups upsert these contacts; wait for them before adding members
+            failed = failed + [{'externalId': eid} for eid in registry.wait_upserts(upserted_elsewhere)]
+        return failed
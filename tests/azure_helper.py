@@ -1,6 +1,8 @@
 """
 Azure Test Helper
 """
+import asyncio
+import threading
 from unittest.mock import MagicMock
 from api.azure import Azure
 
@@ -14,9 +16,11 @@ def create_azure_mock(group_name, ids=None, data=None):
         data = [create_azure_contacts(ids)]
     azure = create_azure_instance()
     azure.get_group_name = MagicMock(return_value=group_name)
+    azure.get_groups = MagicMock(return_value={})
     azure.get_paged_group_members = MagicMock(side_effect=data)
     flattened = [item for sublist in data for item in sublist]
     azure.get_all_group_members = MagicMock(side_effect=[flattened])
+    azure.iter_group_members = MagicMock(side_effect=lambda gid: iter(flattened))
     ####################################################################
     # Graph API currently does not support OrderBy
     # Delete the follwing lines after it does
@@ -24,6 +28,50 @@ def create_azure_mock(group_name, ids=None, data=None):
     ####################################################################
     return azure
 
+class AsyncAzureMock:
+    """
+    AsyncAzure mock serving the members of the given AD ids on the loop
+    Records the threads running the requests
+    """
+    def __init__(self, ids, users=None):
+        self.ids = ids
+        self.users = users or {}
+        self.threads = set()
+
+    async def open(self):
+        """
+        Opens nothing
+        """
+        return self
+
+    async def close(self):
+        """
+        Closes nothing
+        """
+
+    def get_rate_report(self):
+        """
+        Returns empty counters
+        """
+        return {}
+
+    async def get_all_group_members_map(self, group_id, registry=None):
+        """
+        Returns the Dictionary(<userPrincipalName>, <Contact>) of the members
+        """
+        # pylint: disable=unused-argument
+        self.threads.add(threading.current_thread().name)
+        await asyncio.sleep(0)
+        return {con['userPrincipalName']: con for con in create_azure_contacts(self.ids)}
+
+    async def get_users_with_filters_map(self, ad_user_emails):
+        """
+        Returns the Dictionary(<mail>, <Contact>) of the users
+        """
+        # pylint: disable=unused-argument
+        self.threads.add(threading.current_thread().name)
+        return self.users
+
 def create_azure_instance_without_token(cid=None, secret=None, tenant=None):
     """
     Returns Azure instance
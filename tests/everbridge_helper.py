@@ -1,7 +1,9 @@
 """
 Everbridge Test Helper
 """
+import asyncio
 import base64
+import threading
 from unittest.mock import MagicMock
 from requests import Response
 from api.everbridge import Everbridge
@@ -66,16 +68,140 @@ def create_everbridge_mock(data):
     """
     ever = create_everbridge_instance()
     ever.get_group_id_by_name = MagicMock(return_value=123)
-    ever.get_paged_group_members = MagicMock(side_effect=data)
+    ever.get_group_members_page = MagicMock(side_effect=create_get_page(data))
     ever.add_group = MagicMock()
     ever.delete_group = MagicMock()
     ever.get_contacts_by_external_ids = MagicMock()
     ever.delete_contacts = MagicMock()
-    ever.upsert_contacts = MagicMock()
+    ever.upsert_contacts = MagicMock(return_value={'code': 100, 'message': 'OK', 'failed_contacts': []})
     ever.add_members_to_group = MagicMock()
     ever.delete_members_from_group = MagicMock()
     return ever
 
+def create_changing_everbridge_mock(members, pagesize):
+    """
+    Creates Everbridge API mock whose group members are changed by removing and adding members
+    Pages are sliced by offset from the current members as Everbridge API does
+    Returns the mock and the list of the current members
+    """
+    ever = create_everbridge_mock([])
+    members = list(members)
+    lock = threading.Lock()
+
+    def get_page(group_id, page=1):
+        # pylint: disable=unused-argument
+        with lock:
+            current = sorted(members, key=lambda con: con['externalId'])
+        return {'totalPageCount': -(-len(current) // pagesize),
+                'data': current[(page - 1) * pagesize:page * pagesize]}
+
+    def delete_members_from_group(group_id, ids):
+        # pylint: disable=unused-argument
+        with lock:
+            members[:] = [con for con in members if con['id'] not in ids]
+
+    def add_members_to_group(group_id, external_ids, id_type='id'):
+        # pylint: disable=unused-argument
+        with lock:
+            members.extend({'id': None, 'externalId': eid} for eid in external_ids)
+
+    ever.get_group_members_page = MagicMock(side_effect=get_page)
+    ever.delete_members_from_group = MagicMock(side_effect=delete_members_from_group)
+    ever.add_members_to_group = MagicMock(side_effect=add_members_to_group)
+    return ever, members
+
+def create_get_page(data):
+    """
+    Returns get_group_members_page function that returns data[page - 1]
+    """
+    def get_page(group_id, page=1):
+        # pylint: disable=unused-argument
+        members = data[page - 1] if page <= len(data) else []
+        return {'totalPageCount': len(data), 'data': members}
+    return get_page
+
+class AsyncEverbridgeMock:
+    """
+    AsyncEverbridge mock serving the pages of get_page on the loop
+    Records the requested pages, the contact and member requests and the threads running the requests
+    """
+    def __init__(self, get_page):
+        self.get_page = get_page
+        self.requested = []
+        self.calls = []
+        self.threads = set()
+
+    async def open(self):
+        """
+        Opens nothing
+        """
+        return self
+
+    async def close(self):
+        """
+        Closes nothing
+        """
+
+    def set_pagesize(self, pagesize):
+        """
+        Ignores pagesize
+        """
+
+    def get_rate_report(self):
+        """
+        Returns empty counters
+        """
+        return {}
+
+    async def get_group_members_page(self, group_id, page=1):
+        """
+        Returns the page object of group members
+        """
+        self.requested.append((group_id, page))
+        self.threads.add(threading.current_thread().name)
+        await asyncio.sleep(0)
+        return self.get_page(group_id, page)
+
+    async def _record(self, method, *args):
+        """
+        Records the request
+        """
+        self.calls.append((method,) + args)
+        self.threads.add(threading.current_thread().name)
+        await asyncio.sleep(0)
+
+    async def get_contacts_by_external_id_list(self, external_ids):
+        """
+        Returns no contacts
+        """
+        await self._record('get_contacts_by_external_id_list', external_ids)
+        return []
+
+    async def upsert_contacts(self, contacts):
+        """
+        Returns the result with no failed contacts
+        """
+        await self._record('upsert_contacts', contacts)
+        return {'code': 100, 'message': 'OK', 'failed_contacts': []}
+
+    async def delete_contacts(self, contacts):
+        """
+        Records the contacts to delete
+        """
+        await self._record('delete_contacts', contacts)
+
+    async def delete_members_from_group(self, group_id, members):
+        """
+        Records the members to remove
+        """
+        await self._record('delete_members_from_group', group_id, members)
+
+    async def add_members_to_group(self, group_id, members, id_type='id'):
+        """
+        Records the members to add
+        """
+        await self._record('add_members_to_group', group_id, members, id_type)
+
 def modify_everbridge_data(data, ids, key, val):
     """
     Changes contacts specified by ids
@@ -108,7 +234,7 @@ def create_everbridge_contact(seq, eid=None):
     """
     Returns Everbridge Contact Object
     """
-    contact = convert_to_everbridge(create_azure_contact(seq), eid)
+    contact = convert_to_everbridge(create_azure_contact(seq), eid).to_dict()
     contact.pop('errors', None)
     return contact
 
@@ -1,6 +1,8 @@
 """
 Helps mock management in tests
 """
+import asyncio
+import json
 import logging
 from unittest.mock import MagicMock
 import adal
@@ -137,6 +139,51 @@ def create_everbridge_insert_mock(group_value):
     mock_session.insert_new_contacts = MagicMock(return_value=None)
     return mock_session
 
+class AiohttpResponseMock:
+    """
+    aiohttp response returning the given status and body
+    """
+    def __init__(self, session, body, status=200, headers=None):
+        self.session = session
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        self.session.in_flight += 1
+        self.session.max_in_flight = max(self.session.max_in_flight, self.session.in_flight)
+        return self
+
+    async def __aexit__(self, *args):
+        self.session.in_flight -= 1
+
+    async def text(self):
+        """
+        Returns the body after yielding to the other requests
+        """
+        await asyncio.sleep(0.01)
+        return json.dumps(self.body)
+
+class AiohttpSessionMock:
+    """
+    aiohttp session returning the response made by respond(method, url, json) for each request
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def request(self, method, url, **kwargs):
+        """
+        Records the request and returns AiohttpResponseMock
+        """
+        self.calls.append((method, url, kwargs))
+        rslt = self.respond(method, url, kwargs.get('json'))
+        if isinstance(rslt, AiohttpResponseMock):
+            return rslt
+        return AiohttpResponseMock(self, rslt)
+
 class LoggingMock(BaseMock):
     """
     Handles logging mock
@@ -0,0 +1,169 @@
+"""
+Tests AsyncAzure
+"""
+import asyncio
+import time
+from unittest.mock import MagicMock
+import pytest
+from api.async_azure import AsyncAzure
+from api.azure import Azure
+from api.contact_registry import ContactRegistry
+from api.exceptions import AzureException
+from tests.azure_helper import create_azure_instance, create_azure_contacts
+from tests.mock_helper import AiohttpResponseMock, AiohttpSessionMock
+# pylint: disable=unused-import
+import tests.log_helper
+
+def create_instance(respond, azure=None):
+    """
+    Returns AsyncAzure sending requests to AiohttpSessionMock
+    """
+    client = AsyncAzure(azure or create_azure_instance())
+    client.session = AiohttpSessionMock(respond)
+    return client
+
+def create_member_pages(groups):
+    """
+    Returns respond function serving the member pages of each group through nextLink
+    groups: dictionary(<group id>, <list of pages of sequence numbers>)
+    """
+    def respond(method, url, data):
+        gid = url.split('/groups/')[1].split('/')[0]
+        page = int(url.split('$skiptoken=')[1]) if '$skiptoken=' in url else 0
+        res = {'value': create_azure_contacts(groups[gid][page])}
+        if page + 1 < len(groups[gid]):
+            res['@odata.nextLink'] = Azure.API_GROUPS + gid + f'/members/microsoft.graph.user?$skiptoken={page + 1}'
+        return res
+    return respond
+
+def test_get_all_group_members():
+    """
+    Should follow nextLink and return all the members with the shared token
+    """
+    client = create_instance(create_member_pages({'gid1': [[1, 2], [3]]}))
+    members = asyncio.run(client.get_all_group_members('gid1'))
+    assert [con['id'] for con in members] == [1, 2, 3]
+    method, url, kwargs = client.session.calls[0]
+    assert method == 'get'
+    assert url == client.azure.user_members_url('gid1') + client.azure.member_query()
+    assert kwargs['headers'] == {'Authorization': 'Bearer XXXTOKENXXX'}
+    assert client.session.calls[1][1] == client.azure.user_members_url('gid1') + '?$skiptoken=1'
+
+def test_iter_group_member_pages():
+    """
+    Should yield each page and fetch the next one while the current page is processed
+    """
+    client = create_instance(create_member_pages({'gid1': [[1, 2], [3], [4]]}))
+    async def consume():
+        pages = []
+        async for page in client.iter_group_member_pages('gid1'):
+            await asyncio.sleep(0.01)
+            pages.append(([con['id'] for con in page], len(client.session.calls)))
+        return pages
+    assert asyncio.run(consume()) == [([1, 2], 2), ([3], 3), ([4], 3)]
+
+def test_iter_group_member_pages_stopped():
+    """
+    Should cancel the prefetched page when the caller stops early
+    """
+    client = create_instance(create_member_pages({'gid1': [[1], [2], [3]]}))
+    async def consume():
+        pages = client.iter_group_member_pages('gid1')
+        async for page in pages:
+            break
+        await pages.aclose()
+        return page
+    assert [con['id'] for con in asyncio.run(consume())] == [1]
+    assert len(client.session.calls) <= 2
+
+def test_get_all_group_members_map():
+    """
+    Should validate the members page by page and return them by userPrincipalName
+    """
+    client = create_instance(create_member_pages({'gid1': [[1], [2]]}))
+    members = asyncio.run(client.get_all_group_members_map('gid1', ContactRegistry()))
+    assert list(members) == ['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com']
+    assert len(client.session.calls) == 2
+
+def test_get_group_members_with_unexpected_response():
+    """
+    Should raise AzureException unless the status is 200
+    """
+    client = create_instance(lambda method, url, data: AiohttpResponseMock(client.session, {'error': 'x'}, 404))
+    with pytest.raises(AzureException):
+        asyncio.run(client.get_group_members('gid1'))
+
+def test_refresh_shared_token():
+    """
+    Should refresh the token shared with Azure once when it expires soon
+    """
+    azure = create_azure_instance(token={'accessToken': 'OLD', 'expiresAt': time.time() + 60})
+    azure.get_token = MagicMock(return_value={'accessToken': 'NEW', 'expiresIn': '3599'})
+    client = create_instance(lambda method, url, data: {'displayName': 'GROUP'}, azure)
+    async def get_names():
+        return await asyncio.gather(client.get_group_name('gid1'), client.get_group_name('gid2'))
+    assert asyncio.run(get_names()) == ['GROUP', 'GROUP']
+    azure.get_token.assert_called_once_with()
+    assert azure.token['accessToken'] == 'NEW'
+    assert client.session.calls[1][2]['headers'] == {'Authorization': 'Bearer NEW'}
+
+def test_get_groups(monkeypatch):
+    """
+    Should send $batch requests at the same time and cache the groups in Azure
+    """
+    def respond(method, url, data):
+        assert url == Azure.API_BATCH
+        return {'responses': [{'id': req['id'], 'status': 200 if req['url'] != '/groups/gid3' else 404,
+                               'body': {'displayName': req['url'][8:].upper()}}
+                              for req in data['requests']]}
+    azure = create_azure_instance()
+    client = create_instance(respond, azure)
+    client.azure.groups['gid1'] = {'displayName': 'CACHED'}
+    monkeypatch.setattr(Azure, 'MAX_BATCH_REQUESTS', 1)
+    groups = asyncio.run(client.get_groups(['gid1', 'gid2', 'gid3', 'gid4']))
+    assert groups == {'gid1': {'displayName': 'CACHED'}, 'gid2': {'displayName': 'GID2'},
+                      'gid4': {'displayName': 'GID4'}}
+    assert azure.get_group_name('gid4') == 'GID4'
+    assert client.session.max_in_flight == 3
+
+def test_get_users_with_filters_map():
+    """
+    Should follow nextLink and return users by mail
+    """
+    def respond(method, url, data):
+        if url.endswith('$skiptoken=1'):
+            return {'value': create_azure_contacts([2])}
+        return {'value': create_azure_contacts([1]), '@odata.nextLink': Azure.API_USERS_QUERY + '?$skiptoken=1'}
+    client = create_instance(respond)
+    users = asyncio.run(client.get_users_with_filters_map(['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com']))
+    assert list(users) == ['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com']
+    assert len(client.session.calls) == 2
+
+def test_get_users_with_filters_map_in_chunks():
+    """
+    Should look up chunks of emails at the same time and merge the users
+    """
+    def respond(method, url, data):
+        seqs = [int(email[7:11]) for email in url.split("'")[1::2]]
+        return {'value': create_azure_contacts(seqs)}
+    client = create_instance(respond)
+    emails = [f'aaa.bbb{str(i).zfill(4)}@xxx.com' for i in range(1, 32)]
+    users = asyncio.run(client.get_users_with_filters_map(emails))
+    assert sorted(users) == emails
+    assert len(client.session.calls) == 3
+    assert client.session.max_in_flight == 3
+
+def test_retry_throttled_request():
+    """
+    Should retry the request throttled by Graph API
+    """
+    responses = []
+    def respond(method, url, data):
+        if not responses:
+            responses.append(1)
+            return AiohttpResponseMock(client.session, {}, 429, {'Retry-After': '0'})
+        return {'displayName': 'GROUP'}
+    client = create_instance(respond)
+    client.rate_control.set_backoff(0.0)
+    assert asyncio.run(client.get_group_name('gid1')) == 'GROUP'
+    assert client.get_rate_report()['retries'] == 1
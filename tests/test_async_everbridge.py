@@ -0,0 +1,204 @@
+"""
+Tests AsyncEverbridge
+"""
+import asyncio
+import pytest
+from api.async_everbridge import AsyncEverbridge
+from api.everbridge import Everbridge, GroupDirectory
+from api.exceptions import EverbridgeException
+from tests.everbridge_helper import create_everbridge_contacts
+from tests.mock_helper import AiohttpResponseMock, AiohttpSessionMock
+# pylint: disable=unused-import
+import tests.log_helper
+
+def create_instance(respond):
+    """
+    Returns AsyncEverbridge sending requests to AiohttpSessionMock
+    """
+    ever = AsyncEverbridge('1234567', 'user', 'pass')
+    ever.session = AiohttpSessionMock(respond)
+    return ever
+
+def create_pages(group_id, total):
+    """
+    Returns respond function serving the pages of group members
+    """
+    def respond(method, url, data):
+        assert method == 'get'
+        assert f'groupIds={group_id}' in url
+        page = int(url.split('pageNumber=')[1].split('&')[0])
+        return {'page': {'totalPageCount': total, 'data': create_everbridge_contacts([page], True)}}
+    return respond
+
+def test_headers():
+    """
+    Should send the authorization header as str
+    """
+    ever = AsyncEverbridge('1234567', 'user', 'pass')
+    assert ever.headers['Authorization'] == 'dXNlcjpwYXNz'
+
+def test_get_all_group_members():
+    """
+    Should fetch all the pages at the same time and return the members in order
+    """
+    ever = create_instance(create_pages(123, 5))
+    members = asyncio.run(ever.get_all_group_members(123))
+    assert [con['id'] for con in members] == [1, 2, 3, 4, 5]
+    assert len(ever.session.calls) == 5
+    assert ever.session.max_in_flight == 4
+
+def test_get_all_group_members_within_max_concurrency():
+    """
+    Should not send more requests at the same time than max_concurrency
+    """
+    ever = create_instance(create_pages(123, 20))
+    ever.set_max_concurrency(3)
+    members = asyncio.run(ever.get_all_group_members(123))
+    assert len(members) == 20
+    assert ever.session.max_in_flight == 3
+
+def test_get_paged_group_members():
+    """
+    Should return the members in the page
+    """
+    ever = create_instance(create_pages(123, 2))
+    ever.set_pagesize(50)
+    members = asyncio.run(ever.get_paged_group_members(123, 2))
+    assert [con['id'] for con in members] == [2]
+    exp = 'https://api.everbridge.net/rest/contacts/1234567/' + \
+          '?groupIds=123&pageSize=50&pageNumber=2&sortBy=externalId&direction=ASC'
+    assert ever.session.calls == [('get', exp, {})]
+
+def test_get_group_members_page_with_unexpected_response():
+    """
+    Should raise EverbridgeException
+    """
+    ever = create_instance(lambda method, url, data: {'message': 'Error'})
+    with pytest.raises(EverbridgeException):
+        asyncio.run(ever.get_group_members_page(123))
+
+def test_upsert_contacts_in_chunks(monkeypatch):
+    """
+    Should send the chunks at the same time and report the contacts of the failed chunk
+    """
+    def respond(method, url, data):
+        if data[0]['externalId'] == 'aaa.bbb0003@xxx.com':
+            return {'message': 'Error'}
+        return {'code': 100, 'message': 'OK'}
+    contacts = create_everbridge_contacts([1, 2, 3], False)
+    ever = create_instance(respond)
+    monkeypatch.setattr(Everbridge, 'MAX_UPSERT_CONTACTS', 2)
+    rslt = asyncio.run(ever.upsert_contacts(contacts))
+    assert rslt['failed_contacts'] == contacts[2:]
+    assert len(rslt['results']) == 1
+    # The chunk rejected without 5xx status is not retried
+    assert len(ever.session.calls) == 2
+
+def test_upsert_contacts_retries_server_error():
+    """
+    Should retry the chunk that failed with 5xx status
+    """
+    responses = [{'status': 503, 'message': 'Unavailable'}, {'code': 100, 'message': 'OK'}]
+    ever = create_instance(lambda method, url, data: responses.pop(0))
+    ever.rate_control.set_backoff(0)
+    rslt = asyncio.run(ever.upsert_contacts(create_everbridge_contacts([1], False)))
+    assert rslt['failed_contacts'] == []
+    assert len(ever.session.calls) == 2
+
+def test_upsert_contacts_failed():
+    """
+    Should raise EverbridgeException if all the chunks failed
+    """
+    ever = create_instance(lambda method, url, data: {'message': 'Error'})
+    with pytest.raises(EverbridgeException):
+        asyncio.run(ever.upsert_contacts(create_everbridge_contacts([1], False)))
+
+def test_add_members_to_group():
+    """
+    Should add the contacts to the group by externalId
+    """
+    ever = create_instance(lambda method, url, data: {'code': 100, 'message': 'OK'})
+    asyncio.run(ever.add_members_to_group(123, ['aaa', 'bbb'], 'externalId'))
+    exp = 'https://api.everbridge.net/rest/groups/1234567/contacts?byType=id&groupId=123&idType=externalId'
+    assert ever.session.calls == [('post', exp, {'json': ['aaa', 'bbb']})]
+
+def test_delete_members_from_group_with_unexpected_response():
+    """
+    Should raise EverbridgeException
+    """
+    ever = create_instance(lambda method, url, data: {'message': 'Error'})
+    with pytest.raises(EverbridgeException):
+        asyncio.run(ever.delete_members_from_group(123, [1, 2]))
+
+def test_get_contacts_by_external_id_list():
+    """
+    Should divide externalIds into requests and return all the contacts
+    """
+    def respond(method, url, data):
+        ids = [int(exid[-11:-8]) for exid in url.split('&externalIds=')[1:]]
+        return {'page': {'data': create_everbridge_contacts(ids, True)}}
+    exids = [con['externalId'] for con in create_everbridge_contacts([1, 2, 3], False)]
+    ever = create_instance(respond)
+    contacts = asyncio.run(ever.get_contacts_by_external_id_list(exids, 2))
+    assert [con['id'] for con in contacts] == [1, 2, 3]
+    assert len(ever.session.calls) == 2
+
+def test_retry_throttled_request():
+    """
+    Should retry the throttled request and count it
+    """
+    responses = []
+    def respond(method, url, data):
+        if not responses:
+            responses.append(1)
+            return AiohttpResponseMock(ever.session, {}, 429, {'Retry-After': '0'})
+        return {'result': {'id': 999}}
+    ever = create_instance(respond)
+    ever.rate_control.set_backoff(0.0)
+    group = asyncio.run(ever.get_group_by_name('GROUP1'))
+    assert group == {'id': 999}
+    report = ever.get_rate_report()
+    assert report['requests'] == 2
+    assert report['throttled'] == 1
+    assert report['retries'] == 1
+
+def test_give_up_throttled_request():
+    """
+    Should raise EverbridgeException after retries run out
+    """
+    ever = create_instance(lambda method, url, data: AiohttpResponseMock(ever.session, {}, 503))
+    ever.set_max_retries(1)
+    ever.rate_control.set_backoff(0.0)
+    with pytest.raises(EverbridgeException):
+        asyncio.run(ever.get_group_by_name('GROUP1'))
+    assert ever.get_rate_report()['gave_up'] == 1
+
+def test_get_group_id_by_name_with_directory():
+    """
+    Should list all the groups once and serve group ids from GroupDirectory
+    """
+    def respond(method, url, data):
+        page = int(url.split('pageNumber=')[1])
+        return {'page': {'totalPageCount': 2, 'data': [{'name': f'GROUP{page}', 'id': page}]}}
+    ever = create_instance(respond)
+    ever.set_group_directory(GroupDirectory())
+    async def get_ids():
+        return await asyncio.gather(ever.get_group_id_by_name('GROUP1'), ever.get_group_id_by_name('GROUP2'))
+    assert asyncio.run(get_ids()) == [1, 2]
+    assert len(ever.session.calls) == 2
+
+def test_add_and_delete_group():
+    """
+    Should create and delete the group and keep GroupDirectory up to date
+    """
+    def respond(method, url, data):
+        return {'message': 'OK', 'id': 999}
+    ever = create_instance(respond)
+    directory = GroupDirectory()
+    directory.fill([])
+    ever.set_group_directory(directory)
+    asyncio.run(ever.add_group('GROUP1', 888))
+    assert ever.session.calls[0][2] == {'json': {'name': 'GROUP1', 'organizationId': '1234567', 'parentId': 888}}
+    assert directory.get('GROUP1') == 999
+    asyncio.run(ever.delete_group(999))
+    assert directory.get('GROUP1') is None
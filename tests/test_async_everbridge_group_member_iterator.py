@@ -0,0 +1,32 @@
+"""
+Tests AsyncEverbridgeGroupMemberIterator
+"""
+from api.async_everbridge_group_member_iterator import AsyncEverbridgeGroupMemberIterator
+from api.async_runner import AsyncRunner
+from tests.everbridge_helper import AsyncEverbridgeMock, create_get_page
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_iterator():
+    """
+    Should fetch the pages on the loop of AsyncRunner reading ahead up to read_ahead pages
+    """
+    pages = [[{'id': str(p), 'externalId': f'aaa{p:02}@test.com'}] for p in range(6)]
+    ever = AsyncEverbridgeMock(create_get_page(pages))
+    runner = AsyncRunner(everbridge=ever).open()
+    itr = AsyncEverbridgeGroupMemberIterator(runner, 123, read_ahead=2)
+    itr.set_pagesize(1)
+    assert next(itr) == pages[0][0]
+    for future in list(itr.pending):
+        future.result()
+    assert ever.requested == [(123, 1), (123, 2), (123, 3)]
+    members = [pages[0][0]]
+    con = next(itr)
+    while con:
+        members.append(con)
+        con = next(itr)
+    runner.close()
+    assert members == [con for page in pages for con in page]
+    assert len(ever.requested) == 6
+    assert ever.threads == {'AsyncRunner'}
+    assert itr.executor is None
@@ -0,0 +1,69 @@
+"""
+Tests AsyncRunner
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from api.async_runner import AsyncRunner
+from api.exceptions import EverbridgeException
+# pylint: disable=unused-import
+import tests.log_helper
+
+class ClientMock:
+    """
+    Async client that records the loop it is opened and closed on
+    """
+    def __init__(self, error=None):
+        self.error = error
+        self.opened_on = None
+        self.closed_on = None
+
+    async def open(self):
+        """
+        Records the running loop; raises the error if given
+        """
+        self.opened_on = asyncio.get_running_loop()
+        if self.error:
+            raise self.error
+        return self
+
+    async def close(self):
+        """
+        Records the running loop
+        """
+        self.closed_on = asyncio.get_running_loop()
+
+async def get_loop_thread():
+    """
+    Returns the name of the thread running the loop
+    """
+    await asyncio.sleep(0)
+    return threading.current_thread().name
+
+def test_run():
+    """
+    Should run coroutines submitted from several threads on one loop
+    """
+    client = ClientMock()
+    runner = AsyncRunner(everbridge=client).open()
+    loop = runner.loop
+    assert client.opened_on is loop
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        names = list(executor.map(lambda _: runner.run(get_loop_thread()), range(8)))
+    assert names == ['AsyncRunner'] * 8
+    runner.close()
+    assert client.closed_on is loop
+    assert loop.is_closed()
+    assert runner.loop is None
+
+def test_open_with_error():
+    """
+    Should stop the loop and raise the error if the client fails to open
+    """
+    client = ClientMock(EverbridgeException('ASYNC_EVERBRIDGE.OPEN: Failed'))
+    runner = AsyncRunner(everbridge=client)
+    with pytest.raises(EverbridgeException):
+        runner.open()
+    assert runner.loop is None
+    assert client.closed_on is not None
@@ -2,12 +2,16 @@
 Tests Azure Functions
 """
 import json
+import time
+from datetime import datetime
 from unittest.mock import MagicMock
 import pytest
 from adal import AdalError
+from cryptography.fernet import Fernet
+from requests import Response
 from requests.exceptions import HTTPError, Timeout
-from api.exceptions import AzureException
-from api.azure import Azure
+from api.exceptions import AzureException, AzureDeltaTokenException
+from api.azure import Azure, TokenCache
 from api.contact_validator import validate_and_fix_azure_contact
 from tests.mock_helper import AdalMock, RequestsMock
 from tests.azure_helper import create_azure_instance, \
@@ -139,7 +143,7 @@ def test_get_token_with_valid_params():
     token = azure.get_token()
     authority_url = azure.authority_url()
     # Check if arguments passed to adal functions are correct
-    mock.access('adal.AuthenticationContext').assert_called_with(authority_url)
+    mock.access('adal.AuthenticationContext').assert_called_with(authority_url, timeout=Azure.DEFAULT_TIMEOUT)
     mock.access('context.acquire_token_with_client_credentials') \
         .assert_called_with(api_url, cid, secret)
     assert token == expected_res
@@ -272,9 +276,11 @@ def test_get_group_members_with_valid_params():
     azure = create_azure_instance()
     azure.setup()
     data = azure.get_group_members(gid, None)
-    expected_url = azure.group_members_url(gid)
+    expected_url = ('https://graph.microsoft.com/v1.0/groups/' + gid +
+                    '/members/microsoft.graph.user?$select=id,userPrincipalName,givenName,surname,' +
+                    'displayName,mail,businessPhones,mobilePhone&$top=999')
     # Check if arguments passed to session.get are correct
-    mock.access('session.get').assert_called_with(expected_url)
+    mock.access('session.get').assert_called_with(expected_url, timeout=Azure.DEFAULT_TIMEOUT)
     mock.access('session.headers.update').assert_called_with({
         'Authorization': 'Bearer XXXTOKENXXX',
         'Accept': 'application/json',
@@ -391,7 +397,7 @@ def test_get_paged_group_members_with_valid_params():
     data = azure.get_paged_group_members(gid, 1)
     expected_url = azure.paged_group_members_url(gid, 1)
     # Check if arguments passed to session.get are correct
-    mock.access('session.get').assert_called_with(expected_url)
+    mock.access('session.get').assert_called_with(expected_url, timeout=Azure.DEFAULT_TIMEOUT)
     mock.access('session.headers.update').assert_called_with({
         'Authorization': 'Bearer XXXTOKENXXX',
         'Accept': 'application/json',
@@ -490,7 +496,7 @@ def test_get_group_name_with_valid_params():
     data = azure.get_group_name(gid)
     expected_url = azure.group_url(gid)
     # Check if arguments passed to session.get are correct
-    mock.access('session.get').assert_called_with(expected_url)
+    mock.access('session.get').assert_called_with(expected_url, timeout=Azure.DEFAULT_TIMEOUT)
     mock.access('session.headers.update').assert_called_with({
         'Authorization': 'Bearer XXXTOKENXXX',
         'Accept': 'application/json',
@@ -532,13 +538,13 @@ def test_get_all_group_members_map():
     contacts = create_azure_contacts([1, 2, 3, 4, 5])
     expected_keys = [con['userPrincipalName'] for con in contacts]
     azure = create_azure_instance()
-    azure.get_all_group_members = MagicMock(return_value=contacts)
+    azure.iter_group_members = MagicMock(return_value=iter(contacts))
     rslt = azure.get_all_group_members_map(123)
     print(expected_keys)
     print(rslt.keys())
     assert list(rslt.keys()) == expected_keys
     for key in rslt:
-        expected_contact = contacts.pop(0)
+        expected_contact = validate_and_fix_azure_contact(contacts.pop(0))
         assert rslt[key] == expected_contact
 
 def test_get_sorted_group_members():
@@ -548,10 +554,57 @@ def test_get_sorted_group_members():
     contacts = create_azure_contacts([5, 3, 2, 1, 4])
     expected = create_azure_contacts([1, 2, 3, 4, 5])
     azure = create_azure_instance()
-    azure.get_all_group_members = MagicMock(return_value=contacts)
+    azure.iter_group_members = MagicMock(return_value=iter(contacts))
     sorted_contacts = azure.get_sorted_group_members(123)
     assert sorted_contacts == expected
 
+def test_iter_sorted_group_members():
+    """
+    Should yield validated contacts sorted by userPrincipalName across sorted runs
+    """
+    contacts = create_azure_contacts([5, 3, 2, 1, 4])
+    expected = [validate_and_fix_azure_contact(con) for con in create_azure_contacts([1, 2, 3, 4, 5])]
+    azure = create_azure_instance()
+    azure.iter_group_members = MagicMock(return_value=iter(contacts))
+    assert list(azure.iter_sorted_group_members(123, 2)) == expected
+
+def test_get_group_member_count():
+    """
+    Should return the number of users with the advanced query header
+    """
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.get = MagicMock(return_value=MagicMock(status_code=200, text='42'))
+    assert azure.get_group_member_count('xxxx') == 42
+    azure.session.get.assert_called_with(
+        'https://graph.microsoft.com/v1.0/groups/xxxx/members/microsoft.graph.user/$count',
+        headers={'ConsistencyLevel': 'eventual'}, timeout=Azure.DEFAULT_TIMEOUT)
+
+def test_send_retries_throttled_request(monkeypatch):
+    """
+    Should retry the request throttled with HTTP 429 and count it
+    """
+    monkeypatch.setattr('api.rate_control.time.sleep', lambda sec: None)
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.get = MagicMock(side_effect=[
+        MagicMock(status_code=429, headers={'Retry-After': '1'}),
+        MagicMock(status_code=200, text='42')])
+    assert azure.get_group_member_count('xxxx') == 42
+    assert azure.session.get.call_count == 2
+    report = azure.get_rate_report()
+    assert report['throttled'] == 1
+    assert report['retries'] == 1
+    assert 'groups' in report['limits']
+
+def test_get_group_member_count_with_invalid_groupid():
+    """
+    Should raise an exception
+    """
+    azure = create_azure_instance()
+    with pytest.raises(AzureException):
+        azure.get_group_member_count(None)
+
 def test_get_users_with_filters_map():
     """
     Should raise an exception with an empty or invalid parameter
@@ -631,7 +684,7 @@ def test_get_users_with_filters_map_valid_params():
     data = azure.get_users_with_filters_map(["TESTUSER@hawaii.gov"])
     expected_url = azure.user_filter_url(azure.generate_email_filter_string(["TESTUSER@hawaii.gov"]))
     # Check if arguments passed to session.get are correct
-    mock.access('session.get').assert_called_with(expected_url)
+    mock.access('session.get').assert_called_with(expected_url, timeout=Azure.DEFAULT_TIMEOUT)
     mock.access('session.headers.update').assert_called_with({
         'Authorization': 'Bearer XXXTOKENXXX',
         'Accept': 'application/json',
@@ -642,6 +695,64 @@ def test_get_users_with_filters_map_valid_params():
     # Reinstate mocked functions
     mock.restore()
 
+def test_generate_email_filter_string():
+    """
+    Should match emails exactly with single quotes escaped
+    """
+    azure = create_azure_instance()
+    assert azure.generate_email_filter_string(["aaa@xxx.com", "o'neil@xxx.com"]) == \
+        "?$filter=mail in ('aaa@xxx.com','o''neil@xxx.com')"
+    with pytest.raises(AzureException):
+        azure.generate_email_filter_string([f'user{i}@xxx.com' for i in range(16)])
+
+def test_generate_email_filter_strings():
+    """
+    Should divide emails into chunks of MAX_FILTER_VALUES without duplicates
+    """
+    azure = create_azure_instance()
+    emails = [f'user{i}@xxx.com' for i in range(40)]
+    filters = azure.generate_email_filter_strings(emails + emails[:5])
+    assert filters == [azure.generate_email_filter_string(emails[0:15]),
+                       azure.generate_email_filter_string(emails[15:30]),
+                       azure.generate_email_filter_string(emails[30:40])]
+
+def test_get_users_with_filters_map_in_chunks():
+    """
+    Should send each chunk, follow nextLink and merge the users
+    """
+    def get(url, timeout):
+        res = Response()
+        res.status_code = 200
+        if url.endswith('$skiptoken=X'):
+            data = {'value': create_azure_contacts([16])}
+        elif "'aaa.bbb0001@xxx.com'" in url:
+            data = {'value': create_azure_contacts(range(1, 16)),
+                    '@odata.nextLink': Azure.API_USERS_QUERY + '?$skiptoken=X'}
+        else:
+            data = {'value': create_azure_contacts([17])}
+        res.json = MagicMock(return_value=data)
+        return res
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.get = MagicMock(side_effect=get)
+    emails = [f'aaa.bbb{str(i).zfill(4)}@xxx.com' for i in range(1, 18)]
+    users = azure.get_users_with_filters_map(emails)
+    assert sorted(users) == emails
+    assert azure.session.get.call_count == 3
+
+def test_get_users_with_filters_map_with_failed_chunk():
+    """
+    Should raise an exception if any chunk fails
+    """
+    res = Response()
+    res.status_code = 400
+    res.json = MagicMock(return_value={'error': 'Bad Request'})
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.get = MagicMock(return_value=res)
+    with pytest.raises(AzureException):
+        azure.get_users_with_filters_map(['aaa@xxx.com'])
+
 def test_get_group_emails():
     """
     Should return new dictionary with added group data
@@ -709,8 +820,10 @@ def test_get_group_emails():
     initial_data = {
         "TESTUSER@hawaii.gov": validated_user
     }
+    azure.session.post = MagicMock(return_value=create_batch_response([expected]))
     data = azure.get_group_emails(initial_data, ["abcdefghijk"])
     print(data["testGroup@hawaii.gov"])
+    azure.session.get.assert_not_called()
     # Check if arguments passed to session.get are correct
     assert data == expected_value
     # Reinstate mocked functions
@@ -738,4 +851,285 @@ def test_get_group_emails_invalid_token():
         azure.get_group_emails({}, ["abcdefghijk"])
     with pytest.raises(AzureException):
         azure = create_azure_instance('cid', 'secret', 'tenant', {'accessToken':None})
-        azure.get_group_emails({}, ["abcdefghijk"])
\ No newline at end of file
+        azure.get_group_emails({}, ["abcdefghijk"])
+
+def test_group_delta_url():
+    """
+    Should return delta URL filtered by the group
+    """
+    azure = create_azure_instance()
+    url = azure.group_delta_url('xxxx')
+    assert url == "https://graph.microsoft.com/v1.0/groups/delta?$filter=id eq 'xxxx'&$select=members"
+
+def test_get_latest_delta_link():
+    """
+    Should return deltaLink of the latest state
+    """
+    azure = create_azure_instance()
+    azure._get_delta_page = MagicMock(return_value={'value': [], '@odata.deltaLink': 'LINK'})
+    assert azure.get_latest_delta_link('xxxx') == 'LINK'
+    azure._get_delta_page.assert_called_with(azure.group_delta_url('xxxx') + '&$deltatoken=latest')
+
+def test_get_group_member_delta():
+    """
+    Should return added and removed user ids across pages
+    """
+    user = '#microsoft.graph.user'
+    pages = [
+        {
+            'value': [{'id': 'gid', 'members@delta': [
+                {'@odata.type': user, 'id': 'u1'},
+                {'@odata.type': user, 'id': 'u2', '@removed': {'reason': 'deleted'}},
+                {'@odata.type': '#microsoft.graph.group', 'id': 'g1'}]}],
+            '@odata.nextLink': 'NEXT'
+        },
+        {
+            'value': [{'id': 'gid', 'members@delta': [
+                {'@odata.type': user, 'id': 'u3'},
+                {'@odata.type': user, 'id': 'u1', '@removed': {'reason': 'deleted'}}]}],
+            '@odata.deltaLink': 'LINK2'
+        }
+    ]
+    azure = create_azure_instance()
+    azure._get_delta_page = MagicMock(side_effect=pages)
+    rslt = azure.get_group_member_delta('gid', 'LINK1')
+    assert rslt == {'added': ['u3'], 'removed': ['u2', 'u1'], 'deltaLink': 'LINK2'}
+    azure._get_delta_page.assert_any_call('LINK1')
+    azure._get_delta_page.assert_called_with('NEXT')
+
+def test_get_delta_page_with_rejected_token():
+    """
+    Should raise AzureDeltaTokenException when Graph requires a resync
+    """
+    mock = RequestsMock()
+    mock.setup({'error': {'code': 'resyncRequired'}}, 410)
+    azure = create_azure_instance()
+    azure.setup()
+    with pytest.raises(AzureDeltaTokenException):
+        azure._get_delta_page('LINK')
+    mock.restore()
+
+def test_get_group_member_changes():
+    """
+    Should return validated contacts of added users
+    """
+    azure = create_azure_instance()
+    contacts = create_azure_contacts([1, 2])
+    azure.get_group_member_delta = MagicMock(
+        return_value={'added': [1, 2], 'removed': ['u9'], 'deltaLink': 'LINK2'})
+    azure.get_users_by_ids = MagicMock(return_value=contacts)
+    rslt = azure.get_group_member_changes('gid', 'LINK1')
+    azure.get_users_by_ids.assert_called_with([1, 2])
+    assert list(rslt['added'].keys()) == ['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com']
+    assert rslt['added']['aaa.bbb0001@xxx.com']['errors'] is False
+    assert rslt['removed'] == ['u9']
+    assert rslt['deltaLink'] == 'LINK2'
+
+def test_token_cache_is_valid():
+    """
+    Should return False if the token expires within the margin
+    """
+    now = time.time()
+    assert TokenCache.is_valid({'accessToken': 'XXX'})
+    assert TokenCache.is_valid({'accessToken': 'XXX', 'expiresAt': now + 600}, 300)
+    assert not TokenCache.is_valid({'accessToken': 'XXX', 'expiresAt': now + 200}, 300)
+    assert not TokenCache.is_valid({'accessToken': None})
+    assert not TokenCache.is_valid(None)
+    expires_on = datetime.fromtimestamp(now + 600).strftime('%Y-%m-%d %H:%M:%S.%f')
+    assert TokenCache.is_valid({'accessToken': 'XXX', 'expiresOn': expires_on}, 300)
+    assert not TokenCache.is_valid({'accessToken': 'XXX', 'expiresOn': expires_on}, 900)
+
+def test_token_cache_with_file(tmp_path):
+    """
+    Should save the token encrypted and restore it in another process
+    """
+    filename = str(tmp_path / 'token.bin')
+    key = Fernet.generate_key()
+    token = {'accessToken': 'XXXTOKENXXX', 'expiresAt': time.time() + 3600}
+    TokenCache(filename, key).set('tenant:cid', token)
+    with open(filename, 'rb') as stream:
+        assert b'XXXTOKENXXX' not in stream.read()
+    TokenCache.MEMORY.clear()
+    assert TokenCache(filename, key).get('tenant:cid', 300) == token
+    # Wrong key is treated as an empty cache
+    TokenCache.MEMORY.clear()
+    assert TokenCache(filename, Fernet.generate_key()).get('tenant:cid') is None
+    with pytest.raises(AzureException):
+        TokenCache(filename)
+
+def test_setup_with_token_cache():
+    """
+    Should reuse the cached token without requesting a new one
+    """
+    token = {'accessToken': 'CACHED', 'expiresAt': time.time() + 3600}
+    TokenCache.MEMORY.clear()
+    TokenCache().set('tenant:cid', token)
+    azure = Azure('cid', 'secret', 'tenant')
+    azure.get_token = MagicMock()
+    azure.set_token_cache(TokenCache())
+    azure.setup()
+    azure.get_token.assert_not_called()
+    assert azure.token == token
+    TokenCache.MEMORY.clear()
+
+def test_refresh_token_if_expiring():
+    """
+    Should get a new token and update the session header when the token expires soon
+    """
+    azure = create_azure_instance(token={'accessToken': 'OLD', 'expiresAt': time.time() + 60})
+    azure.session = MagicMock()
+    azure.get_token = MagicMock(return_value={'accessToken': 'NEW', 'expiresIn': '3599'})
+    azure._check_setup()
+    azure.get_token.assert_called_with()
+    azure.session.headers.update.assert_called_with({'Authorization': 'Bearer NEW'})
+    assert TokenCache.is_valid(azure.token, Azure.TOKEN_REFRESH_MARGIN)
+    # Does not refresh again while the token is valid
+    azure._check_setup()
+    assert azure.get_token.call_count == 1
+
+def test_get_group_members_with_skip_token():
+    """
+    Should keep the user cast when following the next page
+    """
+    gid = 'xxxx'
+    mock = RequestsMock()
+    mock.setup({'value': []}, 200)
+    azure = create_azure_instance()
+    azure.setup()
+    azure.get_group_members(gid, '$select=id&$top=999&$skiptoken=ABC')
+    expected_url = ('https://graph.microsoft.com/v1.0/groups/xxxx/members/microsoft.graph.user' +
+                    '?$select=id&$top=999&$skiptoken=ABC')
+    mock.access('session.get').assert_called_with(expected_url, timeout=Azure.DEFAULT_TIMEOUT)
+    mock.restore()
+
+def test_set_member_attributes():
+    """
+    Should always include id and userPrincipalName
+    """
+    azure = create_azure_instance()
+    azure.set_member_attributes(['givenName', 'surname', 'mail'])
+    assert azure.member_query() == '?$select=id,userPrincipalName,givenName,surname,mail&$top=999'
+    azure.set_member_attributes(['userPrincipalName', 'mail', 'id'])
+    assert azure.member_query() == '?$select=userPrincipalName,mail,id&$top=999'
+
+def test_get_users_by_ids_with_member_attributes():
+    """
+    Should fetch only member attributes
+    """
+    azure = create_azure_instance()
+    azure.set_member_attributes(['mail'])
+    azure.session = MagicMock()
+    azure.session.post = MagicMock(return_value=MagicMock(
+        status_code=200, json=MagicMock(return_value={'value': [{'id': 'id1'}]})))
+    assert azure.get_users_by_ids(['id1']) == [{'id': 'id1'}]
+    azure.session.post.assert_called_with(
+        'https://graph.microsoft.com/v1.0/directoryObjects/getByIds?$select=id,userPrincipalName,mail',
+        json={'ids': ['id1'], 'types': ['user']}, timeout=Azure.DEFAULT_TIMEOUT)
+
+def test_iter_group_member_pages():
+    """
+    Should yield each page and fetch the next page while the current one is processed
+    """
+    next_link = 'https://graph.microsoft.com/v1.0/groups/gid/members/microsoft.graph.user?$skiptoken='
+    pages = [
+        {'value': [{'id': 1}, {'id': 2}], '@odata.nextLink': next_link + 'P2'},
+        {'value': [{'id': 3}], '@odata.nextLink': next_link + 'P3'},
+        {'value': [{'id': 4}]}
+    ]
+    azure = create_azure_instance()
+    azure.get_group_members = MagicMock(side_effect=pages)
+    itr = azure.iter_group_member_pages('gid')
+    assert next(itr) == [{'id': 1}, {'id': 2}]
+    # Waits for the prefetch of the second page
+    for _ in range(100):
+        if azure.get_group_members.call_count == 2:
+            break
+        time.sleep(0.01)
+    azure.get_group_members.assert_called_with('gid', '$skiptoken=P2')
+    assert list(itr) == [[{'id': 3}], [{'id': 4}]]
+    assert azure.get_group_members.call_count == 3
+
+def test_iter_group_members():
+    """
+    Should yield members across pages
+    """
+    azure = create_azure_instance()
+    azure.iter_group_member_pages = MagicMock(return_value=iter([[{'id': 1}, {'id': 2}], [{'id': 3}]]))
+    assert list(azure.iter_group_members('gid')) == [{'id': 1}, {'id': 2}, {'id': 3}]
+
+def create_batch_response(bodies, statuses=None):
+    """
+    Returns $batch Response that contains each body in order
+    """
+    if not statuses:
+        statuses = [200] * len(bodies)
+    res = Response()
+    res.status_code = 200
+    res.json = MagicMock(return_value={'responses': [
+        {'id': str(i), 'status': statuses[i], 'body': body} for i, body in enumerate(bodies)]})
+    return res
+
+def test_get_groups():
+    """
+    Should fetch groups with $batch requests of up to 20 groups
+    """
+    gids = [f'gid{i}' for i in range(25)]
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.post = MagicMock(side_effect=[
+        create_batch_response([{'id': gid, 'displayName': gid.upper()} for gid in gids[:20]]),
+        create_batch_response([{'id': gid, 'displayName': gid.upper()} for gid in gids[20:]])])
+    groups = azure.get_groups(gids)
+    assert list(groups.keys()) == gids
+    assert azure.session.post.call_count == 2
+    args = azure.session.post.call_args_list
+    assert args[0][0][0] == Azure.API_BATCH
+    assert len(args[0][1]['json']['requests']) == 20
+    assert args[1][1]['json']['requests'] == [
+        {'id': str(i), 'method': 'GET', 'url': '/groups/' + gid} for i, gid in enumerate(gids[20:])]
+    # Served from the cache
+    assert azure.get_group_name('gid3') == 'GID3'
+    assert azure.get_groups(gids[:5]) == {gid: groups[gid] for gid in gids[:5]}
+    assert azure.session.post.call_count == 2
+    azure.session.get.assert_not_called()
+
+def test_get_groups_with_failed_request():
+    """
+    Should leave out the group failed in the batch and fetch it one by one later
+    """
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.post = MagicMock(return_value=create_batch_response(
+        [{'id': 'gid1', 'displayName': 'GID1'}, {'error': {'code': 'TooManyRequests'}}], [200, 429]))
+    res = Response()
+    res.status_code = 200
+    res.json = MagicMock(return_value={'id': 'gid2', 'displayName': 'GID2'})
+    azure.session.get = MagicMock(return_value=res)
+    assert list(azure.get_groups(['gid1', 'gid2']).keys()) == ['gid1']
+    assert azure.get_group_name('gid2') == 'GID2'
+    azure.session.get.assert_called_once_with(azure.group_url('gid2'), timeout=Azure.DEFAULT_TIMEOUT)
+    assert azure.get_group_name('gid2') == 'GID2'
+    assert azure.session.get.call_count == 1
+
+def test_get_groups_with_unexpected_response():
+    """
+    Should raise an exception if the batch request fails
+    """
+    res = Response()
+    res.status_code = 500
+    res.json = MagicMock(return_value={})
+    azure = create_azure_instance()
+    azure.session = MagicMock()
+    azure.session.post = MagicMock(return_value=res)
+    with pytest.raises(AzureException):
+        azure.get_groups(['gid1'])
+
+def test_get_access_token():
+    """
+    Should return the access token refreshed if it expires soon
+    """
+    azure = create_azure_instance(token={'accessToken': 'OLD', 'expiresAt': time.time() + 60})
+    azure.get_token = MagicMock(return_value={'accessToken': 'NEW', 'expiresIn': '3599'})
+    assert azure.get_access_token() == 'NEW'
+    assert azure.get_access_token() == 'NEW'
+    azure.get_token.assert_called_once_with()
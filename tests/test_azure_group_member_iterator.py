@@ -84,3 +84,18 @@ def test_iterator_with_no_data():
     assert next(itr) is None
     assert next(itr) is None
     assert itr.get_total() == 0
+
+def test_iterator_with_sorted_stream():
+    """
+    Should take each page from the sorted stream until the end
+    """
+    members = [{'id': str(i), 'userPrincipalName': f'aaa{i}@test.com'} for i in range(1, 6)]
+    api = MagicMock()
+    api.iter_sorted_group_members = MagicMock(return_value=iter(members))
+    itr = AzureGroupMemberIterator(api, 'xxxxx', 1000)
+    itr.pagesize = 2
+    assert list(iter(lambda: next(itr), None)) == members
+    assert next(itr) is None
+    assert itr.get_total() == 5
+    api.iter_sorted_group_members.assert_called_once_with('xxxxx', 1000)
+    api.get_sorted_group_members.assert_not_called()
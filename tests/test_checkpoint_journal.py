@@ -0,0 +1,114 @@
+"""
+Tests CheckpointJournal
+"""
+import json
+import time
+import pytest
+from api.checkpoint_journal import CheckpointJournal
+from api.contact_records import AdContact
+from api.exceptions import CheckpointJournalException
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_resume_interrupted_run(tmp_path):
+    """
+    Should return the groups and the batches recorded before the run was interrupted
+    """
+    filename = str(tmp_path / 'journal')
+    journal = CheckpointJournal(filename).open()
+    journal.finish_group('gid1', 'GROUP1', {'inserted_contacts': 1})
+    journal.commit_batch(123, CheckpointJournal.REMOVE_MEMBERS, ['aaa', 'bbb'])
+    journal.commit_batch(123, CheckpointJournal.ADD_MEMBERS, ['aaa'])
+    journal.close()
+    journal = CheckpointJournal(filename).open()
+    assert journal.get_group_result('gid1') == ('GROUP1', {'inserted_contacts': 1})
+    assert journal.get_group_result('gid2') is None
+    assert journal.get_committed(123, CheckpointJournal.REMOVE_MEMBERS) == {'aaa', 'bbb'}
+    assert journal.get_committed(123, CheckpointJournal.ADD_MEMBERS) == {'aaa'}
+    assert journal.get_committed(456, CheckpointJournal.REMOVE_MEMBERS) == set()
+    journal.close()
+
+def test_commits_in_current_run_are_not_filtered(tmp_path):
+    """
+    Should keep returning only the batches committed before the run was resumed
+    """
+    journal = CheckpointJournal(str(tmp_path / 'journal')).open()
+    journal.commit_batch(123, CheckpointJournal.ADD_MEMBERS, ['aaa'])
+    assert journal.get_committed(123, CheckpointJournal.ADD_MEMBERS) == set()
+    journal.close()
+
+def test_finish_group_with_records(tmp_path):
+    """
+    Should record the result containing contact records as JSON
+    """
+    filename = str(tmp_path / 'journal')
+    journal = CheckpointJournal(filename).open()
+    journal.finish_group('gid1', 'GROUP1', {'errors': [AdContact({'id': 'x1'})]})
+    journal.close()
+    journal = CheckpointJournal(filename).open()
+    assert journal.get_group_result('gid1') == ('GROUP1', {'errors': [{'id': 'x1'}]})
+    journal.close()
+
+def test_finish_removes_journal(tmp_path):
+    """
+    Should start a new run after the last run finished
+    """
+    filename = tmp_path / 'journal'
+    journal = CheckpointJournal(str(filename)).open()
+    journal.finish_group('gid1', 'GROUP1', {})
+    journal.finish()
+    assert not filename.exists()
+    journal = CheckpointJournal(str(filename)).open()
+    assert journal.get_group_result('gid1') is None
+    journal.close()
+
+def test_discard_expired_journal(tmp_path):
+    """
+    Should start over if the interrupted run is older than max_age
+    """
+    filename = tmp_path / 'journal'
+    started = time.time() - 7200
+    filename.write_text(
+        json.dumps({'type': 'start', 'at': started}) + '\n' +
+        json.dumps({'type': 'group', 'group': 'gid1', 'name': 'GROUP1', 'result': {}}) + '\n')
+    journal = CheckpointJournal(str(filename), 3600).open()
+    assert journal.get_group_result('gid1') is None
+    assert journal.started_at > started
+    journal.close()
+    journal = CheckpointJournal(str(filename), 3600).open()
+    assert journal.get_group_result('gid1') is None
+    journal.close()
+
+def test_ignore_incomplete_line(tmp_path):
+    """
+    Should ignore the last line the process did not finish writing
+    """
+    filename = tmp_path / 'journal'
+    filename.write_text(
+        json.dumps({'type': 'start', 'at': time.time()}) + '\n' +
+        json.dumps({'type': 'batch', 'group': 123, 'op': 'add', 'ids': ['aaa']}) + '\n' +
+        '{"type": "batch", "group": 123, "op": "add", "ids": ["bb')
+    journal = CheckpointJournal(str(filename)).open()
+    assert journal.get_committed(123, CheckpointJournal.ADD_MEMBERS) == {'aaa'}
+    journal.close()
+
+def test_open_unwritable_journal(tmp_path):
+    """
+    Should raise CheckpointJournalException if the journal cannot be written
+    """
+    journal = CheckpointJournal(str(tmp_path / 'nodir' / 'journal'))
+    with pytest.raises(CheckpointJournalException):
+        journal.open()
+
+def test_resume_after_incomplete_line(tmp_path):
+    """
+    Should record the entries after the incomplete line on their own lines
+    """
+    filename = tmp_path / 'journal'
+    filename.write_text(json.dumps({'type': 'start', 'at': time.time()}) + '\n' + '{"type": "ba')
+    journal = CheckpointJournal(str(filename)).open()
+    journal.commit_batch(123, CheckpointJournal.ADD_MEMBERS, ['aaa'])
+    journal.close()
+    journal = CheckpointJournal(str(filename)).open()
+    assert journal.get_committed(123, CheckpointJournal.ADD_MEMBERS) == {'aaa'}
+    journal.close()
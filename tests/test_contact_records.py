@@ -0,0 +1,77 @@
+"""
+Tests contact records
+"""
+import json
+import tracemalloc
+import pytest
+from api.contact_records import AdContact, EverbridgeContact, ContactPath, to_json_data
+from api.contact_utils import convert_to_everbridge
+from tests.azure_helper import create_azure_contact, create_azure_contacts
+
+def test_record_as_dictionary():
+    """
+    Should get, set and delete known and unknown attributes like a dictionary
+    """
+    con = AdContact({'userPrincipalName': 'aaa@xxx.com', 'jobTitle': 'Manager'})
+    assert con['userPrincipalName'] == 'aaa@xxx.com'
+    assert con['jobTitle'] == 'Manager'
+    assert con.get('mail') is None
+    assert 'mail' not in con
+    con['mail'] = 'bbb@xxx.com'
+    assert len(con) == 3
+    assert con.pop('jobTitle') == 'Manager'
+    del con['mail']
+    with pytest.raises(KeyError):
+        del con['mail']
+    assert con == {'userPrincipalName': 'aaa@xxx.com'}
+    assert not hasattr(con, '__dict__')
+
+def test_record_constants():
+    """
+    Should have constant attributes without storing them unless they are changed
+    """
+    path = ContactPath({'pathId': 1, 'value': 'aaa@xxx.com', 'waitTime': 0, 'status': 'A'})
+    assert path._extra is None
+    assert path == {'pathId': 1, 'value': 'aaa@xxx.com', 'waitTime': 0, 'status': 'A', 'skipValidation': False}
+    # False is not the same as 0
+    path['waitTime'] = False
+    assert path['waitTime'] is False
+    path['waitTime'] = 0
+    assert path['waitTime'] == 0 and path['waitTime'] is not False
+    with pytest.raises(KeyError):
+        del path['status']
+
+def test_record_copy():
+    """
+    Should return a record with the same attributes
+    """
+    con = convert_to_everbridge(create_azure_contact(1), 1)
+    copied = con.copy()
+    copied['id'] = 2
+    assert isinstance(copied, EverbridgeContact)
+    assert con['id'] == 1
+    assert copied['paths'] == con['paths']
+
+def test_to_json_data():
+    """
+    Should replace records with dictionaries
+    """
+    con = convert_to_everbridge(create_azure_contact(1), 1)
+    data = to_json_data({'contacts': [con]})
+    assert isinstance(data['contacts'][0], dict)
+    assert isinstance(data['contacts'][0]['paths'][0], dict)
+    assert json.loads(json.dumps(data)) == {'contacts': [con]}
+
+def test_record_memory():
+    """
+    Should keep converted contacts in less memory than dictionaries
+    """
+    contacts = create_azure_contacts(range(1, 501))
+    tracemalloc.start()
+    records = [convert_to_everbridge(con) for con in contacts]
+    record_size = tracemalloc.get_traced_memory()[0]
+    dicts = [con.to_dict() for con in records]
+    dict_size = tracemalloc.get_traced_memory()[0] - record_size
+    tracemalloc.stop()
+    assert len(dicts) == len(records)
+    assert record_size < dict_size * 0.6
@@ -0,0 +1,76 @@
+"""
+Tests ContactRegistry
+"""
+import threading
+from unittest.mock import patch
+from api.contact_registry import ContactRegistry
+from azure_helper import create_azure_contact
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_validate():
+    """
+    Should validate each AD contact only once
+    """
+    registry = ContactRegistry()
+    with patch('api.contact_registry.contact_validator.validate_and_fix_azure_contact',
+               side_effect=lambda con: con) as validate:
+        first = registry.validate(create_azure_contact(1))
+        second = registry.validate(create_azure_contact(1))
+        registry.validate(create_azure_contact(2))
+    assert first is second
+    assert validate.call_count == 2
+
+def test_convert():
+    """
+    Should convert each AD contact only once and return a copy with the given id
+    """
+    registry = ContactRegistry()
+    contact = create_azure_contact(1)
+    with patch('api.contact_registry.contact_utils.convert_to_everbridge',
+               side_effect=lambda con: {'externalId': con['userPrincipalName'], 'errors': False}) as convert:
+        first = registry.convert(contact)
+        first.pop('errors')
+        second = registry.convert(contact, 123)
+    assert convert.call_count == 1
+    assert 'id' not in first
+    assert second == {'externalId': 'aaa.bbb0001@xxx.com', 'errors': False, 'id': 123}
+
+def test_everbridge_contact():
+    """
+    Should return Everbridge contact found in any group
+    """
+    registry = ContactRegistry()
+    registry.add_everbridge_contact({'externalId': 'aaa', 'id': 1})
+    assert registry.get_everbridge_contact('aaa') == {'externalId': 'aaa', 'id': 1}
+    assert registry.get_everbridge_contact('bbb') is None
+
+def test_claim_upserts():
+    """
+    Should let only the first caller upsert each contact
+    """
+    registry = ContactRegistry()
+    contacts = [{'externalId': 'aaa'}, {'externalId': 'bbb'}]
+    claimed, others = registry.claim_upserts(contacts)
+    assert claimed == contacts
+    assert others == []
+    claimed, others = registry.claim_upserts([{'externalId': 'bbb'}, {'externalId': 'ccc'}])
+    assert claimed == [{'externalId': 'ccc'}]
+    assert others == ['bbb']
+
+def test_wait_upserts():
+    """
+    Should wait until the other caller finishes and return failed externalIds
+    """
+    registry = ContactRegistry()
+    contacts = [{'externalId': 'aaa'}, {'externalId': 'bbb'}]
+    registry.claim_upserts(contacts)
+    _, others = registry.claim_upserts(contacts)
+    rslt = []
+    waiter = threading.Thread(target=lambda: rslt.append(registry.wait_upserts(others)))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()
+    registry.finish_upserts(contacts, {'bbb'})
+    waiter.join(1)
+    assert rslt == [['bbb']]
@@ -3,11 +3,11 @@ Test ContactTracker
 """
 from api.contact_tracker import ContactTracker
 
-def create_tracker():
+def create_tracker(keep_contacts=True):
     """
     Creates ContactTracker instacne with data
     """
-    tracker = ContactTracker()
+    tracker = ContactTracker(keep_contacts)
     tracker.push(ContactTracker.INSERT_CONTACT, {'externalId': 'aaa1@test.com'})
     tracker.push(ContactTracker.INSERT_CONTACT, {'externalId': 'aaa2@test.com'})
     tracker.push(ContactTracker.INSERT_CONTACT, {'externalId': 'aaa3@test.com'})
@@ -73,26 +73,6 @@ def test_get_upsert_contacts():
         {'externalId': 'aaa3@test.com'}]
     assert contacts == expected
 
-def test_get_inserted_contact_external_ids():
-    """
-    Should return ids of inserted contacts
-    """
-    tracker = create_tracker()
-    ids = tracker.get_inserted_contact_external_ids()
-    exp = [('&externalIds=aaa1@test.com' +
-            '&externalIds=aaa2@test.com' +
-            '&externalIds=aaa3@test.com')]
-    assert ids == exp
-    ids = tracker.get_inserted_contact_external_ids(1)
-    exp = ['&externalIds=aaa1@test.com',
-           '&externalIds=aaa2@test.com',
-           '&externalIds=aaa3@test.com']
-    assert ids == exp
-    ids = tracker.get_inserted_contact_external_ids(2)
-    exp = ['&externalIds=aaa1@test.com&externalIds=aaa2@test.com',
-           '&externalIds=aaa3@test.com']
-    assert ids == exp
-
 def test_get_remove_member_ids():
     """
     Should return contact ids for removing members
@@ -121,3 +101,39 @@ def test_report():
         'inserted_contacts': 3, 'removed_members': 3, 'updated_contacts': 3,
         'deleted_contacts': 0, 'added_members': 0, 'error_contacts': 0}
     assert rslt == exp
+
+def test_failed_contacts():
+    """
+    Should report failed contacts and skip them when looking up inserted contacts
+    """
+    tracker = create_tracker()
+    tracker.set_failed_contacts([{'externalId': 'aaa2@test.com'}])
+    assert tracker.get_inserted_external_id_list() == ['aaa1@test.com', 'aaa3@test.com']
+    assert tracker.report()['failed_contacts'] == 1
+
+def test_suppressed_updates():
+    """
+    Should report suppressed updates only if counted
+    """
+    tracker = create_tracker()
+    assert 'suppressed_updates' not in tracker.report()
+    tracker.count_suppressed_update()
+    tracker.count_suppressed_update()
+    assert tracker.report()['suppressed_updates'] == 2
+
+def test_counting_tracker():
+    """
+    Should count contacts without keeping them and report the same as keeping them
+    """
+    trackers = [create_tracker(), create_tracker(False)]
+    for tracker in trackers:
+        tracker.push(ContactTracker.INSERT_CONTACT, {'externalId': 'aaa4@test.com', 'errors': ['Invalid']})
+        tracker.add_failed_contacts([{'externalId': 'aaa2@test.com'}])
+        tracker.add_new_members(['aaa1@test.com', 'aaa3@test.com'])
+        tracker.add_deleted_contacts([5])
+    assert trackers[1].new_contacts == []
+    assert trackers[1].obsolete_members == []
+    assert trackers[0].report() == trackers[1].report()
+    assert trackers[1].report() == {
+        'inserted_contacts': 3, 'removed_members': 3, 'updated_contacts': 3, 'deleted_contacts': 1,
+        'added_members': 2, 'error_contacts': 1, 'failed_contacts': 1}
@@ -10,6 +10,10 @@ from api.contact_utils import create_mobile_phone_path
 from api.contact_utils import create_sms_path
 from api.contact_utils import extract_attributes_for_comparison
 from api.contact_utils import is_different
+from api.contact_utils import is_literally_different
+from api.contact_utils import fingerprint
+from api.contact_utils import merge_key
+from api.contact_utils import normalize_path_value
 # pylint: disable=unused-import
 import tests.log_helper
 
@@ -259,3 +263,80 @@ def test_is_different():
     con2['paths'][1]['value'] = '8089999999'
     assert is_different(con1, contact) is False
     assert is_different(con2, contact) is True
+
+def test_normalize_path_value():
+    """
+    Should return emails in lowercase and phone numbers in digits
+    """
+    assert normalize_path_value(' AAA.BBB@Hawaii.gov ') == 'aaa.bbb@hawaii.gov'
+    assert normalize_path_value('(808) 111-2222') == '8081112222'
+    assert normalize_path_value('+1 808 111 2222') == '8081112222'
+    assert normalize_path_value(None) == ''
+
+def test_fingerprint():
+    """
+    Should return the same hash regardless of path order, phone format and server attributes
+    """
+    contact = {
+        'externalId': 'AAA.BBB@hawaii.gov',
+        'firstName': 'AAA',
+        'lastName': 'BBB',
+        'recordTypeId': 892807736729062,
+        'paths': [
+            {'waitTime': 0, 'status': 'A', 'pathId': 241901148045316, 'value': 'AAA.BBB@hawaii.gov'},
+            {'waitTime': 0, 'status': 'A', 'pathId': 241901148045321, 'value': '8081112222', 'phoneExt': '999'},
+            {'waitTime': 0, 'status': 'A', 'pathId': 241901148045319, 'value': '8081114444'}
+        ]}
+    from_server = copy.deepcopy(contact)
+    from_server['id'] = 12345
+    from_server['createdDate'] = 1568246400000
+    from_server['paths'].reverse()
+    from_server['paths'][0]['value'] = '808-111-4444'
+    for path in from_server['paths']:
+        path['id'] = 999
+        path['priority'] = 1
+    assert fingerprint(contact) == fingerprint(from_server)
+    changed = copy.deepcopy(contact)
+    changed['paths'][1]['phoneExt'] = '888'
+    assert fingerprint(contact) != fingerprint(changed)
+    changed = copy.deepcopy(contact)
+    changed['lastName'] = 'CCC'
+    assert fingerprint(contact) != fingerprint(changed)
+
+def test_is_different_with_stored_fingerprint():
+    """
+    Should compare the fingerprint stored with Everbridge Contact
+    """
+    contact = {'externalId': 'AAA.BBB@hawaii.gov', 'firstName': 'AAA', 'lastName': 'BBB', 'paths': []}
+    stored = {'externalId': 'AAA.BBB@hawaii.gov', 'fingerprint': fingerprint(contact)}
+    assert is_different(contact, stored) is False
+    stored['fingerprint'] = 'XXX'
+    assert is_different(contact, stored) is True
+
+def test_is_different_with_server_paths():
+    """
+    Should return False if paths differ only in order, format and server attributes
+    """
+    contact = convert_to_everbridge({
+        'givenName': 'AAA', 'surname': 'BBB', 'userPrincipalName': 'AAA.BBB@hawaii.gov',
+        'mail': 'AAA.BBB@hawaii.gov', 'businessPhones': ['8081112222x999'], 'mobilePhone': '8081114444'}, 12345)
+    contact.pop('errors')
+    from_server = copy.deepcopy(contact)
+    from_server['paths'].reverse()
+    for seq, path in enumerate(from_server['paths']):
+        path['id'] = seq
+        path['priority'] = seq
+    from_server['paths'][0]['value'] = '808-111-4444'
+    assert is_literally_different(contact, from_server) is True
+    assert is_different(contact, from_server) is False
+    from_server['paths'][2]['phoneExt'] = '888'
+    assert is_different(contact, from_server) is True
+
+def test_merge_key():
+    """
+    Should order externalIds regardless of the case
+    """
+    assert merge_key('AAA.BBB@hawaii.gov') == merge_key('aaa.bbb@hawaii.gov')
+    assert sorted(['bbb@hawaii.gov', 'AAB@hawaii.gov', 'aaa@hawaii.gov'], key=merge_key) == \
+        ['aaa@hawaii.gov', 'AAB@hawaii.gov', 'bbb@hawaii.gov']
+    assert merge_key(None) == ''
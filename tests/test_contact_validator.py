@@ -479,7 +479,7 @@ def test_validate_and_fix_azure_contact():
     con = {'userPrincipalName': 'abc.def@test.com',
            'businessPhones': ['+1(808)1234567', '567-9999', '1234444 x 888'],
            'mobilePhone': '+1 (808) 123 - 4567 x 9999'}
-    validate_and_fix_azure_contact(con)
+    con = validate_and_fix_azure_contact(con)
     assert con['userPrincipalName'] == 'abc.def@test.com'
     assert con['givenName'] == 'abc'
     assert con['surname'] == 'def'
@@ -496,7 +496,7 @@ def test_validate_and_fix_azure_contact_without_fix():
            'givenName': 'abc', 'surname': 'def',
            'businessPhones': ['8081234567', '8085679999', '8081234444x888'],
            'mobilePhone': '8081234567x9999'}
-    validate_and_fix_azure_contact(con)
+    con = validate_and_fix_azure_contact(con)
     assert con['userPrincipalName'] == 'abc.def@test.com'
     assert con['givenName'] == 'abc'
     assert con['surname'] == 'def'
@@ -512,7 +512,7 @@ def test_validate_and_fix_azure_contact_with_errors():
     con = {'userPrincipalName': 'abcdef@test..com',
            'businessPhones': ['+1(808)1234567', '567-9999', '1234444 x 888'],
            'mobilePhone': '+1 (808) 123 - 4567 x 9999'}
-    validate_and_fix_azure_contact(con)
+    con = validate_and_fix_azure_contact(con)
     assert con['userPrincipalName'] == 'abcdef@test..com'
     assert con['businessPhones'] == ['8081234567', '8085679999', '8081234444x888']
     assert con['mobilePhone'] == '8081234567x9999'
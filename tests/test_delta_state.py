@@ -0,0 +1,111 @@
+"""
+Tests DeltaState
+"""
+import time
+import pytest
+from api.delta_state import DeltaState
+from api.exceptions import AzureException
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_load_without_file(tmp_path):
+    """
+    Should start with an empty state if the file does not exist
+    """
+    state = DeltaState(str(tmp_path / 'delta.json')).load()
+    assert state.get_delta_link('gid') is None
+    assert state.get_members('gid') == {}
+
+def test_save_and_load(tmp_path):
+    """
+    Should restore the saved state
+    """
+    filename = str(tmp_path / 'delta.json')
+    state = DeltaState(filename)
+    state.set_full_sync('gid', 'https://delta/link1', {'id1': 'aaa@xxx.com'})
+    state.save()
+    loaded = DeltaState(filename).load()
+    assert loaded.get_delta_link('gid') == 'https://delta/link1'
+    assert loaded.get_members('gid') == {'id1': 'aaa@xxx.com'}
+
+def test_load_with_invalid_file(tmp_path):
+    """
+    Should raise Exception
+    """
+    filename = tmp_path / 'delta.json'
+    filename.write_text('INVALID')
+    with pytest.raises(AzureException):
+        DeltaState(str(filename)).load()
+
+def test_set_delta_sync():
+    """
+    Should update deltaLink and members but keep the time of the last full sync
+    """
+    state = DeltaState('delta.json')
+    state.set_full_sync('gid', 'link1', {'id1': 'aaa@xxx.com'})
+    full_sync_at = state.groups['gid']['fullSyncAt']
+    state.set_delta_sync('gid', 'link2', {'id2': 'bbb@xxx.com'})
+    assert state.get_delta_link('gid') == 'link2'
+    assert state.get_members('gid') == {'id2': 'bbb@xxx.com'}
+    assert state.groups['gid']['fullSyncAt'] == full_sync_at
+
+def test_get_delta_link_after_interval():
+    """
+    Should return None to force a full sync when the last full sync is too old
+    """
+    state = DeltaState('delta.json', 60)
+    state.set_full_sync('gid', 'link1', {})
+    assert state.get_delta_link('gid') == 'link1'
+    state.groups['gid']['fullSyncAt'] = time.time() - 61
+    assert state.get_delta_link('gid') is None
+
+def test_reset():
+    """
+    Should forget the group
+    """
+    state = DeltaState('delta.json')
+    state.set_full_sync('gid', 'link1', {'id1': 'aaa@xxx.com'})
+    state.reset('gid')
+    assert state.get_delta_link('gid') is None
+    assert state.get_members('gid') == {}
+
+def test_save_writes_changed_groups(tmp_path):
+    """
+    Should write only the groups changed since the last save
+    """
+    filename = str(tmp_path / 'delta.db')
+    state = DeltaState(filename).load()
+    state.set_full_sync('gid1', 'link1', {'id1': 'aaa@xxx.com'})
+    state.set_full_sync('gid2', 'link2', {'id2': 'bbb@xxx.com'})
+    state.save()
+    state.groups['gid1']['deltaLink'] = 'unsaved'
+    state.set_delta_sync('gid2', 'link3', {'id3': 'ccc@xxx.com'})
+    state.save()
+    loaded = DeltaState(filename).load()
+    assert loaded.get_delta_link('gid1') == 'link1'
+    assert loaded.get_delta_link('gid2') == 'link3'
+    assert loaded.get_members('gid2') == {'id3': 'ccc@xxx.com'}
+
+def test_save_reset_group(tmp_path):
+    """
+    Should remove the group reset since the last save
+    """
+    filename = str(tmp_path / 'delta.db')
+    state = DeltaState(filename).load()
+    state.set_full_sync('gid', 'link1', {'id1': 'aaa@xxx.com'})
+    state.save()
+    state.reset('gid')
+    state.save()
+    assert DeltaState(filename).load().get_delta_link('gid') is None
+
+def test_load_legacy_json_file(tmp_path):
+    """
+    Should convert the JSON state file of earlier versions
+    """
+    filename = tmp_path / 'delta.json'
+    filename.write_text(
+        '{"gid": {"deltaLink": "link1", "fullSyncAt": %f, "members": {"id1": "aaa@xxx.com"}}}' % time.time())
+    DeltaState(str(filename)).load().close()
+    loaded = DeltaState(str(filename)).load()
+    assert loaded.get_delta_link('gid') == 'link1'
+    assert loaded.get_members('gid') == {'id1': 'aaa@xxx.com'}
@@ -2,9 +2,17 @@
 Tests Everbridge API Functions
 """
 import json
-from unittest.mock import patch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
 import pytest
+import requests
+from api.contact_utils import convert_to_everbridge
+from api import everbridge
+from api.everbridge import Everbridge, GroupDirectory
 from api.exceptions import EverbridgeException
+from tests.azure_helper import create_azure_contact
 from tests.everbridge_helper import create_everbridge_contacts, \
                                     create_everbridge_instance, \
                                     create_session_mock, \
@@ -67,7 +75,7 @@ def test_get_contacts_by_external_ids(mock_session):
     # call get_contacts_by_external_ids
     rslt = ever.get_contacts_by_external_ids(extids)
     # Check if correct arguments are passed to session functions
-    session.get.assert_called_with(expected_url)
+    session.get.assert_called_with(expected_url, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
     assert rslt == data
 
@@ -111,7 +119,7 @@ def test_upsert_contacts(mock_session):
     # call upsert_contacts
     ever.upsert_contacts(contacts)
     # Check if correct arguments are passed to session functions
-    session.post.assert_called_with(expected_url, json=contacts)
+    session.post.assert_called_with(expected_url, json=contacts, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_upsert_contacts_with_no_contacts():
@@ -154,7 +162,7 @@ def test_delete_contacts(mock_session):
     # call delete_contacts
     ever.delete_contacts(contacts)
     # Check if correct arguments are passed to session functions
-    session.delete.assert_called_with(expected_url, json=contacts)
+    session.delete.assert_called_with(expected_url, json=contacts, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_delete_contacts_with_no_contacts():
@@ -196,7 +204,7 @@ def test_get_group_by_name(mock_session):
     # call get_group_by_name
     ever.get_group_by_name('xxxxx')
     # Check if correct arguments are passed to session functions
-    session.get.assert_called_with(expected_url)
+    session.get.assert_called_with(expected_url, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_get_group_by_name_without_name():
@@ -239,7 +247,7 @@ def test_get_group_id_by_name(mock_session):
     # call get_group_by_name
     ever.get_group_id_by_name('xxxxx')
     # Check if correct arguments are passed to session functions
-    session.get.assert_called_with(expected_url)
+    session.get.assert_called_with(expected_url, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_get_group_id_by_name_with_no_group_id():
@@ -281,7 +289,7 @@ def test_paged_group_members(mock_session):
     # call get_group_by_name
     ever.get_paged_group_members(123)
     # Check if correct arguments are passed to session functions
-    session.get.assert_called_with(expected_url)
+    session.get.assert_called_with(expected_url, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_paged_group_members_with_no_group_id():
@@ -323,7 +331,7 @@ def test_delete_members_from_group(mock_session):
     # call delete_members_from_group
     ever.delete_members_from_group(123, members)
     # Check if correct arguments are passed to session functions
-    session.delete.assert_called_with(expected_url, json=members)
+    session.delete.assert_called_with(expected_url, json=members, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_delete_members_from_group_with_no_group_id():
@@ -374,7 +382,7 @@ def test_add_members_to_group(mock_session):
     # call add_members_to_group
     ever.add_members_to_group(123, members)
     # Check if correct arguments are passed to session functions
-    session.post.assert_called_with(expected_url, json=members)
+    session.post.assert_called_with(expected_url, json=members, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_add_members_to_group_with_no_group_id():
@@ -425,7 +433,7 @@ def test_add_group(mock_session):
     # call add_group
     ever.add_group('xxxxx')
     # Check if correct arguments are passed to session functions
-    session.post.assert_called_with(expected_url, json=data)
+    session.post.assert_called_with(expected_url, json=data, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_add_group_without_name():
@@ -468,7 +476,7 @@ def test_delete_group(mock_session):
     # call delete_group
     ever.delete_group(123)
     # Check if correct arguments are passed to session functions
-    session.delete.assert_called_with(expected_url)
+    session.delete.assert_called_with(expected_url, timeout=Everbridge.DEFAULT_TIMEOUT)
     session.headers.update.assert_called_with(expected_header())
 
 def test_delete_group_with_no_group_id():
@@ -493,3 +501,298 @@ def test_delete_group_with_unexpected_response(mock_session):
     # call upsert_contacts
     with pytest.raises(EverbridgeException):
         ever.delete_group(123)
+
+def test_max_concurrency():
+    """
+    Should not send more requests at the same time than the limit
+    """
+    lock = threading.Lock()
+    status = {'active': 0, 'max': 0}
+    def slow_get(url, timeout):
+        # pylint: disable=unused-argument
+        with lock:
+            status['active'] += 1
+            status['max'] = max(status['max'], status['active'])
+        time.sleep(0.02)
+        with lock:
+            status['active'] -= 1
+        res = MagicMock()
+        res.json = MagicMock(return_value={'page': {'data': []}})
+        return res
+    ever = create_everbridge_instance()
+    ever.session = MagicMock()
+    ever.session.get = MagicMock(side_effect=slow_get)
+    ever.set_max_concurrency(2)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda page: ever.get_paged_group_members(123, page), range(1, 7)))
+    assert ever.session.get.call_count == 6
+    assert status['max'] == 2
+
+def test_get_group_members_page():
+    """
+    Should return the page object
+    """
+    raw = {'message': 'OK', 'page': {'pageSize': 100, 'totalCount': 250, 'totalPageCount': 3, 'data': []}}
+    expected = json.loads(json.dumps(raw))
+    session = create_session_mock(expected, code=200, method='GET')
+    ever = create_everbridge_instance()
+    ever.session = session
+    rslt = ever.get_group_members_page(123, 2)
+    params = '?groupIds=123&pageSize=100&pageNumber=2&sortBy=externalId&direction=ASC'
+    session.get.assert_called_with(ever.contacts_url(params), timeout=Everbridge.DEFAULT_TIMEOUT)
+    assert rslt == expected['page']
+
+def test_upsert_contacts_in_chunks():
+    """
+    Should split contacts into chunks and send each chunk once
+    """
+    contacts = [{'externalId': f'aaa{i}@xxx.com'} for i in range(2500)]
+    ever = create_everbridge_instance()
+    ever._post = MagicMock(return_value={'code': 100, 'message': 'OK'})
+    rslt = ever.upsert_contacts(contacts)
+    assert ever._post.call_count == 3
+    sent = sorted((call[1]['data'] for call in ever._post.call_args_list), key=len)
+    assert [len(chunk) for chunk in sent] == [500, 1000, 1000]
+    assert sorted(con['externalId'] for chunk in sent for con in chunk) == \
+        sorted(con['externalId'] for con in contacts)
+    assert len(rslt['results']) == 3
+    assert rslt['failed_contacts'] == []
+
+def test_upsert_contacts_retries_failed_chunk():
+    """
+    Should retry only the failed chunk and report contacts that still fail
+    """
+    contacts = [{'externalId': f'aaa{i}@xxx.com'} for i in range(2100)]
+    attempts = {}
+    lock = threading.Lock()
+    def post(url, data):
+        # pylint: disable=unused-argument
+        key = data[0]['externalId']
+        with lock:
+            attempts[key] = attempts.get(key, 0) + 1
+        if key == 'aaa1000@xxx.com':
+            return {'status': 500, 'message': 'Internal Error'}
+        if key == 'aaa2000@xxx.com' and attempts[key] == 1:
+            return {'status': 500, 'message': 'Internal Error'}
+        return {'code': 100, 'message': 'OK'}
+    ever = create_everbridge_instance()
+    ever.rate_control.set_backoff(0)
+    ever._post = MagicMock(side_effect=post)
+    rslt = ever.upsert_contacts(contacts)
+    assert attempts == {'aaa0@xxx.com': 1, 'aaa1000@xxx.com': 3, 'aaa2000@xxx.com': 2}
+    assert len(rslt['results']) == 2
+    assert rslt['failed_contacts'] == contacts[1000:2000]
+
+def test_upsert_contacts_with_all_chunks_failed():
+    """
+    Should raise Exception if no chunk succeeds
+    """
+    ever = create_everbridge_instance()
+    ever.rate_control.set_backoff(0)
+    ever._post = MagicMock(return_value={'status': 500})
+    with pytest.raises(EverbridgeException):
+        ever.upsert_contacts([{'externalId': 'aaa@xxx.com'}])
+    assert ever._post.call_count == 3
+
+def test_upsert_contacts_does_not_retry_rejected_chunk():
+    """
+    Should not retry the chunk rejected without 5xx status
+    """
+    ever = create_everbridge_instance()
+    ever._post = MagicMock(return_value={'status': 400, 'message': 'Invalid Contact'})
+    with pytest.raises(EverbridgeException):
+        ever.upsert_contacts([{'externalId': 'aaa@xxx.com'}])
+    assert ever._post.call_count == 1
+
+def test_upsert_contacts_retries_connection_error():
+    """
+    Should retry the chunk that failed to connect
+    """
+    ever = create_everbridge_instance()
+    ever.rate_control.set_backoff(0)
+    ever.session = MagicMock()
+    ever.session.post = MagicMock(side_effect=[
+        requests.exceptions.ConnectionError('Connection Reset'),
+        MagicMock(status_code=200, json=MagicMock(return_value={'code': 100, 'message': 'OK'}))])
+    rslt = ever.upsert_contacts([{'externalId': 'aaa@xxx.com'}])
+    assert rslt['failed_contacts'] == []
+    assert ever.session.post.call_count == 2
+
+def test_add_members_to_group_by_external_id():
+    """
+    Should send POST request with idType=externalId
+    """
+    members = ['aaa@xxx.com', 'bbb@xxx.com']
+    session = create_session_mock({'message': 'OK', 'code': 100}, code=200, method='POST')
+    ever = create_everbridge_instance()
+    ever.session = session
+    ever.add_members_to_group(123, members, 'externalId')
+    expected_url = ever.groups_url('contacts?byType=id&groupId=123&idType=externalId')
+    session.post.assert_called_with(expected_url, json=members, timeout=Everbridge.DEFAULT_TIMEOUT)
+
+def test_get_contacts_by_external_id_list():
+    """
+    Should look up contacts per 100 externalIds concurrently and keep the order
+    """
+    external_ids = [f'aaa{i:03}@xxx.com' for i in range(250)]
+    def get_contacts(ids):
+        return [{'externalId': exid} for exid in ids.split('&externalIds=')[1:]]
+    ever = create_everbridge_instance()
+    ever.get_contacts_by_external_ids = MagicMock(side_effect=get_contacts)
+    rslt = ever.get_contacts_by_external_id_list(external_ids)
+    assert ever.get_contacts_by_external_ids.call_count == 3
+    assert [con['externalId'] for con in rslt] == external_ids
+
+def test_get_all_groups():
+    """
+    Should list groups across pages
+    """
+    ever = create_everbridge_instance()
+    ever._get = MagicMock(side_effect=[
+        {'page': {'totalPageCount': 2, 'data': [{'id': 1, 'name': 'G1'}, {'id': 2, 'name': 'G2'}]}},
+        {'page': {'totalPageCount': 2, 'data': [{'id': 3, 'name': 'G3'}]}}])
+    groups = ever.get_all_groups()
+    assert [group['id'] for group in groups] == [1, 2, 3]
+    ever._get.assert_called_with(ever.groups_url('?pageSize=100&pageNumber=2'))
+
+def test_get_group_id_by_name_with_group_directory():
+    """
+    Should serve group ids from the directory filled once
+    """
+    ever = create_everbridge_instance()
+    ever.set_group_directory(GroupDirectory())
+    ever.get_all_groups = MagicMock(return_value=[{'id': 1, 'name': 'G1'}, {'id': 2, 'name': 'G2'}])
+    ever.get_group_by_name = MagicMock(return_value={'id': 3})
+    assert ever.get_group_id_by_name('G1') == 1
+    assert ever.get_group_id_by_name('G2') == 2
+    ever.get_all_groups.assert_called_once()
+    ever.get_group_by_name.assert_not_called()
+    # Falls back to the query by name if not found in the directory
+    assert ever.get_group_id_by_name('G3') == 3
+    assert ever.get_group_id_by_name('G3') == 3
+    ever.get_group_by_name.assert_called_once_with('G3')
+
+def test_group_directory_updated_on_add_and_delete():
+    """
+    Should add the created group and remove the deleted group
+    """
+    ever = create_everbridge_instance()
+    ever.set_group_directory(GroupDirectory())
+    ever.get_all_groups = MagicMock(return_value=[{'id': 1, 'name': 'G1'}])
+    ever.load_group_directory()
+    ever._post = MagicMock(return_value={'message': 'OK', 'id': 5})
+    ever._delete = MagicMock(return_value={'message': 'OK'})
+    ever.add_group('G5')
+    assert ever.group_directory.get('G5') == 5
+    ever.delete_group(1)
+    assert ever.group_directory.get('G1') is None
+    assert ever.group_directory.groups == {'G5': 5}
+
+def test_group_directory_file(tmp_path):
+    """
+    Should reuse the saved groups until the TTL passes
+    """
+    filename = str(tmp_path / 'groups.json')
+    directory = GroupDirectory(filename)
+    directory.fill([{'id': 1, 'name': 'G1'}])
+    directory.add('G2', 2)
+    loaded = GroupDirectory(filename)
+    assert loaded.load()
+    assert loaded.is_loaded()
+    assert loaded.groups == {'G1': 1, 'G2': 2}
+    expired = GroupDirectory(filename, 1)
+    with open(filename) as stream:
+        data = json.load(stream)
+    data['loadedAt'] -= 10
+    with open(filename, 'w') as stream:
+        json.dump(data, stream)
+    assert not expired.load()
+    assert not expired.is_loaded()
+
+def test_get_contacts_page():
+    """
+    Should return a page of org contacts
+    """
+    ever = create_everbridge_instance()
+    ever._get = MagicMock(return_value={'page': {'totalPageCount': 1, 'data': [{'id': 1}]}})
+    assert ever.get_contacts_page(2) == {'totalPageCount': 1, 'data': [{'id': 1}]}
+    ever._get.assert_called_with(
+        ever.contacts_url('?pageSize=100&pageNumber=2&sortBy=externalId&direction=ASC'))
+    ever._get = MagicMock(return_value={'message': 'Error'})
+    with pytest.raises(EverbridgeException):
+        ever.get_contacts_page(1)
+
+def test_get_contact_count():
+    """
+    Should return the number of contacts in the org or the group
+    """
+    ever = create_everbridge_instance()
+    ever._get = MagicMock(return_value={'page': {'totalCount': 25, 'data': [{'id': 1}]}})
+    assert ever.get_contact_count() == 25
+    ever._get.assert_called_with(ever.contacts_url('?pageSize=1&pageNumber=1'))
+    assert ever.get_contact_count(123) == 25
+    ever._get.assert_called_with(ever.contacts_url('?pageSize=1&pageNumber=1&groupIds=123'))
+
+def test_upsert_contacts_with_records():
+    """
+    Should send contact records as dictionaries
+    """
+    ever = create_everbridge_instance()
+    ever.session = MagicMock()
+    ever.session.post.return_value.json.return_value = {'code': 100, 'message': 'OK'}
+    contacts = [convert_to_everbridge(create_azure_contact(1), 1)]
+    ever.upsert_contacts(contacts)
+    sent = ever.session.post.call_args[1]['json']
+    assert sent == contacts
+    assert isinstance(sent[0], dict)
+    assert isinstance(sent[0]['paths'][0], dict)
+    json.dumps(sent)
+
+def test_get_retries_throttled_request(monkeypatch):
+    """
+    Should retry the request throttled with HTTP 503 and count it
+    """
+    monkeypatch.setattr('api.rate_control.time.sleep', lambda sec: None)
+    ever = create_everbridge_instance()
+    ever.session = MagicMock()
+    ever.session.get = MagicMock(side_effect=[
+        MagicMock(status_code=503, headers={}),
+        MagicMock(status_code=200, json=MagicMock(return_value={'page': {'totalCount': 3}}))])
+    assert ever.get_contact_count() == 3
+    assert ever.session.get.call_count == 2
+    report = ever.get_rate_report()
+    assert report['throttled'] == 1
+    assert report['limits'] == {'contacts': 2}
+
+def test_set_timeout():
+    """
+    Should send requests with the connect and read timeouts
+    """
+    ever = create_everbridge_instance()
+    ever.session = MagicMock()
+    ever.session.get.return_value.json.return_value = {'page': {'totalCount': 3}}
+    ever.set_timeout(5, 30)
+    ever.get_contact_count()
+    assert ever.session.get.call_args[1]['timeout'] == (5, 30)
+    ever.set_timeout(7)
+    ever.get_contact_count()
+    assert ever.session.get.call_args[1]['timeout'] == (7, 60)
+    ever.set_timeout(read=30)
+    ever.get_contact_count()
+    assert ever.session.get.call_args[1]['timeout'] == (10, 30)
+
+def test_merge_upsert_results():
+    """
+    Should merge the results of the chunks shared by Everbridge and AsyncEverbridge
+    """
+    contacts = create_everbridge_contacts([1, 2, 3], False)
+    chunks = [contacts[:2], contacts[2:]]
+    rslt = everbridge.merge_upsert_results('EVERBRIDGE.UPSERT_CONTACTS', contacts, chunks,
+                                           [[{'code': 100}, None], [None, EverbridgeException()]])
+    assert rslt['results'] == [{'code': 100}]
+    assert rslt['failed_contacts'] == contacts[2:]
+    with pytest.raises(EverbridgeException):
+        everbridge.merge_upsert_results('EVERBRIDGE.UPSERT_CONTACTS', contacts, chunks,
+                                        [[None, EverbridgeException()], [None, EverbridgeException()]])
+    assert everbridge.external_id_filters(['aaa', 'bbb', 'ccc'], 2) == \
+        ['&externalIds=aaa&externalIds=bbb', '&externalIds=ccc']
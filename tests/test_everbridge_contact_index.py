@@ -0,0 +1,71 @@
+"""
+Tests EverbridgeContactIndex
+"""
+from unittest.mock import MagicMock
+from api.everbridge_contact_index import EverbridgeContactIndex
+from everbridge_helper import create_everbridge_contacts, modify_everbridge_data
+# pylint: disable=unused-import
+import tests.log_helper
+
+def create_api(pages):
+    """
+    Returns Everbridge API mock that returns the pages of org contacts
+    """
+    api = MagicMock()
+    api.get_contacts_page = MagicMock(side_effect=lambda page: {
+        'totalPageCount': len(pages), 'data': pages[page - 1]})
+    return api
+
+def create_pages():
+    """
+    Returns two pages of contacts in groups 1 and 2
+    """
+    pages = [create_everbridge_contacts([1, 2, 3], True), create_everbridge_contacts([4, 5], True)]
+    modify_everbridge_data(pages[0], [1, 2], 'groups', [1])
+    modify_everbridge_data(pages[0], [3], 'groups', [1, 2])
+    modify_everbridge_data(pages[1], [4], 'groups', [2])
+    return pages
+
+def test_load():
+    """
+    Should index contacts by externalId and group members from every page
+    """
+    api = create_api(create_pages())
+    index = EverbridgeContactIndex(api).load()
+    assert api.get_contacts_page.call_count == 2
+    assert len(index.contacts) == 5
+    assert [con['id'] for con in index.get_group_members(1)] == [1, 2, 3]
+    assert [con['id'] for con in index.get_group_members(2)] == [3, 4]
+    assert index.get_group_members(3) == []
+
+def test_add_group_members():
+    """
+    Should add the members and the group to the contacts in the index
+    """
+    index = EverbridgeContactIndex(create_api(create_pages())).load()
+    index.add_group_members(2, [index.contacts['aaa.bbb0001@xxx.com'], {'externalId': 'unknown@xxx.com'}])
+    assert [con['id'] for con in index.get_group_members(2)] == [1, 3, 4]
+    assert index.contacts['aaa.bbb0001@xxx.com']['groups'] == [1, 2]
+    index.add_group_members(2, [index.contacts['aaa.bbb0001@xxx.com']])
+    assert [con['id'] for con in index.get_group_members(2)] == [1, 3, 4]
+
+def test_remove_group_members():
+    """
+    Should remove the members and the group from the contacts
+    """
+    index = EverbridgeContactIndex(create_api(create_pages())).load()
+    index.remove_group_members(1, [index.contacts['aaa.bbb0003@xxx.com']])
+    assert [con['id'] for con in index.get_group_members(1)] == [1, 2]
+    assert index.contacts['aaa.bbb0003@xxx.com']['groups'] == [2]
+
+def test_should_use():
+    """
+    Should return True if the groups have as many members as ratio times the org contacts
+    """
+    api = MagicMock()
+    counts = {None: 100, 1: 60, 2: 50}
+    api.get_contact_count = MagicMock(side_effect=lambda gid=None: counts[gid])
+    assert EverbridgeContactIndex.should_use(api, [1, 2])
+    assert not EverbridgeContactIndex.should_use(api, [1])
+    assert EverbridgeContactIndex.should_use(api, [1], 0.5)
+    assert not EverbridgeContactIndex.should_use(api, [None])
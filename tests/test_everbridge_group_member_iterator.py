@@ -2,6 +2,7 @@
 Tests EverbridgeGroupMemberIterator class
 """
 import json
+import time
 from unittest.mock import MagicMock
 from api.everbridge_group_member_iterator import EverbridgeGroupMemberIterator
 # pylint: disable=unused-import
@@ -14,7 +15,7 @@ def create_iterator(rtnvals):
     gid = 'xxxxx'
     api = MagicMock()
     api.set_pagesize = MagicMock()
-    api.get_paged_group_members = MagicMock(side_effect=rtnvals)
+    api.get_group_members_page = MagicMock(side_effect=[{'data': page} for page in rtnvals])
     itr = EverbridgeGroupMemberIterator(api, gid)
     return itr
 
@@ -57,3 +58,78 @@ def test_iterator_with_no_data():
     assert next(itr) is None
     assert next(itr) is None
     assert itr.get_total() == 0
+
+def create_paged_api(pages, delay=0):
+    """
+    Creates api mock that returns pages with totalPageCount
+    """
+    api = MagicMock()
+    def get_page(group_id, page):
+        # pylint: disable=unused-argument
+        if page > 1:
+            # Later pages come back in reverse order
+            time.sleep(delay * (len(pages) - page))
+        return {'totalPageCount': len(pages), 'data': pages[page - 1]}
+    api.get_group_members_page = MagicMock(side_effect=get_page)
+    return api
+
+def test_iterator_with_prefetch():
+    """
+    Should return members in page order while fetching pages concurrently
+    """
+    pages = [[{'id': str(i), 'externalId': f'aaa{i:02}@test.com'} for i in range(p * 2, p * 2 + 2)]
+             for p in range(6)]
+    api = create_paged_api(pages, 0.01)
+    itr = EverbridgeGroupMemberIterator(api, 'xxxxx', read_ahead=3)
+    itr.set_pagesize(2)
+    members = []
+    con = next(itr)
+    while con:
+        members.append(con)
+        con = next(itr)
+    assert members == [con for page in pages for con in page]
+    assert itr.get_total() == 12
+    # Stops at totalPageCount without requesting an empty page
+    assert api.get_group_members_page.call_count == 6
+    assert itr.executor is None
+
+def test_iterator_with_bounded_read_ahead():
+    """
+    Should not request pages further than read_ahead beyond the current page
+    """
+    pages = [[{'id': str(p), 'externalId': f'aaa{p:02}@test.com'}] for p in range(10)]
+    api = create_paged_api(pages)
+    itr = EverbridgeGroupMemberIterator(api, 'xxxxx', read_ahead=2)
+    itr.set_pagesize(1)
+    assert next(itr) == pages[0][0]
+    # Waits for the scheduled requests
+    for future in list(itr.pending):
+        future.result()
+    assert api.get_group_members_page.call_count == 3
+    itr.close()
+
+def test_iterator_start():
+    """
+    Should fetch the first page and the pages read ahead without consuming members
+    """
+    pages = [[{'id': str(p), 'externalId': f'aaa{p:02}@test.com'}] for p in range(10)]
+    api = create_paged_api(pages)
+    itr = EverbridgeGroupMemberIterator(api, 'xxxxx', read_ahead=2)
+    itr.set_pagesize(1)
+    itr.start()
+    for future in list(itr.pending):
+        future.result()
+    assert api.get_group_members_page.call_count == 3
+    assert itr.get_total() == 0
+    assert next(itr) == pages[0][0]
+    assert next(itr) == pages[1][0]
+    itr.close()
+
+def test_count_pages():
+    """
+    Should return the number of pages from page object
+    """
+    assert EverbridgeGroupMemberIterator.count_pages({}) is None
+    assert EverbridgeGroupMemberIterator.count_pages({'totalPageCount': 3}) == 3
+    assert EverbridgeGroupMemberIterator.count_pages(
+        {'totalPageCount': 0, 'totalCount': 201, 'pageSize': 100}) == 3
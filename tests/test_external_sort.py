@@ -0,0 +1,41 @@
+"""
+Tests external_sort
+"""
+from api.external_sort import external_sort
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_external_sort_in_memory(tmp_path):
+    """
+    Should sort items without spilling if they fit in a single run
+    """
+    items = [{'key': k} for k in [3, 1, 2]]
+    rslt = list(external_sort(iter(items), lambda item: item['key'], 10, str(tmp_path)))
+    assert rslt == [{'key': 1}, {'key': 2}, {'key': 3}]
+
+def test_external_sort_with_runs(tmp_path):
+    """
+    Should merge the runs spilled to disk in order and remove the run files
+    """
+    keys = [9, 4, 7, 1, 8, 2, 6, 3, 5, 0]
+    items = ({'key': k, 'name': 'item' + str(k)} for k in keys)
+    itr = external_sort(items, lambda item: item['key'], 3, str(tmp_path))
+    assert next(itr) == {'key': 0, 'name': 'item0'}
+    assert [item['key'] for item in itr] == list(range(1, 10))
+    assert not list(tmp_path.iterdir())
+
+def test_external_sort_closed_early(tmp_path):
+    """
+    Should remove the run files when the caller stops early
+    """
+    items = ({'key': k} for k in range(10, 0, -1))
+    itr = external_sort(items, lambda item: item['key'], 4, str(tmp_path))
+    assert next(itr) == {'key': 1}
+    itr.close()
+    assert not list(tmp_path.iterdir())
+
+def test_external_sort_without_items():
+    """
+    Should yield nothing
+    """
+    assert not list(external_sort(iter([]), lambda item: item['key']))
@@ -0,0 +1,215 @@
+"""
+Tests rate control
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest.mock import MagicMock
+import pytest
+from api import rate_control
+from api.rate_control import AdaptiveLimiter, RateControl, endpoint_family, parse_retry_after
+# pylint: disable=unused-import
+import tests.log_helper
+
+def create_response(code, retry_after=None):
+    """
+    Returns response mock
+    """
+    headers = {'Retry-After': retry_after} if retry_after is not None else {}
+    return MagicMock(status_code=code, headers=headers)
+
+@pytest.fixture(name='sleeps')
+def fixture_sleeps(monkeypatch):
+    """
+    Records sleeps instead of sleeping
+    """
+    sleeps = []
+    monkeypatch.setattr(rate_control.time, 'sleep', sleeps.append)
+    return sleeps
+
+def test_parse_retry_after():
+    """
+    Should return seconds given by seconds or HTTP date
+    """
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(later, usegmt=True)) <= 30
+    earlier = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(earlier, usegmt=True)) == 0
+
+def test_endpoint_family():
+    """
+    Should return the first path segment after base URL
+    """
+    base = 'https://graph.microsoft.com/v1.0/'
+    assert endpoint_family(base + 'groups/xxx/members?$top=999', base) == 'groups'
+    assert endpoint_family(base + '$batch', base) == '$batch'
+    assert endpoint_family(base + 'users?$filter=x', base) == 'users'
+
+def test_adaptive_limiter():
+    """
+    Should halve the limit when throttled and increase it by one per limit successes
+    """
+    limiter = AdaptiveLimiter(8)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.get_limit() == 2
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.get_limit() == 2
+    limiter.on_success()
+    assert limiter.get_limit() == 3
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.get_limit() == 1
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.get_limit() == 8
+
+def test_send_retries_after_retry_after(sleeps):
+    """
+    Should wait as long as Retry-After and retry until the request succeeds
+    """
+    request = MagicMock(side_effect=[create_response(429, '3'), create_response(503, '1'), create_response(200)])
+    control = RateControl('TEST', 4)
+    assert control.send('groups', request).status_code == 200
+    assert request.call_count == 3
+    assert 3 <= sleeps[0] <= 3.5
+    assert 1 <= sleeps[1] <= 1.5
+    report = control.report()
+    assert report['requests'] == 3
+    assert report['throttled'] == 2
+    assert report['retries'] == 2
+    assert report['gave_up'] == 0
+    # 4 => 2 => 1 when throttled; 2 after a success
+    assert report['limits'] == {'groups': 2}
+
+def test_send_backs_off_with_jitter(sleeps):
+    """
+    Should back off exponentially without Retry-After
+    """
+    request = MagicMock(side_effect=[create_response(429)] * 3 + [create_response(200)])
+    control = RateControl('TEST', 4)
+    control.set_backoff(1.0, 3.0)
+    control.send('contacts', request)
+    assert 0.5 <= sleeps[0] <= 1
+    assert 1 <= sleeps[1] <= 2
+    assert 1.5 <= sleeps[2] <= 3
+
+def test_send_gives_up(sleeps):
+    """
+    Should return the throttled response after max retries
+    """
+    request = MagicMock(return_value=create_response(429, '0'))
+    control = RateControl('TEST', 4, 2)
+    assert control.send('contacts', request).status_code == 429
+    assert request.call_count == 3
+    assert len(sleeps) == 2
+    assert control.report()['gave_up'] == 1
+
+def test_send_waits_until_deadline(monkeypatch):
+    """
+    Should cap the delay at the deadline and give up once it has passed
+    """
+    request = MagicMock(return_value=create_response(429, '30'))
+    control = RateControl('TEST', 4)
+    control.set_deadline(time.time() + 5)
+    # The deadline passes while sleeping
+    sleep = MagicMock(side_effect=lambda delay: control.set_deadline(time.time() - 1))
+    monkeypatch.setattr(rate_control.time, 'sleep', sleep)
+    assert control.send('contacts', request).status_code == 429
+    assert request.call_count == 2
+    assert sleep.call_count == 1
+    assert sleep.call_args[0][0] <= 5
+    assert control.report()['gave_up'] == 1
+
+def test_send_async_gives_up_after_deadline():
+    """
+    Should not retry after the deadline
+    """
+    async def request():
+        return 429, {'Retry-After': '30'}, ''
+    control = RateControl('TEST', 4)
+    control.set_deadline(time.time() - 1)
+    status, _, _ = asyncio.run(control.send_async('groups', request))
+    assert status == 429
+    report = control.report()
+    assert report['requests'] == 1
+    assert report['gave_up'] == 1
+
+def test_send_without_throttling(sleeps):
+    """
+    Should return the response as it is
+    """
+    response = create_response(404)
+    control = RateControl('TEST', 4)
+    assert control.send('contacts', MagicMock(return_value=response)) is response
+    assert not sleeps
+    assert control.report()['limits'] == {'contacts': 4}
+
+def test_send_async_within_max_concurrency():
+    """
+    Should keep requests in flight within max_concurrency and retry throttled ones
+    """
+    state = {'in_flight': 0, 'max_in_flight': 0, 'calls': 0}
+    async def request():
+        state['calls'] += 1
+        call = state['calls']
+        state['in_flight'] += 1
+        state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+        await asyncio.sleep(0.01)
+        state['in_flight'] -= 1
+        if call == 1:
+            return 429, {'Retry-After': '0'}, ''
+        return 200, {}, 'OK'
+    control = RateControl('TEST', 2)
+    control.set_backoff(0.0)
+    async def send_all():
+        return await asyncio.gather(*[control.send_async('groups', request) for _ in range(5)])
+    results = asyncio.run(send_all())
+    assert [body for _, _, body in results] == ['OK'] * 5
+    assert state['max_in_flight'] == 2
+    report = control.report()
+    assert report['requests'] == 6
+    assert report['retries'] == 1
+
+def test_send_async_lowers_concurrency_when_throttled():
+    """
+    Should halve the limit of the family when throttled and admit requests within the limit
+    """
+    async def throttled():
+        return 429, {'Retry-After': '0'}, ''
+    control = RateControl('TEST', 4, 0)
+    asyncio.run(control.send_async('groups', throttled))
+    asyncio.run(control.send_async('groups', throttled))
+    assert control.report()['limits'] == {'groups': 1}
+    events = []
+    async def request():
+        events.append('start')
+        await asyncio.sleep(0.01)
+        events.append('end')
+        return 200, {}, 'OK'
+    async def send_all():
+        return await asyncio.gather(*[control.send_async('groups', request) for _ in range(3)])
+    asyncio.run(send_all())
+    # The second request waits for the first one; the limit grows to 2 after that
+    assert events == ['start', 'end', 'start', 'start', 'end', 'end']
+
+def test_send_async_on_another_loop():
+    """
+    Should admit requests on a new event loop after the previous one is closed
+    """
+    async def request():
+        await asyncio.sleep(0.01)
+        return 200, {}, 'OK'
+    control = RateControl('TEST', 1)
+    async def send_all():
+        control.open_async()
+        results = await asyncio.gather(*[control.send_async('groups', request) for _ in range(3)])
+        control.close_async()
+        return results
+    for _ in range(2):
+        assert [body for _, _, body in asyncio.run(send_all())] == ['OK'] * 3
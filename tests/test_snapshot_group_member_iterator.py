@@ -0,0 +1,26 @@
+"""
+Tests SnapshotGroupMemberIterator class
+"""
+from api.snapshot_group_member_iterator import SnapshotGroupMemberIterator
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_iterator_with_data():
+    """
+    Should return each group member until the end
+    """
+    members = [{'externalId': str(i), 'id': i} for i in range(150)]
+    itr = SnapshotGroupMemberIterator(123, members)
+    assert [next(itr) for _ in range(150)] == members
+    assert next(itr) is None
+    assert next(itr) is None
+    assert itr.get_total() == 150
+    assert itr.get_group_id() == 123
+
+def test_iterator_without_data():
+    """
+    Should return None
+    """
+    itr = SnapshotGroupMemberIterator(123, [])
+    assert next(itr) is None
+    assert itr.get_total() == 0
@@ -0,0 +1,105 @@
+"""
+Tests SnapshotStore
+"""
+import pytest
+from api.contact_utils import fingerprint
+from api.exceptions import SnapshotStoreException
+from api.snapshot_store import SnapshotStore
+# pylint: disable=unused-import
+import tests.log_helper
+
+def create_contact(external_id, ever_id=None, groups=None):
+    """
+    Returns Everbridge contact
+    """
+    contact = {'externalId': external_id, 'firstName': 'AAA', 'groups': groups or []}
+    if ever_id:
+        contact['id'] = ever_id
+    return contact
+
+def with_fingerprint(contact):
+    """
+    Returns the contact with its fingerprint as returned from the store
+    """
+    return dict(contact, fingerprint=fingerprint(contact))
+
+def test_save_and_get_group_members(tmp_path):
+    """
+    Should return the saved members ordered by externalId
+    """
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(1, [create_contact('bbb', 2, [1]), create_contact('aaa', 1, [1])], True)
+    store.close()
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    assert store.get_group_members(1) == [with_fingerprint(create_contact('aaa', 1, [1])),
+                                          with_fingerprint(create_contact('bbb', 2, [1]))]
+    assert store.get_group_members(2) == []
+
+def test_save_group_keeps_known_ids(tmp_path):
+    """
+    Should keep the Everbridge id of the contact saved without id by another group
+    """
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(1, [create_contact('aaa', 1, [1])], True)
+    store.save_group(2, [create_contact('aaa', None, [2])], True)
+    assert store.get_group_members(1)[0]['id'] == 1
+    assert store.get_group_members(2)[0]['id'] == 1
+
+def test_save_group_replaces_members(tmp_path):
+    """
+    Should remove members not saved again and contacts belonging to no groups
+    """
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(1, [create_contact('aaa', 1), create_contact('bbb', 2)], True)
+    store.save_group(1, [create_contact('bbb', 2)])
+    assert store.get_group_members(1) == [with_fingerprint(create_contact('bbb', 2))]
+    assert store.conn.execute('SELECT COUNT(*) FROM contacts').fetchone()[0] == 1
+
+def test_needs_reconciliation(tmp_path):
+    """
+    Should return True unless the group was reconciled within the interval
+    """
+    store = SnapshotStore(str(tmp_path / 'snapshot.db'), 60).open()
+    assert store.needs_reconciliation(1)
+    store.save_group(1, [], True)
+    assert not store.needs_reconciliation(1)
+    store.save_group(1, [])
+    assert not store.needs_reconciliation(1)
+    store.conn.execute('UPDATE group_syncs SET reconciled_at = reconciled_at - 120')
+    assert store.needs_reconciliation(1)
+    store.save_group(2, [])
+    assert store.needs_reconciliation(2)
+
+def test_invalidate(tmp_path):
+    """
+    Should forget the group
+    """
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(1, [create_contact('aaa', 1)], True)
+    store.invalidate(1)
+    assert store.needs_reconciliation(1)
+    assert store.get_group_members(1) == []
+
+def test_open_with_invalid_file(tmp_path):
+    """
+    Should raise an exception if the file is not a database
+    """
+    filename = tmp_path / 'snapshot.db'
+    filename.write_text('NOT A DATABASE' * 100)
+    with pytest.raises(SnapshotStoreException):
+        SnapshotStore(str(filename)).open()
+
+def test_open_with_store_without_fingerprint(tmp_path):
+    """
+    Should add the fingerprint column to the store created before it was introduced
+    """
+    filename = str(tmp_path / 'snapshot.db')
+    store = SnapshotStore(filename).open()
+    with store.conn:
+        store.conn.execute('DROP TABLE contacts')
+        store.conn.execute('CREATE TABLE contacts (external_id TEXT PRIMARY KEY, ever_id INTEGER,'
+                           ' data TEXT NOT NULL, updated_at REAL NOT NULL)')
+    store.close()
+    store = SnapshotStore(filename).open()
+    store.save_group(1, [create_contact('aaa', 1)], True)
+    assert store.get_group_members(1) == [with_fingerprint(create_contact('aaa', 1))]
@@ -0,0 +1,91 @@
+"""
+Tests SyncPipeline
+"""
+import threading
+import pytest
+from api.exceptions import SynchronizerException
+from api.sync_pipeline import SyncPipeline
+# pylint: disable=unused-import
+import tests.log_helper
+
+def test_put_and_close():
+    """
+    Should send full batches while putting and the rest on close
+    """
+    batches = []
+    pipeline = SyncPipeline(batch_size=3).add_stage('write', batches.append)
+    for i in range(7):
+        pipeline.put('write', i)
+    pipeline.close()
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+def test_chained_stages():
+    """
+    Should let a stage feed the following stage
+    """
+    added = []
+    pipeline = SyncPipeline(batch_size=2)
+    pipeline.add_stage('first', lambda batch: [pipeline.put('second', i * 10) for i in batch])
+    pipeline.add_stage('second', added.append)
+    for i in range(5):
+        pipeline.put('first', i)
+    pipeline.close()
+    assert sorted(sum(added, [])) == [0, 10, 20, 30, 40]
+
+def test_deferred_stage():
+    """
+    Should hold the batches of the deferred stage until close
+    """
+    batches = []
+    pipeline = SyncPipeline(batch_size=2).add_stage('write', batches.append, deferred=True)
+    for i in range(5):
+        pipeline.put('write', i)
+    assert batches == []
+    pipeline.close()
+    assert batches == [[0, 1], [2, 3], [4]]
+
+def test_backpressure():
+    """
+    Should block put while the stage queue is full
+    """
+    release = threading.Event()
+    pipeline = SyncPipeline(batch_size=1, queue_size=1).add_stage('write', lambda batch: release.wait())
+    done = threading.Event()
+
+    def produce():
+        for i in range(4):
+            pipeline.put('write', i)
+        done.set()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    # One batch is being written and another is queued
+    assert not done.wait(0.1)
+    release.set()
+    assert done.wait(1)
+    producer.join()
+    pipeline.close()
+
+def test_error():
+    """
+    Should raise the error of a stage on put and close
+    """
+    def fail(batch):
+        raise ValueError('Failed')
+    pipeline = SyncPipeline(batch_size=1).add_stage('write', fail)
+    pipeline.put('write', 1)
+    with pytest.raises(SynchronizerException):
+        for i in range(100):
+            pipeline.put('write', i)
+    with pytest.raises(SynchronizerException):
+        pipeline.close()
+
+def test_abort():
+    """
+    Should stop stages without writing the remaining batch
+    """
+    batches = []
+    pipeline = SyncPipeline(batch_size=3).add_stage('write', batches.append)
+    pipeline.put('write', 1)
+    pipeline.abort()
+    assert batches == []
@@ -1,6 +1,7 @@
 """
 Tests SyncRunner
 """
+import json
 from unittest.mock import MagicMock, patch
 import pytest
 from api.exceptions import SyncRunnerException
@@ -27,7 +28,7 @@ def test_run(mock_sync, mock_ever, mock_azure):
     mock_sync.Synchronizer.return_value = sync
     # Call SyncRuunner#run
     runner = SyncRunner('./config/sampleConfig.json')
-    runner.run()
+    assert runner.run() == sync.run_with_map.return_value
     # Test if each function is called properly
     mock_azure.Azure.assert_called_with(conf['clientId'],
                                   conf['clientSecret'],
@@ -36,8 +37,76 @@ def test_run(mock_sync, mock_ever, mock_azure):
                                  conf['everbridgeUsername'],
                                  conf['everbridgePassword'])
     mock_sync.Synchronizer.assert_called_with(azure, everbridge)
+    mock_ever.GroupDirectory.assert_called_with(None, None)
+    everbridge.set_group_directory.assert_called_with(mock_ever.GroupDirectory.return_value)
+    sync.set_org_index_mode.assert_called_with('never', None)
     sync.run_with_map.assert_called_with(conf['adGroupId'], conf["adMemberId"], conf["parentGroup"])
 
+@patch('api.sync_runner.Azure', autospec=True)
+@patch('api.sync_runner.Everbridge', autospec=True)
+@patch('api.sync_runner.Synchronizer', autospec=True)
+def test_run_with_deadline(mock_sync, mock_ever, mock_azure):
+    """
+    Should pass the deadline to Synchronizer
+    """
+    mock_azure.Azure.return_value = MagicMock()
+    mock_ever.Everbridge.return_value = MagicMock()
+    sync = MagicMock()
+    mock_sync.Synchronizer.return_value = sync
+    runner = SyncRunner('./config/sampleConfig.json')
+    runner.run(deadline=12345)
+    sync.set_deadline.assert_called_with(12345, None)
+
+@patch('api.sync_runner.Azure', autospec=True)
+@patch('api.sync_runner.Everbridge', autospec=True)
+@patch('api.sync_runner.Synchronizer', autospec=True)
+def test_run_with_read_timeout(mock_sync, mock_ever, mock_azure, tmp_path):
+    """
+    Should set the read timeout without the connect timeout
+    """
+    conf = SyncRunner.load_config('./config/sampleConfig.json')
+    conf['readTimeout'] = 30
+    configfile = tmp_path / 'config.json'
+    configfile.write_text(json.dumps(conf))
+    azure = MagicMock()
+    mock_azure.Azure.return_value = azure
+    everbridge = MagicMock()
+    mock_ever.Everbridge.return_value = everbridge
+    mock_sync.Synchronizer.return_value = MagicMock()
+    SyncRunner(str(configfile)).run()
+    azure.set_timeout.assert_called_with(None, 30)
+    everbridge.set_timeout.assert_called_with(None, 30)
+
+@patch('api.sync_runner.Azure', autospec=True)
+@patch('api.sync_runner.Everbridge', autospec=True)
+@patch('api.sync_runner.Synchronizer', autospec=True)
+@patch('api.sync_runner.async_azure', autospec=True)
+@patch('api.sync_runner.async_everbridge', autospec=True)
+def test_run_with_async_clients(mock_async_ever, mock_async_azure, mock_sync, mock_ever, mock_azure, tmp_path):
+    """
+    Should pass AsyncRunner of the async clients to Synchronizer
+    """
+    conf = SyncRunner.load_config('./config/sampleConfig.json')
+    conf['asyncClients'] = True
+    configfile = tmp_path / 'config.json'
+    configfile.write_text(json.dumps(conf))
+    azure = MagicMock()
+    mock_azure.Azure.return_value = azure
+    everbridge = MagicMock()
+    everbridge.timeout = (5, 30)
+    mock_ever.Everbridge.return_value = everbridge
+    sync = MagicMock()
+    mock_sync.Synchronizer.return_value = sync
+    SyncRunner(str(configfile)).run()
+    mock_async_ever.AsyncEverbridge.assert_called_with(conf['everbridgeOrg'],
+                                                       conf['everbridgeUsername'],
+                                                       conf['everbridgePassword'])
+    mock_async_ever.AsyncEverbridge.return_value.set_timeout.assert_called_with(5, 30)
+    mock_async_azure.AsyncAzure.assert_called_with(azure)
+    runner = sync.set_async_runner.call_args[0][0]
+    assert runner.everbridge == mock_async_ever.AsyncEverbridge.return_value
+    assert runner.azure == mock_async_azure.AsyncAzure.return_value
+
 def test_load_config():
     """
     Should return config object
@@ -174,3 +243,19 @@ def test_check_config_with_errors():
             'adGroupId':['group1', 'group2'],
             'logLevel':'XXXXX'
         })
+
+def test_check_config_with_token_cache_file_without_key():
+    """
+    Should raise Exception because the token cache file must be encrypted
+    """
+    with pytest.raises(SyncRunnerException):
+        SyncRunner.check_config({
+            'clientId':'cid',
+            'clientSecret':'secret',
+            'everbridgeUsername':'user',
+            'everbridgePassword':'pass',
+            'everbridgeOrg':'12345',
+            'adTenant':'98765',
+            'adGroupId':['group1', 'group2'],
+            'tokenCacheFile':'token.bin'
+        })
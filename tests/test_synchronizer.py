@@ -1,13 +1,25 @@
 """
 Tests Synchronizer
 """
+import threading
+import time
 from unittest.mock import MagicMock
+import pytest
 from api.synchronizer import Synchronizer
 from api.synchronizer import AdContactMap
 from api.azure_group_member_iterator import AzureGroupMemberIterator
 from api.everbridge_group_member_iterator import EverbridgeGroupMemberIterator
-from azure_helper import create_azure_mock
-from everbridge_helper import create_everbridge_mock, \
+from api.delta_state import DeltaState
+from api.snapshot_store import SnapshotStore
+from api.checkpoint_journal import CheckpointJournal
+from api.async_runner import AsyncRunner
+from api.azure import Azure
+from api.exceptions import AzureDeltaTokenException, AzureException, EverbridgeException
+from azure_helper import AsyncAzureMock, create_azure_mock, create_azure_contacts
+from everbridge_helper import AsyncEverbridgeMock, \
+                              create_everbridge_mock, \
+                              create_changing_everbridge_mock, \
+                              create_get_page, \
                               create_everbridge_contacts, \
                               modify_everbridge_data
 # pylint: disable=unused-import
@@ -28,13 +40,11 @@ def test_run():
     update_data = create_everbridge_contacts(update_ids, True)
     insert_data = create_everbridge_contacts(insert_ids, False)
     upsert_data = update_data + insert_data
-    inserted_data = [create_everbridge_contacts(insert_ids, True)]
-    inserted_exids = (
-        '&externalIds=aaa.bbb0004@xxx.com' +
-        '&externalIds=aaa.bbb0006@xxx.com' +
-        '&externalIds=aaa.bbb0007@xxx.com')
+    inserted_exids = [
+        'aaa.bbb0004@xxx.com',
+        'aaa.bbb0006@xxx.com',
+        'aaa.bbb0007@xxx.com']
     ever = create_everbridge_mock(data)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     app = Synchronizer(azure, ever)
     # Call run
     rslt = app.run([gid])
@@ -46,8 +56,8 @@ def test_run():
     ever.delete_members_from_group.assert_called_with(gid, delete_ids)
     ever.delete_contacts.assert_called_with(delete_ids)
     ever.upsert_contacts.assert_called_with(upsert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, insert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'GROUP1': {
             'azure_group_id': 123, 'everbridge_group_id': 123,
@@ -65,12 +75,12 @@ def test_run_add_group():
     data = [create_everbridge_contacts([], True)]
     insert_ids = [1, 2]
     insert_data = create_everbridge_contacts(insert_ids, False)
-    inserted_data = [create_everbridge_contacts(insert_ids, True)]
-    inserted_exids = ('&externalIds=aaa.bbb0001@xxx.com&externalIds=aaa.bbb0002@xxx.com')
+    inserted_exids = [
+        'aaa.bbb0001@xxx.com',
+        'aaa.bbb0002@xxx.com']
     ever = create_everbridge_mock(data)
     ever.add_group = MagicMock(return_value={'id': 123})
     ever.get_group_id_by_name = MagicMock(return_value=None)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     app = Synchronizer(azure, ever)
     # Call run
     rslt = app.run([gid])
@@ -82,8 +92,8 @@ def test_run_add_group():
     ever.delete_members_from_group.assert_not_called()
     ever.delete_contacts.assert_not_called()
     ever.upsert_contacts.assert_called_with(insert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, insert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'GROUP1': {
             'azure_group_id': 123, 'everbridge_group_id': 123,
@@ -133,10 +143,10 @@ def test_sync_group_with_map_insert_and_delete():
     delete_ids = [3, 7, 8]
     upsert_ids = [2, 9]
     upsert_data = create_everbridge_contacts(upsert_ids, False)
-    inserted_data = [create_everbridge_contacts(upsert_ids, True)]
-    inserted_exids = '&externalIds=aaa.bbb0002@xxx.com&externalIds=aaa.bbb0009@xxx.com'
+    inserted_exids = [
+        'aaa.bbb0002@xxx.com',
+        'aaa.bbb0009@xxx.com']
     ever = create_everbridge_mock(data)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     members_map = azure.get_all_group_members_map(gid)
     admap = AdContactMap(gid, members_map)
     itr_ev = EverbridgeGroupMemberIterator(ever, gid)
@@ -149,8 +159,8 @@ def test_sync_group_with_map_insert_and_delete():
     ever.delete_contacts.assert_not_called()
     ever.delete_members_from_group.assert_called_with(gid, delete_ids)
     ever.upsert_contacts.assert_called_with(upsert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, upsert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'azure_group_id': 123, 'everbridge_group_id': 123, 'azure_count': 4, 'everbridge_count': 5,
         'inserted_contacts': 2, 'updated_contacts': 0, 'removed_members': 3,
@@ -227,12 +237,11 @@ def test_sync_group_with_map_only_ad():
     data = [create_everbridge_contacts([], True)]
     upsert_ids = [1, 2, 3]
     upsert_data = create_everbridge_contacts(upsert_ids, False)
-    inserted_data = [create_everbridge_contacts(upsert_ids, True)]
-    inserted_exids = ('&externalIds=aaa.bbb0001@xxx.com' +
-                      '&externalIds=aaa.bbb0002@xxx.com' +
-                      '&externalIds=aaa.bbb0003@xxx.com')
+    inserted_exids = [
+        'aaa.bbb0001@xxx.com',
+        'aaa.bbb0002@xxx.com',
+        'aaa.bbb0003@xxx.com']
     ever = create_everbridge_mock(data)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     members_map = azure.get_all_group_members_map(gid)
     admap = AdContactMap(gid, members_map)
     itr_ev = EverbridgeGroupMemberIterator(ever, gid)
@@ -245,8 +254,8 @@ def test_sync_group_with_map_only_ad():
     ever.delete_contacts.assert_not_called()
     ever.delete_members_from_group.assert_not_called()
     ever.upsert_contacts.assert_called_with(upsert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, upsert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'azure_group_id': 123, 'everbridge_group_id': 123, 'azure_count': 3, 'everbridge_count': 0,
         'inserted_contacts': 3, 'updated_contacts': 0, 'removed_members': 0,
@@ -263,10 +272,10 @@ def test_sync_group_insert_and_delete():
     delete_ids = [3, 7, 8]
     upsert_ids = [2, 9]
     upsert_data = create_everbridge_contacts(upsert_ids, False)
-    inserted_data = [create_everbridge_contacts(upsert_ids, True)]
-    inserted_exids = '&externalIds=aaa.bbb0002@xxx.com&externalIds=aaa.bbb0009@xxx.com'
+    inserted_exids = [
+        'aaa.bbb0002@xxx.com',
+        'aaa.bbb0009@xxx.com']
     ever = create_everbridge_mock(data)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     itr_ad = AzureGroupMemberIterator(azure, gid)
     itr_ev = EverbridgeGroupMemberIterator(ever, gid)
     app = Synchronizer(azure, ever)
@@ -278,8 +287,8 @@ def test_sync_group_insert_and_delete():
     ever.delete_contacts.assert_not_called()
     ever.delete_members_from_group.assert_called_with(gid, delete_ids)
     ever.upsert_contacts.assert_called_with(upsert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, upsert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'azure_group_id': 123, 'everbridge_group_id': 123, 'azure_count': 4, 'everbridge_count': 5,
         'inserted_contacts': 2, 'updated_contacts': 0, 'removed_members': 3,
@@ -356,12 +365,11 @@ def test_sync_group_only_ad():
     data = [create_everbridge_contacts([], True)]
     upsert_ids = [1, 2, 3]
     upsert_data = create_everbridge_contacts(upsert_ids, False)
-    inserted_data = [create_everbridge_contacts(upsert_ids, True)]
-    inserted_exids = ('&externalIds=aaa.bbb0001@xxx.com' +
-                      '&externalIds=aaa.bbb0002@xxx.com' +
-                      '&externalIds=aaa.bbb0003@xxx.com')
+    inserted_exids = [
+        'aaa.bbb0001@xxx.com',
+        'aaa.bbb0002@xxx.com',
+        'aaa.bbb0003@xxx.com']
     ever = create_everbridge_mock(data)
-    ever.get_contacts_by_external_ids = MagicMock(side_effect=inserted_data)
     itr_ad = AzureGroupMemberIterator(azure, gid)
     itr_ev = EverbridgeGroupMemberIterator(ever, gid)
     app = Synchronizer(azure, ever)
@@ -373,8 +381,8 @@ def test_sync_group_only_ad():
     ever.delete_contacts.assert_not_called()
     ever.delete_members_from_group.assert_not_called()
     ever.upsert_contacts.assert_called_with(upsert_data)
-    ever.get_contacts_by_external_ids.assert_called_with(inserted_exids)
-    ever.add_members_to_group.assert_called_with(gid, upsert_ids)
+    ever.get_contacts_by_external_ids.assert_not_called()
+    ever.add_members_to_group.assert_called_with(gid, inserted_exids, 'externalId')
     assert rslt == {
         'azure_group_id': 123, 'everbridge_group_id': 123, 'azure_count': 3, 'everbridge_count': 0,
         'inserted_contacts': 3, 'updated_contacts': 0, 'removed_members': 0,
@@ -407,3 +415,767 @@ def test_sync_group_no_data():
         'inserted_contacts': 0, 'updated_contacts': 0, 'removed_members': 0,
         'deleted_contacts': 0, 'added_members': 0, 'error_contacts': 0
     }
+
+def test_sync_group_changes():
+    """
+    Should insert new contacts, add existing contacts and remove members
+    """
+    gid = 123
+    azure = create_azure_mock('GROUP1', [])
+    added = {con['userPrincipalName']: con for con in create_azure_contacts([1, 2])}
+    existing = create_everbridge_contacts([1, 3], True)
+    modify_everbridge_data(existing, [1], 'groups', [999])
+    modify_everbridge_data(existing, [3], 'groups', [gid])
+    ever = create_everbridge_mock([])
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=existing)
+    app = Synchronizer(azure, ever)
+    rslt = app.sync_group_changes(gid, added, ['aaa.bbb0003@xxx.com'])
+    ever.get_contacts_by_external_id_list.assert_called_with(
+        ['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com', 'aaa.bbb0003@xxx.com'])
+    ever.upsert_contacts.assert_called_with(create_everbridge_contacts([2], False))
+    ever.delete_members_from_group.assert_called_with(gid, [3])
+    ever.delete_contacts.assert_called_with([3])
+    ever.add_members_to_group.assert_any_call(gid, ['aaa.bbb0002@xxx.com'], 'externalId')
+    ever.add_members_to_group.assert_called_with(gid, [1])
+    assert rslt == {
+        'everbridge_group_id': 123, 'incremental': True,
+        'inserted_contacts': 1, 'updated_contacts': 0, 'removed_members': 1,
+        'deleted_contacts': 1, 'added_members': 2, 'error_contacts': 0
+    }
+
+def test_sync_group_incrementally():
+    """
+    Should sync only changed members and save the new delta link
+    """
+    gid = 123
+    state = DeltaState('delta.json')
+    state.set_full_sync('gid_ad', 'LINK1', {'u3': 'aaa.bbb0003@xxx.com', 'u4': 'aaa.bbb0004@xxx.com'})
+    state.save = MagicMock()
+    azure = create_azure_mock('GROUP1', [])
+    contact = create_azure_contacts([2])[0]
+    azure.get_group_member_changes = MagicMock(return_value={
+        'added': {contact['userPrincipalName']: contact}, 'removed': ['u3'], 'deltaLink': 'LINK2'})
+    ever = create_everbridge_mock([])
+    app = Synchronizer(azure, ever)
+    app.set_delta_state(state)
+    app.sync_group_changes = MagicMock(return_value={'everbridge_group_id': gid})
+    rslt = app._sync_group_incrementally('gid_ad', gid)
+    app.sync_group_changes.assert_called_with(gid, {contact['userPrincipalName']: contact},
+                                              ['aaa.bbb0003@xxx.com'])
+    assert rslt == {'everbridge_group_id': gid, 'azure_group_id': 'gid_ad',
+                    'azure_count': 2, 'everbridge_count': 2}
+    assert state.get_delta_link('gid_ad') == 'LINK2'
+    assert state.get_members('gid_ad') == {'u4': 'aaa.bbb0004@xxx.com', 2: 'aaa.bbb0002@xxx.com'}
+    state.save.assert_called_with()
+
+def test_sync_group_incrementally_with_rejected_token():
+    """
+    Should return None and forget the group state to run a full sync
+    """
+    state = DeltaState('delta.json')
+    state.set_full_sync('gid_ad', 'LINK1', {})
+    azure = create_azure_mock('GROUP1', [])
+    azure.get_group_member_changes = MagicMock(side_effect=AzureDeltaTokenException)
+    app = Synchronizer(azure, create_everbridge_mock([]))
+    app.set_delta_state(state)
+    assert app._sync_group_incrementally('gid_ad', 123) is None
+    assert state.get_delta_link('gid_ad') is None
+
+def test_sync_group_fully_with_delta_state():
+    """
+    Should save the delta link and members after a full sync
+    """
+    gid = 123
+    state = DeltaState('delta.json')
+    state.save = MagicMock()
+    azure = create_azure_mock('GROUP1', [1, 2])
+    azure.get_latest_delta_link = MagicMock(return_value='LINK1')
+    data = [create_everbridge_contacts([1, 2], True)]
+    ever = create_everbridge_mock(data)
+    app = Synchronizer(azure, ever)
+    app.set_delta_state(state)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    assert rslt['azure_count'] == 2
+    assert state.get_delta_link('gid_ad') == 'LINK1'
+    assert state.get_members('gid_ad') == {1: 'aaa.bbb0001@xxx.com', 2: 'aaa.bbb0002@xxx.com'}
+
+def test_run_with_map_concurrently():
+    """
+    Should sync groups concurrently and merge each report
+    """
+    groups = {'gid1': ('GROUP1', [1, 2]), 'gid2': ('GROUP2', [3]), 'gid3': ('GROUP3', [4, 5, 6])}
+    ev_groups = {'GROUP1': 1, 'GROUP2': 2, 'GROUP3': 3, 'PARENT': 9}
+    ev_members = {1: [1, 2], 2: [3], 3: [4, 5, 6], 9: []}
+    azure = create_azure_mock('', [])
+    azure.get_group_name = MagicMock(side_effect=lambda gid: groups[gid][0])
+    azure.get_all_group_members_map = MagicMock(side_effect=lambda gid, registry=None: {
+        con['userPrincipalName']: con for con in create_azure_contacts(groups[gid][1])})
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    ever.get_group_id_by_name = MagicMock(side_effect=lambda name: ev_groups[name])
+    ever.get_group_members_page = MagicMock(side_effect=lambda gid, page: {
+        'totalPageCount': 1, 'data': create_everbridge_contacts(ev_members[gid], True)})
+    app = Synchronizer(azure, ever)
+    app.set_max_workers(3)
+    rslt = app.run_with_map(list(groups), [], 'PARENT')
+    azure.get_groups.assert_called_once_with(list(groups))
+    assert list(rslt.keys()) == ['GROUP1', 'GROUP2', 'GROUP3', 'PARENT', 'rate_control']
+    for gid, (name, members) in groups.items():
+        assert rslt[name]['azure_group_id'] == gid
+        assert rslt[name]['everbridge_group_id'] == ev_groups[name]
+        assert rslt[name]['azure_count'] == len(members)
+        assert rslt[name]['everbridge_count'] == len(members)
+        assert rslt[name]['updated_contacts'] == 0
+    ever.upsert_contacts.assert_not_called()
+
+def test_run_with_map_concurrently_with_moved_contact():
+    """
+    Should not delete from the org the contact another worker added to its group after the pages were read
+    """
+    groups = {'gid1': ('GROUP1', [1]), 'gid2': ('GROUP2', [])}
+    ev_groups = {'GROUP1': 1, 'GROUP2': 2, 'PARENT': 9}
+    ev_members = {1: [], 2: [1], 9: []}
+    azure = create_azure_mock('', [])
+    azure.get_group_name = MagicMock(side_effect=lambda gid: groups[gid][0])
+    azure.get_all_group_members_map = MagicMock(side_effect=lambda gid, registry=None: {
+        con['userPrincipalName']: con for con in create_azure_contacts(groups[gid][1])})
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    moved = create_everbridge_contacts([1], True)
+    modify_everbridge_data(moved, [1], 'groups', [2])
+    ever = create_everbridge_mock([])
+    ever.get_group_id_by_name = MagicMock(side_effect=lambda name: ev_groups[name])
+    ever.get_group_members_page = MagicMock(side_effect=lambda gid, page: {
+        'totalPageCount': 1, 'data': moved if ev_members[gid] else []})
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=[dict(moved[0], groups=[2, 1])])
+    app = Synchronizer(azure, ever)
+    app.set_max_workers(2)
+    app.run_with_map(list(groups), [], 'PARENT')
+    ever.delete_members_from_group.assert_called_once_with(2, [1])
+    ever.get_contacts_by_external_id_list.assert_called_once_with(['aaa.bbb0001@xxx.com'])
+    ever.delete_contacts.assert_not_called()
+
+def test_sync_group_with_map_with_failed_upsert():
+    """
+    Should report failed contacts and add only upserted contacts to group
+    """
+    gid = 123
+    azure = create_azure_mock('GROUP1', [1, 2])
+    ever = create_everbridge_mock([[]])
+    ever.upsert_contacts = MagicMock(return_value={
+        'code': 100, 'message': 'OK', 'failed_contacts': create_everbridge_contacts([2])})
+    admap = AdContactMap(gid, azure.get_all_group_members_map(gid))
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+    app = Synchronizer(azure, ever)
+    rslt = app.sync_group_with_map(admap, itr_ev)
+    ever.add_members_to_group.assert_called_with(gid, ['aaa.bbb0001@xxx.com'], 'externalId')
+    assert rslt['inserted_contacts'] == 2
+    assert rslt['failed_contacts'] == 1
+    assert rslt['added_members'] == 1
+
+def test_sync_group_fully_with_snapshot_store(tmp_path):
+    """
+    Should diff AD members against the snapshot instead of Everbridge member pages
+    """
+    gid = 123
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    # First sync walks Everbridge pages and records the members
+    data = [create_everbridge_contacts([1, 2, 3], True)]
+    modify_everbridge_data(data[0], [1, 2, 3], 'groups', [gid])
+    modify_everbridge_data(data[0], [2], 'firstName', 'CHANGED')
+    ever = create_everbridge_mock(data)
+    app = Synchronizer(create_azure_mock('GROUP1', [1, 2, 4]), ever)
+    app.set_snapshot_store(store)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    assert rslt['inserted_contacts'] == 1
+    assert rslt['updated_contacts'] == 1
+    assert rslt['removed_members'] == 1
+    assert [con.get('id') for con in store.get_group_members(gid)] == [1, 2, None]
+    assert not store.needs_reconciliation(gid)
+    # Second sync reads the snapshot and looks up the inserted contact only
+    inserted = create_everbridge_contacts([4], True)
+    modify_everbridge_data(inserted, [4], 'groups', [gid])
+    ever = create_everbridge_mock([])
+    ever.get_group_members_page = MagicMock()
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=inserted)
+    app = Synchronizer(create_azure_mock('GROUP1', [1, 2, 4]), ever)
+    app.set_snapshot_store(store)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    ever.get_group_members_page.assert_not_called()
+    ever.get_contacts_by_external_id_list.assert_called_with(['aaa.bbb0004@xxx.com'])
+    ever.upsert_contacts.assert_not_called()
+    assert rslt['everbridge_count'] == 3
+    assert rslt['updated_contacts'] == 0
+    assert rslt['inserted_contacts'] == 0
+    assert [con.get('id') for con in store.get_group_members(gid)] == [1, 2, 4]
+    # Third sync checks the current groups of removed members before deleting contacts
+    current = create_everbridge_contacts([2], True)
+    modify_everbridge_data(current, [2], 'groups', [gid, 999])
+    ever = create_everbridge_mock([])
+    ever.get_group_members_page = MagicMock()
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=current)
+    app = Synchronizer(create_azure_mock('GROUP1', [1, 4]), ever)
+    app.set_snapshot_store(store)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    ever.get_contacts_by_external_id_list.assert_called_with(['aaa.bbb0002@xxx.com'])
+    ever.delete_members_from_group.assert_called_with(gid, [2])
+    ever.delete_contacts.assert_not_called()
+    assert rslt['removed_members'] == 1
+    assert [con.get('id') for con in store.get_group_members(gid)] == [1, 4]
+
+def test_sync_group_fully_with_snapshot_store_needing_reconciliation(tmp_path):
+    """
+    Should walk Everbridge member pages if the snapshot is too old
+    """
+    gid = 123
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(gid, create_everbridge_contacts([1], True))
+    ever = create_everbridge_mock([create_everbridge_contacts([1], True)])
+    ever.get_group_members_page = MagicMock(wraps=ever.get_group_members_page)
+    app = Synchronizer(create_azure_mock('GROUP1', [1]), ever)
+    app.set_snapshot_store(store)
+    app._sync_group_fully('gid_ad', gid)
+    ever.get_group_members_page.assert_called()
+    assert not store.needs_reconciliation(gid)
+
+def test_sync_group_fully_with_snapshot_store_and_unknown_contact(tmp_path):
+    """
+    Should walk Everbridge member pages if the inserted contact is not found
+    """
+    gid = 123
+    store = SnapshotStore(str(tmp_path / 'snapshot.db')).open()
+    store.save_group(gid, create_everbridge_contacts([1], False), True)
+    ever = create_everbridge_mock([create_everbridge_contacts([1], True)])
+    ever.get_group_members_page = MagicMock(wraps=ever.get_group_members_page)
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=[])
+    app = Synchronizer(create_azure_mock('GROUP1', [1]), ever)
+    app.set_snapshot_store(store)
+    app._sync_group_fully('gid_ad', gid)
+    ever.get_group_members_page.assert_called()
+    assert [con.get('id') for con in store.get_group_members(gid)] == [1]
+
+def test_sync_group_with_map_with_server_paths():
+    """
+    Should not update contacts whose paths differ only in order and server attributes
+    Should count them only if enabled
+    """
+    gid = 123
+    data = [create_everbridge_contacts([1, 2], True)]
+    for contact in data[0]:
+        contact['paths'].reverse()
+        for seq, path in enumerate(contact['paths']):
+            path['id'] = seq
+    ever = create_everbridge_mock(data)
+    azure = create_azure_mock('GROUP1', [1, 2])
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+    app = Synchronizer(azure, ever)
+    rslt = app.sync_group_with_map(AdContactMap('gid_ad', azure.get_all_group_members_map('gid_ad')), itr_ev)
+    ever.upsert_contacts.assert_not_called()
+    assert rslt['updated_contacts'] == 0
+    assert 'suppressed_updates' not in rslt
+    app.set_report_suppressed_updates(True)
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+    rslt = app.sync_group_with_map(AdContactMap('gid_ad', azure.get_all_group_members_map('gid_ad')), itr_ev)
+    ever.upsert_contacts.assert_not_called()
+    assert rslt['suppressed_updates'] == 2
+
+def test_run_with_map_with_shared_contacts():
+    """
+    Should upsert each contact at most once and add contacts found in other groups by id
+    """
+    groups = {'gid1': ('GROUP1', [1, 5]), 'gid2': ('GROUP2', [1, 5])}
+    ev_groups = {'GROUP1': 1, 'GROUP2': 2, 'PARENT': 9}
+    ev_members = {1: [1], 2: [], 9: []}
+    azure = create_azure_mock('', [])
+    azure.get_group_name = MagicMock(side_effect=lambda gid: groups[gid][0])
+    azure.iter_group_members = MagicMock(side_effect=lambda gid: iter(create_azure_contacts(groups[gid][1])))
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    ever.get_group_id_by_name = MagicMock(side_effect=lambda name: ev_groups[name])
+    ever.get_group_members_page = MagicMock(side_effect=lambda gid, page: {
+        'totalPageCount': 1, 'data': create_everbridge_contacts(ev_members[gid], True)})
+    app = Synchronizer(azure, ever)
+    rslt = app.run_with_map(list(groups), [], 'PARENT')
+    ever.upsert_contacts.assert_called_once()
+    assert [con['externalId'] for con in ever.upsert_contacts.call_args[0][0]] == ['aaa.bbb0005@xxx.com']
+    ever.add_members_to_group.assert_any_call(1, ['aaa.bbb0005@xxx.com'], 'externalId')
+    ever.add_members_to_group.assert_any_call(2, ['aaa.bbb0005@xxx.com'], 'externalId')
+    ever.add_members_to_group.assert_any_call(2, [1])
+    assert rslt['GROUP1']['inserted_contacts'] == 1
+    assert rslt['GROUP2']['added_members'] == 2
+    assert rslt['GROUP2']['updated_contacts'] == 0
+
+def test_run_with_map_with_org_index():
+    """
+    Should take Everbridge group members from the org contacts instead of paging each group
+    """
+    groups = {'gid1': ('GROUP1', [1, 2]), 'gid2': ('GROUP2', [2, 3])}
+    ev_groups = {'GROUP1': 1, 'GROUP2': 2, 'PARENT': 9}
+    org = create_everbridge_contacts([1, 2, 3, 4], True)
+    modify_everbridge_data(org, [1], 'groups', [1])
+    modify_everbridge_data(org, [2], 'groups', [1, 2])
+    modify_everbridge_data(org, [3], 'groups', [5])
+    modify_everbridge_data(org, [4], 'groups', [2])
+    azure = create_azure_mock('', [])
+    azure.get_group_name = MagicMock(side_effect=lambda gid: groups[gid][0])
+    azure.iter_group_members = MagicMock(side_effect=lambda gid: iter(create_azure_contacts(groups[gid][1])))
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    ever.get_group_id_by_name = MagicMock(side_effect=lambda name: ev_groups[name])
+    ever.get_group_members_page = MagicMock()
+    ever.get_contact_count = MagicMock(side_effect=lambda gid=None: {None: 4, 1: 2, 2: 2}[gid])
+    ever.get_contacts_page = MagicMock(return_value={'totalPageCount': 1, 'data': org})
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=[org[3]])
+    app = Synchronizer(azure, ever)
+    app.set_org_index_mode('auto')
+    rslt = app.run_with_map(list(groups), [], 'PARENT')
+    ever.get_group_members_page.assert_not_called()
+    ever.get_contacts_page.assert_called_once_with(1)
+    ever.upsert_contacts.assert_not_called()
+    # Contact 3 exists in the org; added to GROUP2 by id
+    ever.add_members_to_group.assert_called_once_with(2, [3])
+    ever.delete_members_from_group.assert_called_once_with(2, [4])
+    # The groups of the deleted contact are read again before deleting it from the org
+    ever.get_contacts_by_external_id_list.assert_called_once_with(['aaa.bbb0004@xxx.com'])
+    ever.delete_contacts.assert_called_once_with([4])
+    assert rslt['GROUP1']['everbridge_count'] == 2
+    assert rslt['GROUP2']['added_members'] == 1
+    assert app.org_index is None
+
+def test_run_with_map_with_org_index_moved_contact():
+    """
+    Should not delete from the org the contact moved to another group earlier in the run
+    """
+    groups = {'gid1': ('GROUP1', [1]), 'gid2': ('GROUP2', [])}
+    ev_groups = {'GROUP1': 1, 'GROUP2': 2, 'PARENT': 9}
+    org = create_everbridge_contacts([1], True)
+    modify_everbridge_data(org, [1], 'groups', [2])
+    azure = create_azure_mock('', [])
+    azure.get_group_name = MagicMock(side_effect=lambda gid: groups[gid][0])
+    azure.iter_group_members = MagicMock(side_effect=lambda gid: iter(create_azure_contacts(groups[gid][1])))
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    ever.get_group_id_by_name = MagicMock(side_effect=lambda name: ev_groups[name])
+    ever.get_contacts_page = MagicMock(return_value={'totalPageCount': 1, 'data': org})
+    ever.get_contacts_by_external_id_list = MagicMock(return_value=[dict(org[0], groups=[2, 1])])
+    app = Synchronizer(azure, ever)
+    app.set_org_index_mode('always')
+    app.run_with_map(list(groups), [], 'PARENT')
+    # GROUP1 adds the contact, then GROUP2 removes it
+    ever.add_members_to_group.assert_called_once_with(1, [1])
+    ever.delete_members_from_group.assert_called_once_with(2, [1])
+    ever.delete_contacts.assert_not_called()
+
+def test_run_with_map_without_org_index():
+    """
+    Should page each group if the groups have fewer members than the org
+    """
+    azure = create_azure_mock('GROUP1', [1])
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([create_everbridge_contacts([1], True)])
+    ever.get_contact_count = MagicMock(side_effect=lambda gid=None: {None: 100, 123: 1}[gid])
+    ever.get_contacts_page = MagicMock()
+    app = Synchronizer(azure, ever)
+    app.set_org_index_mode('auto')
+    app.run_with_map(['gid1'], [], 'PARENT')
+    ever.get_contacts_page.assert_not_called()
+
+def test_sync_group_with_map_with_pipeline():
+    """
+    Should write changes in batches while diffing and report the same as without pipeline
+    """
+    gid = 123
+    data = [create_everbridge_contacts([1, 2, 3, 5, 8, 9], True)]
+    modify_everbridge_data(data[0], [1, 2], 'firstName', 'CHANGED')
+    modify_everbridge_data(data[0], [3, 8, 9], 'groups', [gid])
+    modify_everbridge_data(data[0], [5], 'groups', [gid, 456])
+    reports = []
+    for batch_size in [None, 2]:
+        ever = create_everbridge_mock(data)
+        azure = create_azure_mock('GROUP1', [1, 2, 4, 6, 7])
+        app = Synchronizer(azure, ever)
+        if batch_size:
+            app.set_pipeline(batch_size)
+        itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+        admap = AdContactMap('gid_ad', azure.get_all_group_members_map('gid_ad'))
+        reports.append(app.sync_group_with_map(admap, itr_ev))
+    assert reports[0] == reports[1]
+    assert reports[1]['removed_members'] == 4
+    assert reports[1]['deleted_contacts'] == 3
+    assert reports[1]['added_members'] == 3
+    # Batches of 2
+    assert [len(call[0][1]) for call in ever.delete_members_from_group.call_args_list] == [2, 2]
+    assert ever.upsert_contacts.call_count == 3
+    assert [len(call[0][1]) for call in ever.add_members_to_group.call_args_list] == [2, 1]
+
+def test_sync_group_with_map_with_pipeline_keeps_member_pages():
+    """
+    Should read every Everbridge member page before removing and adding members
+    """
+    gid = 123
+    contacts = create_everbridge_contacts(list(range(3, 21)), True)
+    ever, members = create_changing_everbridge_mock(contacts, 2)
+    azure = create_azure_mock('GROUP1', list(range(2, 21, 2)))
+    app = Synchronizer(azure, ever)
+    app.set_pipeline(2)
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid, 1)
+    itr_ev.pagesize = 2
+    admap = AdContactMap('gid_ad', azure.get_all_group_members_map('gid_ad'))
+    rslt = app.sync_group_with_map(admap, itr_ev)
+    assert rslt['everbridge_count'] == 18
+    assert rslt['removed_members'] == 9
+    assert rslt['added_members'] == 1
+    expected = [con['externalId'] for con in create_everbridge_contacts(list(range(2, 21, 2)))]
+    assert sorted(con['externalId'] for con in members) == expected
+
+def test_sync_group_fully_downloads_concurrently():
+    """
+    Should download AD members while Everbridge members are being downloaded
+    """
+    gid = 123
+    ev_started = threading.Event()
+    azure = create_azure_mock('GROUP1', [1, 2])
+    get_map = azure.get_all_group_members_map
+
+    def get_all_group_members_map(gid_ad, registry=None):
+        # Blocks until Everbridge download starts; would time out if run one after the other
+        assert ev_started.wait(2)
+        return get_map(gid_ad, registry)
+
+    azure.get_all_group_members_map = MagicMock(side_effect=get_all_group_members_map)
+    ever = create_everbridge_mock([])
+    get_page = create_get_page([create_everbridge_contacts([1, 2], True)])
+
+    def get_group_members_page(group_id, page=1):
+        ev_started.set()
+        return get_page(group_id, page)
+
+    ever.get_group_members_page = MagicMock(side_effect=get_group_members_page)
+    app = Synchronizer(azure, ever)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    assert rslt['azure_count'] == 2
+    assert rslt['everbridge_count'] == 2
+    assert rslt['updated_contacts'] == 0
+
+def test_sync_group_fully_stops_download_on_error():
+    """
+    Should stop reading Everbridge pages ahead if the AD download fails
+    """
+    gid = 123
+    azure = create_azure_mock('GROUP1', [1, 2])
+    azure.get_all_group_members_map = MagicMock(side_effect=AzureException('Failed'))
+    ever = create_everbridge_mock([create_everbridge_contacts([i], True) for i in range(1, 4)])
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+    app = Synchronizer(azure, ever)
+    app._create_everbridge_iterator = MagicMock(return_value=itr_ev)
+    with pytest.raises(AzureException):
+        app._sync_group_fully('gid_ad', gid)
+    assert itr_ev.executor is None
+    assert not itr_ev.pending
+
+def create_streaming_azure_mock(ids):
+    """
+    Creates Azure API mock that sorts group members on disk in runs of 2
+    """
+    azure = create_azure_mock('GROUP1', ids)
+    azure.iter_sorted_group_members = MagicMock(
+        side_effect=lambda gid, run_size: Azure.iter_sorted_group_members(azure, gid, 2))
+    return azure
+
+def test_sync_group_streaming():
+    """
+    Should write changes while merging and report the same as without streaming
+    """
+    gid = 123
+    data = [create_everbridge_contacts([1, 2, 3, 5, 8, 9], True)]
+    modify_everbridge_data(data[0], [1, 2], 'firstName', 'CHANGED')
+    modify_everbridge_data(data[0], [3, 8, 9], 'groups', [gid])
+    modify_everbridge_data(data[0], [5], 'groups', [gid, 456])
+    reports = []
+    for streaming in [False, True]:
+        ever = create_everbridge_mock(data)
+        azure = create_streaming_azure_mock([7, 6, 4, 2, 1])
+        azure.get_sorted_group_members = MagicMock(return_value=create_azure_contacts([1, 2, 4, 6, 7]))
+        app = Synchronizer(azure, ever)
+        app.set_pipeline(2)
+        itr_ad = AzureGroupMemberIterator(azure, 'gid_ad', 1000 if streaming else None)
+        itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+        reports.append(app.sync_group(itr_ad, itr_ev, streaming))
+    assert reports[0] == reports[1]
+    assert reports[1]['updated_contacts'] == 2
+    assert reports[1]['inserted_contacts'] == 3
+    assert reports[1]['removed_members'] == 4
+    assert reports[1]['deleted_contacts'] == 3
+    assert reports[1]['added_members'] == 3
+    # Batches of 2
+    assert [len(call[0][1]) for call in ever.delete_members_from_group.call_args_list] == [2, 2]
+    assert [len(call[0][1]) for call in ever.add_members_to_group.call_args_list] == [2, 1]
+
+def test_sync_group_streaming_ignores_case():
+    """
+    Should match AD members and Everbridge members regardless of the case
+    """
+    gid = 123
+    data = [create_everbridge_contacts([1, 2, 3], True)]
+    data[0][1]['externalId'] = 'AAA.BBB0002@xxx.com'
+    ever = create_everbridge_mock(data)
+    azure = create_streaming_azure_mock([3, 2, 1])
+    app = Synchronizer(azure, ever)
+    app.set_pipeline(2)
+    itr_ad = AzureGroupMemberIterator(azure, 'gid_ad', 1000)
+    rslt = app.sync_group(itr_ad, EverbridgeGroupMemberIterator(ever, gid), True)
+    assert rslt['inserted_contacts'] == 0
+    assert rslt['removed_members'] == 0
+    ever.delete_members_from_group.assert_not_called()
+
+def test_sync_group_streaming_with_unordered_members():
+    """
+    Should sync in memory without removing members if Everbridge members are not ordered
+    """
+    gid = 123
+    ever = create_everbridge_mock([create_everbridge_contacts([3, 1, 2], True)])
+    azure = create_streaming_azure_mock([3, 2, 1])
+    azure.get_group_member_count = MagicMock(return_value=3)
+    app = Synchronizer(azure, ever)
+    app.set_pipeline(2)
+    app.set_streaming(2)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    assert rslt['everbridge_count'] == 3
+    assert rslt['inserted_contacts'] == 0
+    assert rslt['removed_members'] == 0
+    ever.delete_members_from_group.assert_not_called()
+    ever.add_members_to_group.assert_not_called()
+
+def test_sync_group_streaming_keeps_member_pages():
+    """
+    Should read every Everbridge member page before removing and adding members
+    """
+    gid = 123
+    ever, members = create_changing_everbridge_mock(create_everbridge_contacts(list(range(3, 21)), True), 2)
+    azure = create_streaming_azure_mock(list(range(2, 21, 2)))
+    app = Synchronizer(azure, ever)
+    app.set_pipeline(2)
+    itr_ad = AzureGroupMemberIterator(azure, 'gid_ad', 1000)
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid, 1)
+    itr_ev.pagesize = 2
+    rslt = app.sync_group(itr_ad, itr_ev, True)
+    assert rslt['everbridge_count'] == 18
+    assert rslt['removed_members'] == 9
+    assert rslt['added_members'] == 1
+    expected = [con['externalId'] for con in create_everbridge_contacts(list(range(2, 21, 2)))]
+    assert sorted(con['externalId'] for con in members) == expected
+
+def test_sync_group_fully_streams_huge_group():
+    """
+    Should stream AD group with more members than the threshold and reset its delta state
+    """
+    gid = 123
+    azure = create_streaming_azure_mock([3, 1, 2])
+    azure.get_group_member_count = MagicMock(return_value=3)
+    azure.get_all_group_members_map = MagicMock()
+    azure.get_latest_delta_link = MagicMock()
+    ever = create_everbridge_mock([create_everbridge_contacts([1, 2], True)])
+    app = Synchronizer(azure, ever)
+    app.set_streaming(2)
+    delta_state = MagicMock()
+    app.set_delta_state(delta_state)
+    rslt = app._sync_group_fully('gid_ad', gid)
+    azure.get_all_group_members_map.assert_not_called()
+    azure.get_latest_delta_link.assert_not_called()
+    delta_state.reset.assert_called_with('gid_ad')
+    ever.add_members_to_group.assert_called_with(gid, ['aaa.bbb0003@xxx.com'], 'externalId')
+    assert rslt['azure_count'] == 3
+    assert rslt['everbridge_count'] == 2
+    assert rslt['inserted_contacts'] == 1
+    assert rslt['added_members'] == 1
+
+def test_sync_group_fully_below_streaming_threshold():
+    """
+    Should load AD group with as many members as the threshold in memory
+    """
+    azure = create_azure_mock('GROUP1', [1, 2])
+    azure.get_group_member_count = MagicMock(return_value=2)
+    ever = create_everbridge_mock([create_everbridge_contacts([1, 2], True)])
+    app = Synchronizer(azure, ever)
+    app.set_streaming(2)
+    rslt = app._sync_group_fully('gid_ad', 123)
+    azure.iter_group_members.assert_called_with('gid_ad')
+    assert rslt['updated_contacts'] == 0
+
+def test_run_with_map_after_deadline():
+    """
+    Should skip all the groups and return a partial report
+    """
+    azure = create_azure_mock('GROUP1', [1, 2])
+    ever = create_everbridge_mock([])
+    app = Synchronizer(azure, ever)
+    app.set_deadline(time.time() + 30, 60)
+    rslt = app.run_with_map(['gid1', 'gid2'], [], 'PARENT')
+    assert rslt['partial']
+    assert rslt['skipped_groups'] == ['gid1', 'gid2']
+    assert rslt['skipped_shared_mailboxes']
+    assert 'rate_control' in rslt
+    azure.get_group_name.assert_not_called()
+    ever.upsert_contacts.assert_not_called()
+
+def test_set_deadline_to_clients():
+    """
+    Should stop the clients from retrying throttled requests after the deadline
+    """
+    deadline = time.time() + 30
+    azure = create_azure_mock('GROUP1', [1, 2])
+    ever = create_everbridge_mock([])
+    app = Synchronizer(azure, ever)
+    app.set_deadline(deadline)
+    runner = AsyncRunner(everbridge=MagicMock(), azure=MagicMock())
+    app.set_async_runner(runner)
+    assert azure.rate_control.deadline == deadline
+    assert ever.rate_control.deadline == deadline
+    runner.everbridge.set_deadline.assert_called_with(deadline)
+    runner.azure.set_deadline.assert_called_with(deadline)
+
+def test_run_with_map_near_deadline():
+    """
+    Should finish the group in progress and skip the rest
+    """
+    azure = create_azure_mock('GROUP1', [1, 2])
+    azure.get_all_group_members_map = MagicMock(side_effect=lambda gid, registry=None: {
+        con['userPrincipalName']: con for con in create_azure_contacts([1, 2])})
+    ever = create_everbridge_mock([create_everbridge_contacts([1], True)])
+    app = Synchronizer(azure, ever)
+    app._is_near_deadline = MagicMock(side_effect=[False, True, True])
+    rslt = app.run_with_map(['gid1', 'gid2'], [], 'PARENT')
+    assert rslt['GROUP1']['inserted_contacts'] == 1
+    assert rslt['skipped_groups'] == ['gid2']
+    assert rslt['skipped_shared_mailboxes']
+    ever.upsert_contacts.assert_called_once()
+
+def test_run_with_map_resumes_interrupted_run(tmp_path):
+    """
+    Should skip the groups finished in the interrupted run and remove the journal at the end
+    """
+    filename = tmp_path / 'journal'
+    journal = CheckpointJournal(str(filename)).open()
+    journal.finish_group('gid1', 'GROUP1', {'inserted_contacts': 1})
+    journal.close()
+    azure = create_azure_mock('GROUP2', [1])
+    azure.get_all_group_members_map = MagicMock(side_effect=lambda gid, registry=None: {
+        con['userPrincipalName']: con for con in create_azure_contacts([1])})
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([create_everbridge_contacts([1], True)])
+    app = Synchronizer(azure, ever)
+    app.set_journal(CheckpointJournal(str(filename)))
+    rslt = app.run_with_map(['gid1', 'gid2'], [], 'PARENT')
+    assert rslt['GROUP1'] == {'inserted_contacts': 1, 'resumed': True}
+    assert 'resumed' not in rslt['GROUP2']
+    assert azure.get_group_name.call_count == 1
+    assert not filename.exists()
+
+def test_sync_group_with_map_skips_committed_batches(tmp_path):
+    """
+    Should resend upserts but not add the members added before the run was interrupted
+    """
+    gid = 123
+    filename = str(tmp_path / 'journal')
+    journal = CheckpointJournal(filename).open()
+    journal.commit_batch(gid, CheckpointJournal.ADD_MEMBERS, ['aaa.bbb0001@xxx.com', 'aaa.bbb0002@xxx.com'])
+    journal.close()
+    azure = create_azure_mock('GROUP1', [1, 2, 3])
+    ever = create_everbridge_mock([create_everbridge_contacts([], True)])
+    admap = AdContactMap(gid, azure.get_all_group_members_map(gid))
+    itr_ev = EverbridgeGroupMemberIterator(ever, gid)
+    app = Synchronizer(azure, ever)
+    app.set_journal(CheckpointJournal(filename).open())
+    app.sync_group_with_map(admap, itr_ev)
+    ever.upsert_contacts.assert_called_with(create_everbridge_contacts([1, 2, 3], False))
+    ever.add_members_to_group.assert_called_with(gid, ['aaa.bbb0003@xxx.com'], 'externalId')
+    app.journal.close()
+
+def test_sync_group_with_map_commits_each_member_batch(tmp_path, monkeypatch):
+    """
+    Should record each member batch once written so that an interrupted run resends only the rest
+    """
+    gid = 123
+    monkeypatch.setattr(Synchronizer, 'MEMBER_BATCH_SIZE', 2)
+    filename = str(tmp_path / 'journal')
+    azure = create_azure_mock('GROUP1', [1, 2, 3])
+    ever = create_everbridge_mock([create_everbridge_contacts([], True)])
+    ever.add_members_to_group = MagicMock(side_effect=[{'code': 100}, EverbridgeException()])
+    app = Synchronizer(azure, ever)
+    app.set_journal(CheckpointJournal(filename).open())
+    with pytest.raises(EverbridgeException):
+        app.sync_group_with_map(AdContactMap(gid, azure.get_all_group_members_map(gid)),
+                                EverbridgeGroupMemberIterator(ever, gid))
+    app.journal.close()
+    ever = create_everbridge_mock([create_everbridge_contacts([], True)])
+    app = Synchronizer(azure, ever)
+    app.set_journal(CheckpointJournal(filename).open())
+    app.sync_group_with_map(AdContactMap(gid, azure.get_all_group_members_map(gid)),
+                            EverbridgeGroupMemberIterator(ever, gid))
+    ever.add_members_to_group.assert_called_once_with(gid, ['aaa.bbb0003@xxx.com'], 'externalId')
+    app.journal.close()
+
+def test_run_with_map_with_async_runner():
+    """
+    Should fetch Everbridge member pages with the async client on the loop of AsyncRunner
+    """
+    azure = create_azure_mock('GROUP1', [1, 2])
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    ever.get_group_members_page = MagicMock()
+    async_ever = AsyncEverbridgeMock(create_get_page([create_everbridge_contacts([1, 2], True)]))
+    runner = AsyncRunner(everbridge=async_ever)
+    app = Synchronizer(azure, ever)
+    app.set_async_runner(runner)
+    rslt = app.run_with_map(['gid1'], [], 'PARENT')
+    ever.get_group_members_page.assert_not_called()
+    assert (123, 1) in async_ever.requested
+    assert async_ever.threads == {'AsyncRunner'}
+    assert rslt['GROUP1']['everbridge_count'] == 2
+    assert rslt['GROUP1']['updated_contacts'] == 0
+    assert rslt['rate_control']['async_everbridge'] == {}
+    assert runner.loop is None
+
+def test_run_with_map_writes_with_async_runner():
+    """
+    Should write contacts and members with the async client on the loop of AsyncRunner
+    """
+    gid = 123
+    azure = create_azure_mock('GROUP1', [1, 3])
+    azure.get_users_with_filters_map = MagicMock(return_value={})
+    ever = create_everbridge_mock([])
+    data = [create_everbridge_contacts([1, 2], True)]
+    modify_everbridge_data(data[0], [2], 'groups', [gid])
+    async_ever = AsyncEverbridgeMock(create_get_page(data))
+    app = Synchronizer(azure, ever)
+    app.set_async_runner(AsyncRunner(everbridge=async_ever))
+    rslt = app.run_with_map(['gid1'], [], 'PARENT')
+    ever.upsert_contacts.assert_not_called()
+    ever.delete_members_from_group.assert_not_called()
+    ever.add_members_to_group.assert_not_called()
+    methods = [call[0] for call in async_ever.calls]
+    assert 'upsert_contacts' in methods
+    assert ('delete_members_from_group', gid, [2]) in async_ever.calls
+    assert ('delete_contacts', [2]) in async_ever.calls
+    assert ('add_members_to_group', gid, ['aaa.bbb0003@xxx.com'], 'externalId') in async_ever.calls
+    assert async_ever.threads == {'AsyncRunner'}
+    assert rslt['GROUP1']['removed_members'] == 1
+    assert rslt['GROUP1']['added_members'] == 1
+
+def test_run_with_map_with_async_azure():
+    """
+    Should fetch AD members and shared mailboxes with the async client on the loop of AsyncRunner
+    """
+    azure = create_azure_mock('GROUP1', [])
+    azure.get_all_group_members_map = MagicMock()
+    azure.get_users_with_filters_map = MagicMock()
+    ever = create_everbridge_mock([create_everbridge_contacts([1, 2], True)])
+    async_azure = AsyncAzureMock([1, 2])
+    app = Synchronizer(azure, ever)
+    app.set_async_runner(AsyncRunner(azure=async_azure))
+    rslt = app.run_with_map(['gid1'], ['shared@xxx.com'], 'PARENT')
+    azure.get_all_group_members_map.assert_not_called()
+    azure.get_users_with_filters_map.assert_not_called()
+    assert async_azure.threads == {'AsyncRunner'}
+    assert rslt['GROUP1']['azure_count'] == 2
+    assert rslt['GROUP1']['updated_contacts'] == 0
+    assert rslt['rate_control']['async_azure'] == {}